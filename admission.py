@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+下载目录的准入控制
+
+每个下载开始前按预估大小预留磁盘空间，预留总量不能超过预算，且要给磁盘保留最小剩余空间；
+同时限制全局和每个客户端的并发下载数。放不下的请求排队等待，
+多个客户端同时排队时轮流放行，单个客户端的大量请求不会挤占其他客户端
+"""
+import logging
+import shutil
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('youtube.admission')
+
+# 排队期间重新检查磁盘剩余空间的间隔（秒），缓存淘汰等外部变化不会触发通知
+RECHECK_INTERVAL = 1.0
+
+
+class AdmissionRejected(Exception):
+    """
+    无法在等待时间内获得下载资源
+    retry_after 为建议的重试等待秒数，请求本身超出预算时为 None（重试也不会成功）
+    """
+
+    def __init__(self, msg, retry_after=None):
+        super().__init__(msg)
+        self.msg = msg
+        self.retry_after = retry_after
+
+    @property
+    def errcode(self):
+        # 503: 暂时没有资源，稍后重试；507: 文件超出预算，重试也无法下载
+        return 503 if self.retry_after else 507
+
+
+class Reservation:
+    """error 为排队期间被拒绝的原因（磁盘剩余空间减少到永远放不下）"""
+    __slots__ = ('client', 'nbytes', 'granted', 'released', 'error', '_controller')
+
+    def __init__(self, controller, client, nbytes):
+        self._controller = controller
+        self.client = client
+        self.nbytes = nbytes
+        self.granted = False
+        self.released = False
+        self.error = None
+
+    def release(self):
+        self._controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    path: 下载目录，用于读取磁盘剩余空间
+    budget_bytes: 所有下载预留空间的总预算，0 表示只按磁盘剩余空间限制
+    min_free_bytes: 预留后磁盘至少保留的剩余空间
+    max_active: 全局并发下载数，0 表示不限
+    per_client: 每个客户端的并发下载数，0 表示不限
+    max_waiting: 最多排队的请求数，超出时直接拒绝
+    retry_after: 拒绝时建议客户端等待的秒数
+    """
+
+    def __init__(self, path, budget_bytes=0, min_free_bytes=0, max_active=0, per_client=0,
+                 max_waiting=64, retry_after=30):
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.max_active = max_active
+        self.per_client = per_client
+        self.max_waiting = max_waiting
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        # 客户端 -> 排队中的预留，_turns 为轮转顺序
+        self._waiting = {}
+        self._turns = deque()
+        self._active = {}
+        self.reserved_bytes = 0
+        self.active = 0
+        self.rejected = 0
+
+    def _disk_free(self):
+        try:
+            return shutil.disk_usage(self.path).free
+        except OSError:
+            return None
+
+    def _capacity(self, disk_free):
+        """所有进行中的下载结束后，单个下载最多能预留的字节数，没有限制时为 None"""
+        limits = []
+        if self.budget_bytes:
+            limits.append(self.budget_bytes)
+        if disk_free is not None:
+            # 进行中的下载写入的空间不会超过它们的预留，结束后最多释放这么多
+            limits.append(max(disk_free + self.reserved_bytes - self.min_free_bytes, 0))
+        return min(limits) if limits else None
+
+    def capacity(self):
+        with self._cond:
+            return self._capacity(self._disk_free())
+
+    def _too_large(self, nbytes, disk_free):
+        """请求超出预算或磁盘可用空间，等待也不会放行时返回 AdmissionRejected，否则返回 None"""
+        if self.budget_bytes and nbytes > self.budget_bytes:
+            return AdmissionRejected(
+                f"预计大小 {nbytes/1024/1024:.0f}MB 超出下载空间预算 {self.budget_bytes/1024/1024:.0f}MB")
+        capacity = self._capacity(disk_free)
+        if capacity is not None and nbytes > capacity:
+            return AdmissionRejected(
+                f"预计大小 {nbytes/1024/1024:.0f}MB 超出磁盘可用空间 {capacity/1024/1024:.0f}MB")
+        return None
+
+    def _fits(self, nbytes, disk_free):
+        if self.max_active and self.active >= self.max_active:
+            return False
+        if self.budget_bytes and self.reserved_bytes + nbytes > self.budget_bytes:
+            return False
+        # 已预留但尚未写入的空间按全部未写入计算，宁可保守；不写磁盘的预留（边下载边发送）只占名额
+        if nbytes and disk_free is not None and disk_free - self.reserved_bytes - nbytes < self.min_free_bytes:
+            return False
+        return True
+
+    def _dispatch(self):
+        """按客户端轮转放行排队的预留，在持有锁时调用"""
+        disk_free = None
+        checked = False
+        changed = False
+        skipped = 0
+        while self._turns and skipped < len(self._turns):
+            client = self._turns[0]
+            queue = self._waiting[client]
+            if self.per_client and self._active.get(client, 0) >= self.per_client:
+                # 该客户端已达并发上限，让给下一个客户端
+                self._turns.rotate(-1)
+                skipped += 1
+                continue
+            if not checked:
+                disk_free = self._disk_free()
+                checked = True
+            reservation = queue[0]
+            if not self._fits(reservation.nbytes, disk_free):
+                error = self._too_large(reservation.nbytes, disk_free)
+                if error is None:
+                    # 队首等进行中的下载结束后就能放下，不让后面的小请求插队，避免大文件一直等不到空间
+                    break
+                # 排队期间磁盘剩余空间减少，队首永远放不下，拒绝它而不是挡住后面所有请求
+                queue.popleft()
+                reservation.error = error
+                self.rejected += 1
+                logger.warning(f"拒绝排队中的下载 - 客户端: {client} | 原因: {error.msg}")
+                changed = True
+            else:
+                queue.popleft()
+                self._grant(reservation)
+                changed = True
+            skipped = 0
+            self._turns.popleft()
+            if queue:
+                self._turns.append(client)
+            else:
+                del self._waiting[client]
+        if changed:
+            self._cond.notify_all()
+
+    def _grant(self, reservation):
+        reservation.granted = True
+        self.reserved_bytes += reservation.nbytes
+        self.active += 1
+        self._active[reservation.client] = self._active.get(reservation.client, 0) + 1
+
+    def _remove_waiting(self, reservation):
+        queue = self._waiting.get(reservation.client)
+        if queue is None:
+            return
+        try:
+            queue.remove(reservation)
+        except ValueError:
+            return
+        if not queue:
+            del self._waiting[reservation.client]
+            self._turns.remove(reservation.client)
+
+    def acquire(self, client, nbytes, timeout=None):
+        """
+        预留 nbytes 字节和一个下载名额，返回 Reservation，使用完毕后调用 release
+        timeout 为最长排队时间（秒），None 表示一直等待；超时或队列已满时抛出 AdmissionRejected，
+        超出预算或磁盘可用空间时立即抛出不带 retry_after 的 AdmissionRejected
+        """
+        reservation = Reservation(self, client, nbytes)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            # 超出预算或磁盘可用空间的请求直接拒绝，排队只会挡住其他请求
+            error = self._too_large(nbytes, self._disk_free())
+            if error is not None:
+                self.rejected += 1
+                raise error
+            waiting = sum(len(q) for q in self._waiting.values())
+            if waiting >= self.max_waiting:
+                self.rejected += 1
+                raise AdmissionRejected(f"排队的下载请求已满 ({waiting}/{self.max_waiting})", self.retry_after)
+            if client not in self._waiting:
+                self._waiting[client] = deque()
+                self._turns.append(client)
+            self._waiting[client].append(reservation)
+
+            start = time.monotonic()
+            logged = False
+            while True:
+                self._dispatch()
+                if reservation.granted:
+                    break
+                if reservation.error is not None:
+                    raise reservation.error
+                if not logged:
+                    logger.info(f"下载排队等待资源 - 客户端: {client} | 预留: {nbytes/1024/1024:.1f}MB | "
+                                f"已预留: {self.reserved_bytes/1024/1024:.1f}MB | 进行中: {self.active}")
+                    logged = True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._remove_waiting(reservation)
+                    self.rejected += 1
+                    # 自己离开队列后，后面的请求可能可以放行
+                    self._cond.notify_all()
+                    raise AdmissionRejected("下载资源不足，请稍后重试", self.retry_after)
+                self._cond.wait(RECHECK_INTERVAL if remaining is None else min(remaining, RECHECK_INTERVAL))
+
+        if logged:
+            logger.info(f"下载获得资源 - 客户端: {client} | 等待: {time.monotonic() - start:.2f}秒")
+        return reservation
+
+    def _release(self, reservation):
+        with self._cond:
+            if reservation.released or not reservation.granted:
+                return
+            reservation.released = True
+            self.reserved_bytes -= reservation.nbytes
+            self.active -= 1
+            count = self._active.get(reservation.client, 0) - 1
+            if count > 0:
+                self._active[reservation.client] = count
+            else:
+                self._active.pop(reservation.client, None)
+            self._cond.notify_all()
+
+    def waiting(self):
+        with self._cond:
+            return sum(len(q) for q in self._waiting.values())
+
+    def stats(self):
+        with self._cond:
+            return {
+                'reserved_bytes': self.reserved_bytes,
+                'budget_bytes': self.budget_bytes,
+                'disk_free': self._disk_free(),
+                'active': self.active,
+                'waiting': sum(len(q) for q in self._waiting.values()),
+                'rejected': self.rejected,
+                'clients': dict(self._active),
+            }
@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+异步服务入口：Quart + hypercorn
+
+路由是协程，yt-dlp 的解析和下载、文件读取都在有界线程池中执行；等待下载的请求和慢速客户端只占用一个协程，
+不占用线程，单个进程可以保持数千个空闲或慢速连接。
+缓存、下载合并、准入控制、后台任务与 main.py 共用同一套实现，一个进程只运行其中一个入口
+
+python async_app.py            # hypercorn，监听地址等配置与 main.py 相同
+python async_app.py --debug    # Quart 开发服务器
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import CONTENT_TYPE_LATEST
+from hypercorn.middleware import ProxyFixMiddleware
+from quart import Quart, request, jsonify, g, Response, url_for
+
+import metrics
+import log_config
+import twitter
+from admission import AdmissionRejected
+from delivery import file_etag, resolve_range, proxy_redirect_header
+from live_stream import select_stream_formats
+from singleflight import AsyncSingleFlight, SharedFile
+from main import (
+    CACHE_DIR, DELIVERY_MODE, X_ACCEL_PREFIX, BATCH_MAX_ITEMS,
+    MAX_DOWNLOADS, DOWNLOAD_QUEUE_SIZE, TRUSTED_PROXIES,
+    media_cache, job_manager, batch_executor, download_flights, transcode_flights,
+    DownloadFailed, generate_file, generate_live, extract_video_info,
+    batch_items, parse_batch_item, queue_playlist, resolve_batch_item, request_format_policy,
+    collect_cache_stats, collect_stats,
+    prepare_storage, worker_init, on_worker_exit, acquire_live_slot,
+    twitter_request, open_twitter_download, generate_proxy,
+    request_client, admission_rejected_response, youtube_info_response, twitter_info_response,
+    download_request, download_task, submit_job_response, job_status_response, job_result_media,
+)
+
+logger = logging.getLogger('youtube.async')
+
+# 解析视频信息、读取文件等短时间阻塞调用的线程数
+ASYNC_THREADS = int(os.environ.get('YOUTUBE_ASYNC_THREADS', 64))
+# 下载和转换任务的线程数，默认足够容纳所有进行中和排队等待准入的下载
+ASYNC_DOWNLOAD_THREADS = int(os.environ.get('YOUTUBE_ASYNC_DOWNLOAD_THREADS',
+                                            MAX_DOWNLOADS + DOWNLOAD_QUEUE_SIZE))
+
+blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_THREADS, thread_name_prefix='async')
+download_executor = ThreadPoolExecutor(max_workers=ASYNC_DOWNLOAD_THREADS, thread_name_prefix='async-download')
+
+# 相同 (视频ID, 格式) 的协程共享一个下载线程，同时与后台任务的下载合并
+async_download_flights = AsyncSingleFlight(download_flights, download_executor)
+async_transcode_flights = AsyncSingleFlight(transcode_flights, download_executor)
+
+
+async def run_blocking(fn, *args):
+    """在线程池中执行阻塞调用，复制上下文以保留请求关联ID"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, context.run, fn, *args)
+
+
+def _release_abandoned(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().release()
+
+
+async def acquire_live(client):
+    """在下载线程池中排队等待边下载边发送的名额；客户端排队时断开，之后获得的名额立即归还"""
+    context = contextvars.copy_context()
+    future = asyncio.get_running_loop().run_in_executor(download_executor, context.run, acquire_live_slot, client)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(_release_abandoned)
+        raise
+
+
+class BlockingBody:
+    """
+    在线程池中逐块读取同步生成器的异步响应体
+
+    客户端断开时 Quart 取消发送任务并调用 aclose：等正在进行的读取结束后，在线程池中关闭生成器
+    （生成器按 GeneratorExit 记录中断并结束传输），然后执行 on_close；
+    响应头发送前就断开、生成器从未开始时同样会执行 on_close
+    """
+
+    def __init__(self, chunks, executor, on_close=None):
+        self._chunks = chunks
+        self._executor = executor
+        self._on_close = on_close
+        self._pending = None
+        self._closed = False
+        # 生成器中的日志带有请求关联ID；读取依次进行，同一时间只有一个线程进入该上下文
+        self._context = contextvars.copy_context()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        self._pending = self._executor.submit(self._context.run, next, self._chunks, None)
+        chunk = await asyncio.wrap_future(self._pending)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._pending is None:
+            self._executor.submit(self._context.run, self._finish)
+        else:
+            # 生成器正在其他线程中执行时不能关闭
+            self._pending.add_done_callback(lambda _: self._executor.submit(self._context.run, self._finish))
+
+    def _finish(self):
+        try:
+            self._chunks.close()
+        finally:
+            if self._on_close:
+                self._on_close()
+
+
+app = Quart(__name__)
+# 大文件的发送时间不受限制，慢速客户端由 hypercorn 的 keep-alive 和发送缓冲控制
+app.config['RESPONSE_TIMEOUT'] = None
+if TRUSTED_PROXIES:
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, mode='legacy', trusted_hops=TRUSTED_PROXIES)
+
+
+@app.before_request
+async def before_request():
+    g.start_time = time.time()
+    # 每个请求在独立的任务中处理，上下文变量不会影响其他请求
+    g.request_id = log_config.request_id_from_header(request.headers.get('X-Request-ID'))
+    log_config.request_id_var.set(g.request_id)
+
+
+@app.after_request
+async def after_request(response):
+    if hasattr(g, 'request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    # 文件和 NDJSON 是流式响应，只对 JSON 响应记录处理时间
+    if hasattr(g, 'start_time') and response.is_json:
+        metrics.REQUEST_SECONDS.labels(request.endpoint or 'unknown').observe(time.time() - g.start_time)
+        errcode = ((await response.get_json(silent=True)) or {}).get('errcode')
+        if errcode:
+            metrics.ERRORS.labels(str(errcode)).inc()
+    return response
+
+
+def first_byte_observer(mode):
+    """返回记录首字节时间的回调，回调在线程池中执行，不依赖请求上下文"""
+    start_time = g.start_time
+    return lambda: metrics.TTFB_SECONDS.labels(mode).observe(time.time() - start_time)
+
+
+@app.route("/youtube")
+async def youtube_info():
+    return jsonify(await run_blocking(youtube_info_response, request.args, request.url_root))
+
+
+@app.route("/twitter")
+async def twitter_info():
+    return jsonify(await run_blocking(twitter_info_response, request.args, request.url_root))
+
+
+@app.route("/youtube/batch", methods=['POST'])
+async def youtube_batch():
+    """批量解析视频信息，结果以 NDJSON 按完成顺序逐行返回"""
+    data = await request.get_json(silent=True) or {}
+    try:
+        items = batch_items(data)
+        policy = request_format_policy(data)
+    except ValueError as e:
+        return jsonify({'errcode': 400, 'msg': str(e)})
+
+    logger.info(f"开始批量解析 - 数量: {len(items)}")
+    root_url = request.url_root
+
+    async def generate():
+        loop = asyncio.get_running_loop()
+        futures = {}
+        seen = set()
+        start_time = time.time()
+        resolved = 0
+
+        def submit(kind, url, item):
+            """返回 False 表示已达到 BATCH_MAX_ITEMS，条目没有排队"""
+            if url in seen:
+                return True
+            if len(seen) >= BATCH_MAX_ITEMS:
+                return False
+            seen.add(url)
+            # 与同步版本共用批量解析线程池
+            future = loop.run_in_executor(batch_executor, contextvars.copy_context().run, resolve_batch_item,
+                                          kind, url, policy, root_url)
+            futures[future] = (kind, url, item)
+            return True
+
+        for item in items:
+            parsed = parse_batch_item(item)
+            if parsed is None:
+                yield json.dumps({'item': item, 'errcode': 400, 'msg': "无法识别的视频ID或URL"},
+                                 ensure_ascii=False) + '\n'
+                continue
+            submit(*parsed, item)
+
+        try:
+            while futures:
+                done, _ = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    kind, url, item = futures.pop(future)
+                    result = future.result()
+                    if kind == 'playlist' and isinstance(result, list):
+                        result = queue_playlist(url, result, lambda k, u: submit(k, u, item))
+                    resolved += 1
+                    yield json.dumps({'item': item, **result}, ensure_ascii=False) + '\n'
+            logger.info(f"批量解析完成 - 数量: {resolved} | 用时: {time.time() - start_time:.2f}秒")
+        except (asyncio.CancelledError, GeneratorExit):
+            # 尚未开始的解析不再执行
+            for future in futures:
+                future.cancel()
+            logger.info(f"批量解析被客户端中断 - 已完成: {resolved}")
+            raise
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route("/cache/stats")
+async def cache_stats():
+    return jsonify(collect_cache_stats())
+
+
+async def file_response(path, video_id, on_close, filename=None, mimetype='video/mp4'):
+    """
+    与 main.file_response 相同，支持 ETag/If-None-Match、单区间 Range 和交给反向代理发送
+    文件在线程池中分块读取；on_close 在响应结束或客户端断开后调用，没有响应体时立即调用
+    """
+    filename = filename or f"{video_id}.mp4"
+    stat = await run_blocking(os.stat, path)
+    etag = file_etag(stat)
+
+    def finish(response):
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        return response
+
+    if request.if_none_match.contains_weak(etag):
+        on_close()
+        return finish(Response('', status=304))
+
+    if DELIVERY_MODE in ('x-accel', 'x-sendfile') and \
+            os.path.dirname(os.path.abspath(path)) == os.path.abspath(CACHE_DIR):
+        header = proxy_redirect_header(DELIVERY_MODE, path, CACHE_DIR, X_ACCEL_PREFIX)
+        if header:
+            logger.info(f"交由反向代理发送文件 - ID: {video_id} | {header[0]}: {header[1]}")
+            response = Response('', mimetype=mimetype)
+            response.headers[header[0]] = header[1]
+            on_close()
+            return finish(response)
+
+    status, start, length = resolve_range(request, stat.st_size, etag)
+    if status == 416:
+        on_close()
+        response = Response('', status=416)
+        response.headers['Content-Range'] = f"bytes */{stat.st_size}"
+        return finish(response)
+
+    chunks = generate_file(path, request.path, video_id, start, length, first_byte_observer('stream'))
+    response = Response(BlockingBody(chunks, blocking_executor, on_close), status=status, mimetype=mimetype)
+    response.headers['Content-Length'] = str(length)
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{start + length - 1}/{stat.st_size}"
+    return finish(response)
+
+
+async def live_stream_response(url, video_id, format_str, client=None):
+    """边下载边发送，格式无法实时封装时返回 None，名额不足时抛出 AdmissionRejected"""
+    info = await run_blocking(extract_video_info, url)
+    formats = select_stream_formats(info, format_str)
+    if not formats:
+        logger.info(f"格式不支持边下载边发送，回退到普通下载 - ID: {video_id} | 格式: {format_str}")
+        return None
+    reservation = await acquire_live(client)
+    chunks = generate_live(formats, video_id, request.path, first_byte_observer('live'))
+    response = Response(BlockingBody(chunks, blocking_executor, reservation.release), mimetype='video/mp4')
+    response.headers['Content-Disposition'] = f'attachment; filename="{video_id}.mp4"'
+    return response
+
+
+async def send_media(media, video_id, **response_options):
+    """发送 SharedFile，响应结束后释放；构造响应失败或客户端已断开时立即释放"""
+    try:
+        return await file_response(media.path, video_id, media.release, **response_options)
+    except BaseException:
+        media.release()
+        raise
+
+
+@app.route("/twitter/download")
+async def twitter_download():
+    """与 main.twitter_download 相同，CDN 响应在线程池中逐块读取"""
+    try:
+        url, tweet, max_bytes = twitter_request(request.args)
+    except ValueError as e:
+        return jsonify({'errcode': 400, 'msg': str(e)})
+    logger.info(f"开始处理推特视频下载请求 - 推文: {tweet} | URL: {url}")
+    # 在线程池中使用，先复制需要透传的请求头（按名称大小写不敏感读取）
+    forward_headers = {name: request.headers[name] for name in twitter.FORWARD_REQUEST_HEADERS
+                       if name in request.headers}
+    try:
+        kind, source = await run_blocking(open_twitter_download, url, tweet, max_bytes, forward_headers)
+    except DownloadFailed as e:
+        return jsonify({'errcode': e.errcode, 'msg': e.msg})
+
+    filename = f"{tweet}.mp4"
+    if kind == 'cache':
+        return await send_media(source, tweet, filename=filename)
+    if kind == 'live':
+        try:
+            reservation = await acquire_live(request_client(request))
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        chunks = generate_live([source.format], tweet, request.path, first_byte_observer('live'))
+        response = Response(BlockingBody(chunks, blocking_executor, reservation.release), mimetype='video/mp4')
+    else:
+        chunks = generate_proxy(source, tweet, request.path, first_byte_observer('proxy'))
+        # 响应体未开始读取就断开时生成器不会执行，由 on_close 归还连接
+        response = Response(BlockingBody(chunks, blocking_executor, source.close), status=source.status_code,
+                            mimetype=source.headers.get('Content-Type', 'video/mp4'))
+        response.headers.update(twitter.response_headers(source))
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@app.route("/youtube/download")
+async def youtube_download():
+    """与 main.youtube_download 相同，参数校验和下载任务由 main 中的函数构造"""
+    data = ((await request.get_json(silent=True)) or (await request.form)) if request.method == 'POST' else {}
+    video_id = data.get("id") or request.args.get("id")
+
+    try:
+        try:
+            req = download_request(request.args, data)
+        except ValueError as e:
+            return jsonify({'errcode': 400, 'msg': str(e)})
+
+        logger.info(f"开始处理YouTube视频下载请求 - ID: {video_id} | URL: {req.url} | 格式: {req.format}"
+                    f"{f' | 变体: {req.variant.key}' if req.variant else ''}")
+
+        client = request_client(request)
+        if not req.variant:
+            cache_entry = await run_blocking(media_cache.lookup, video_id, req.format)
+            if cache_entry:
+                logger.info(f"命中媒体缓存 - ID: {video_id} | 格式: {req.format} | 路径: {cache_entry.path}")
+                return await send_media(SharedFile(cache_entry.path, lambda: media_cache.release(cache_entry)),
+                                        video_id)
+
+            if req.stream:
+                try:
+                    response = await live_stream_response(req.url, video_id, req.format, client)
+                except AdmissionRejected as e:
+                    logger.warning(f"拒绝边下载边发送请求 - ID: {video_id} | 客户端: {client} | 原因: {e.msg}")
+                    return admission_rejected_response(e)
+                if response is not None:
+                    return response
+
+        key, task, response_options = download_task(req, client)
+        flights = async_transcode_flights if req.variant else async_download_flights
+        try:
+            media, shared = await flights.do(key, task)
+        except DownloadFailed as e:
+            return jsonify({'errcode': e.errcode, 'msg': e.msg})
+        except AdmissionRejected as e:
+            logger.warning(f"拒绝下载请求 - ID: {video_id} | 客户端: {client} | 原因: {e.msg}")
+            return admission_rejected_response(e)
+        if shared:
+            logger.info(f"复用进行中的下载任务 - ID: {video_id} | 格式: {req.format}")
+
+        return await send_media(media, video_id, **response_options)
+
+    except Exception as e:
+        logger.error(f"视频下载失败 - ID: {video_id} | 错误: {str(e)}", exc_info=True)
+        return jsonify({'errcode': 900, 'msg': f"视频下载失败: {str(e)}"})
+
+
+@app.route("/jobs", methods=['POST'])
+async def submit_job():
+    data = await request.get_json(silent=True) or await request.form
+    # run_blocking 复制了上下文，线程中可以使用 url_for
+    return await run_blocking(submit_job_response, request.args, data, request_client(request), url_for)
+
+
+@app.route("/jobs/<job_id>")
+async def job_status(job_id):
+    # get 会清理过期任务：释放结果文件、删除任务日志，不能在事件循环中执行
+    return jsonify(job_status_response(await run_blocking(job_manager.get, job_id)))
+
+
+@app.route("/jobs/<job_id>/result")
+async def job_result(job_id):
+    job = await run_blocking(job_manager.get, job_id)
+    try:
+        media = job_result_media(job)
+    except DownloadFailed as e:
+        return jsonify({'errcode': e.errcode, 'msg': e.msg})
+    return await send_media(media, job.video_id)
+
+
+@app.route("/stats")
+async def stats():
+    # 统计信息包含任务日志的 SQLite 查询
+    return jsonify(await run_blocking(collect_stats))
+
+
+@app.route("/metrics")
+async def prometheus_metrics():
+    # 磁盘占用等指标需要遍历目录
+    return Response(await run_blocking(metrics.render), mimetype=CONTENT_TYPE_LATEST)
+
+
+@app.before_serving
+async def startup():
+    await run_blocking(prepare_storage)
+    await run_blocking(worker_init)
+
+
+@app.after_serving
+async def shutdown():
+    on_worker_exit()
+    blocking_executor.shutdown(wait=False, cancel_futures=True)
+    download_executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    if '--debug' in sys.argv or os.environ.get('YOUTUBE_DEBUG') == '1':
+        app.run(host="0.0.0.0", port=int(os.environ.get('YOUTUBE_PORT', 80)), debug=True, use_reloader=False)
+    else:
+        import server
+        server.run_async(app)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+对比每次新建 YoutubeDL 与使用实例池时 extract_info 的耗时
+
+用法: python benchmarks/bench_ydl_pool.py [视频URL] [-n 次数] [--cookies cookies.txt] [--extract-latency 秒]
+指定 URL 时访问 YouTube，结果取决于网络状况，建议多跑几次；
+不指定 URL 时离线运行：仍使用真实的 YoutubeDL（初始化和格式选择都是真实开销），
+只把网络解析替换为 fake_ydl 合成的 info dict，--extract-latency 模拟解析耗时
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import yt_dlp
+
+import fake_ydl
+from media_server import MediaServer
+from ydl_pool import YDLPool
+
+OFFLINE_URL = 'https://www.youtube.com/watch?v=benchmark'
+
+INFO_OPTS = {
+    'format': 'bestvideo[ext=mp4][vcodec!=none]',
+    'quiet': True,
+    'no_warnings': True,
+}
+
+
+class OfflineYoutubeDL(yt_dlp.YoutubeDL):
+    """真实的 YoutubeDL，extract_info 用合成的 info dict 代替网络请求，之后的格式选择照常执行"""
+
+    def extract_info(self, url, download=True, **kwargs):
+        time.sleep(fake_ydl.config.extract_latency)
+        info = fake_ydl._youtube_info(url.rpartition('=')[2])
+        info.update(extractor_key='Youtube', webpage_url_basename='watch')
+        return self.process_ie_result(info, download=False)
+
+
+def install_offline(extract_latency):
+    """替换 yt_dlp.YoutubeDL，格式地址指向本地媒体服务器（不会被请求），返回需要停止的服务器"""
+    media = MediaServer().start()
+    fake_ydl.config = fake_ydl.FakeConfig(media, extract_latency=extract_latency)
+    yt_dlp.YoutubeDL = OfflineYoutubeDL
+    return media
+
+
+def fresh(url, opts):
+    with yt_dlp.YoutubeDL(dict(opts)) as ydl:
+        ydl.extract_info(url, download=False)
+
+
+def pooled(pool, url):
+    with pool.acquire('info') as ydl:
+        ydl.extract_info(url, download=False)
+
+
+def measure(fn, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name, samples):
+    print(f"{name:>8}: 平均 {statistics.mean(samples) * 1000:8.1f} ms | "
+          f"中位数 {statistics.median(samples) * 1000:8.1f} ms | "
+          f"最小 {min(samples) * 1000:8.1f} ms | 最大 {max(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url', nargs='?', help='不指定时离线运行')
+    parser.add_argument('-n', type=int, default=5, help='每种方式的请求次数')
+    parser.add_argument('--cookies', default=None, help='cookies 文件路径')
+    parser.add_argument('--extract-latency', type=float, default=0.0, help='离线运行时模拟的解析耗时（秒）')
+    args = parser.parse_args()
+
+    media = None
+    if args.url is None:
+        media = install_offline(args.extract_latency)
+        args.url = OFFLINE_URL
+
+    opts = dict(INFO_OPTS, cookiefile=args.cookies)
+    pool = YDLPool({'info': opts}, size=1, cookiefile=args.cookies or '')
+    pool.warm()
+
+    report('新建实例', measure(lambda: fresh(args.url, opts), args.n))
+    report('实例池', measure(lambda: pooled(pool, args.url), args.n))
+    pool.close()
+    if media is not None:
+        media.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+yt_dlp.YoutubeDL 的本地替身
+
+extract_info 返回合成的 info dict（可配置解析延迟），格式地址指向本地媒体服务器；
+下载时通过 HTTP 读取这些地址写入 outtmpl，并调用进度回调，分离的音视频直接拼接代替 ffmpeg 合并。
+实现了服务端用到的接口（含 YDLPool 依赖的 params / _progress_hooks / format_selector 等属性）
+"""
+import copy
+import re
+import time
+
+import requests
+
+import yt_dlp
+
+CHUNK_SIZE = 256 * 1024
+
+
+class FakeConfig:
+    """
+    media_server: benchmarks.media_server.MediaServer
+    video_size: 一个视频（音视频合计）的字节数
+    extract_latency: 每次 extract_info 的模拟耗时（秒）
+    """
+
+    def __init__(self, media_server, video_size=10 * 1024 * 1024, extract_latency=0.2):
+        self.media_server = media_server
+        self.video_size = video_size
+        self.extract_latency = extract_latency
+        self.extract_calls = 0
+        self.download_calls = 0
+
+
+config = None
+_session = requests.Session()
+
+
+def _youtube_info(video_id):
+    video_size = int(config.video_size * 0.9)
+    audio_size = config.video_size - video_size
+    url = config.media_server.url
+
+    def fmt(format_id, ext, vcodec, acodec, height, size, tbr):
+        return {
+            'format_id': format_id, 'ext': ext, 'vcodec': vcodec, 'acodec': acodec,
+            'height': height, 'filesize': size, 'tbr': tbr, 'protocol': 'https',
+            'url': url(f"{video_id}-{format_id}", size), 'http_headers': {},
+        }
+
+    return {
+        'id': video_id,
+        'title': f"benchmark {video_id}",
+        'uploader': 'benchmark',
+        'upload_date': '20240101',
+        'duration': 60,
+        'view_count': 1,
+        'description': '',
+        'thumbnail': '',
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+        'extractor': 'youtube',
+        'formats': [
+            fmt('18', 'mp4', 'avc1.42001E', 'mp4a.40.2', 360, config.video_size // 4, 500),
+            fmt('137', 'mp4', 'avc1.640028', 'none', 1080, video_size, 4000),
+            fmt('248', 'webm', 'vp9', 'none', 1080, video_size, 3000),
+            fmt('140', 'm4a', 'none', 'mp4a.40.2', None, audio_size, 128),
+        ],
+    }
+
+
+def _twitter_info(url):
+    tweet_id = url.rstrip('/').split('/')[-1]
+    return {
+        'id': tweet_id,
+        'title': f"tweet {tweet_id}",
+        'uploader': 'benchmark',
+        'upload_date': '20240101',
+        'duration': 30,
+        'description': '',
+        'thumbnail': '',
+        'formats': [{
+            'format_id': 'http-2176', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2',
+            'height': 720, 'tbr': 2176, 'protocol': 'https', 'filesize': config.video_size,
+            'url': config.media_server.url(f"tweet-{tweet_id}", config.video_size),
+        }],
+    }
+
+
+class FakeYoutubeDL:
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+        outtmpl = self.params.get('outtmpl', '%(title)s [%(id)s].%(ext)s')
+        self.params['outtmpl'] = outtmpl if isinstance(outtmpl, dict) else {'default': outtmpl}
+        self._progress_hooks = list(self.params.get('progress_hooks') or [])
+        self.format_selector = self.build_format_selector(self.params.get('format'))
+        self._download_retcode = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def build_format_selector(self, format_spec):
+        return format_spec
+
+    def add_progress_hook(self, hook):
+        self._progress_hooks.append(hook)
+
+    @staticmethod
+    def sanitize_info(info, remove_private_keys=False):
+        return copy.deepcopy(info)
+
+    def extract_info(self, url, download=True, **kwargs):
+        config.extract_calls += 1
+        time.sleep(config.extract_latency)
+        if 'twitter.com' in url or 'x.com' in url:
+            info = _twitter_info(url)
+        elif 'list=' in url:
+            info = {'id': 'playlist', '_type': 'playlist',
+                    'entries': [{'id': f"pl{i}"} for i in range(10)]}
+        else:
+            match = re.search(r'v=([^&]+)', url)
+            info = _youtube_info(match.group(1) if match else url)
+        if download:
+            self.process_ie_result(info, download=True)
+        return info
+
+    def _select(self, info):
+        formats = {f['format_id']: f for f in info.get('formats', [])}
+        format_ids = str(self.format_selector or '').split('+')
+        if all(format_id in formats for format_id in format_ids):
+            return [formats[format_id] for format_id in format_ids]
+        # 复杂的格式选择表达式：使用音视频合一格式
+        return [next(f for f in info['formats'] if f['vcodec'] != 'none' and f['acodec'] != 'none')]
+
+    def _hook(self, status, f, downloaded, total):
+        for hook in self._progress_hooks:
+            hook({'status': status, 'info_dict': f, 'downloaded_bytes': downloaded, 'total_bytes': total})
+
+    def process_ie_result(self, info, download=True, **kwargs):
+        if not download:
+            return info
+        config.download_calls += 1
+        output = self.params['outtmpl']['default']
+        with open(output, 'wb') as out:
+            for f in self._select(info):
+                downloaded = 0
+                try:
+                    with _session.get(f['url'], stream=True, timeout=30) as r:
+                        r.raise_for_status()
+                        total = int(r.headers.get('Content-Length', 0))
+                        for chunk in r.iter_content(CHUNK_SIZE):
+                            out.write(chunk)
+                            downloaded += len(chunk)
+                            self._hook('downloading', f, downloaded, total)
+                except requests.RequestException as e:
+                    raise yt_dlp.utils.DownloadError(f"ERROR: {e}")
+                self._hook('finished', f, downloaded, total)
+        return info
+
+    def download(self, urls):
+        for url in urls:
+            self.extract_info(url, download=True)
+        return self._download_retcode
+
+
+def install(media_server, **kwargs):
+    """替换 yt_dlp.YoutubeDL，需要在导入 main 之前调用"""
+    global config
+    config = FakeConfig(media_server, **kwargs)
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    return config
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+本地媒体服务器：为压测提供任意大小的合成文件，代替 googlevideo / twimg 的 CDN
+
+GET /media/<名称>?size=<字节数>  返回 size 字节的数据，支持单区间 Range
+"""
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+CHUNK_SIZE = 256 * 1024
+# 所有响应共用的一块随机内容，避免生成数据占用 CPU
+_BLOCK = bytes(range(256)) * (CHUNK_SIZE // 256)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if not parsed.path.startswith('/media/'):
+            self.send_error(404)
+            return
+        size = int(parse_qs(parsed.query).get('size', ['0'])[0])
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and size:
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2) or end), end)
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        length = end - start + 1 if size else 0
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        try:
+            while length > 0:
+                n = min(length, CHUNK_SIZE)
+                self.wfile.write(_BLOCK[:n])
+                length -= n
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MediaServer:
+    """在后台线程中运行的本地媒体服务器，port 为 0 时自动选择端口"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, name, size):
+        return f"{self.base_url}/media/{name}?size={size}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+离线压测：用本地 yt-dlp 替身和本地媒体服务器启动服务，不需要访问 YouTube
+
+    python benchmarks/run.py --scenarios info,twitter,download -c 8 -n 200 --size 20M -o results.json
+    python benchmarks/run.py ... --compare baseline.json --threshold 0.1
+
+服务运行在单独的子进程中（默认 Flask 开发服务器，--server gunicorn 使用生产配置），
+统计每个场景的 p50/p95/p99 延迟、首字节时间、下载吞吐量，以及服务进程的 RSS 和每个请求的 CPU 时间。
+结果保存为 JSON；指定 --compare 时与基线对比，有指标变差超过阈值时以返回码 1 退出
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from yt_dlp.utils import parse_bytes
+
+SCENARIOS = ('info', 'twitter', 'download')
+# 对比时检查的指标，值越大越差
+COMPARE_METRICS = (
+    ('latency', 'p50'), ('latency', 'p95'), ('latency', 'p99'),
+    ('ttfb', 'p95'), ('cpu_seconds_per_request', None),
+)
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+# ---------- 服务子进程 ----------
+
+def serve(args):
+    """子进程入口：安装替身后启动服务"""
+    from media_server import MediaServer
+    import fake_ydl
+
+    media = MediaServer().start()
+    fake_ydl.install(media, video_size=args.size, extract_latency=args.extract_latency)
+
+    import main
+    import logging
+    logging.getLogger('youtube').setLevel(args.log_level)
+
+    if args.server == 'gunicorn':
+        import server
+        os.environ['YOUTUBE_PORT'] = str(args.port)
+        os.environ['YOUTUBE_HOST'] = '127.0.0.1'
+        server.run(main.app, on_starting=main.prepare_storage, on_worker_init=main.ydl_pool.warm,
+                   on_worker_exit=main.on_worker_exit)
+    else:
+        from werkzeug.serving import make_server
+        main.prepare_storage()
+        main.ydl_pool.warm()
+        make_server('127.0.0.1', args.port, main.app, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, work_dir):
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault('YOUTUBE_DOWNLOAD_DIR', work_dir)
+    env.setdefault('YOUTUBE_TRANSFER_PROGRESS', '0')
+    # 替身输出的是合成数据，不能交给 ffmpeg 合并
+    env.setdefault('YOUTUBE_PARALLEL_STREAMS', '0')
+    # 所有请求都来自 127.0.0.1，按客户端限流会把压测变成串行
+    env.setdefault('YOUTUBE_DOWNLOADS_PER_CLIENT', '0')
+    env.setdefault('YOUTUBE_MAX_DOWNLOADS', '0')
+    env.setdefault('YOUTUBE_MIN_FREE_BYTES', '0')
+    env.setdefault('YOUTUBE_WORKERS', '1')
+    if args.no_cache:
+        env['YOUTUBE_CACHE_MAX_BYTES'] = '0'
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port),
+           '--server', args.server, '--size', str(args.size),
+           '--extract-latency', str(args.extract_latency), '--log-level', args.log_level]
+    log = open(os.path.join(work_dir, 'server.log'), 'wb')
+    proc = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务启动失败，见 {log.name}")
+        try:
+            requests.get(f"{base_url}/cache/stats", timeout=1)
+            return proc, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("服务启动超时")
+
+
+# ---------- 进程资源 ----------
+
+def _process_tree(pid):
+    """pid 及其所有子进程（gunicorn worker）"""
+    pids = [pid]
+    try:
+        entries = [p for p in os.listdir('/proc') if p.isdigit()]
+    except OSError:
+        return pids
+    parents = {}
+    for entry in entries:
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            parents.setdefault(int(fields[1]), []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            pass
+    i = 0
+    while i < len(pids):
+        pids.extend(parents.get(pids[i], []))
+        i += 1
+    return pids
+
+
+def process_usage(pid):
+    """返回 (CPU 秒数, RSS 字节, 峰值 RSS 字节)，按进程树求和；不支持 /proc 时返回 None"""
+    cpu = rss = peak = 0
+    found = False
+    for p in _process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+                    elif line.startswith('VmHWM:'):
+                        peak += int(line.split()[1]) * 1024
+            found = True
+        except (OSError, IndexError, ValueError):
+            pass
+    return (cpu, rss, peak) if found else None
+
+
+# ---------- 压测 ----------
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))]
+
+    return {
+        'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+        'mean': sum(values) / len(values), 'max': values[-1],
+    }
+
+
+def scenario_paths(name, count, distinct):
+    for i in range(count):
+        key = i % distinct
+        if name == 'info':
+            yield f"/youtube?id=bench{key}"
+        elif name == 'twitter':
+            yield f"/twitter?url=https://x.com/bench/status/{key}"
+        else:
+            yield f"/youtube/download?id=dl{key}&format=137%2B140"
+
+
+def run_scenario(name, base_url, proc, args):
+    local = threading.local()
+
+    def one(path):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        ttfb = None
+        size = 0
+        error = None
+        try:
+            with session.get(base_url + path, stream=True, timeout=args.timeout) as r:
+                body = []
+                for chunk in r.iter_content(64 * 1024):
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - start
+                    size += len(chunk)
+                    if r.headers.get('Content-Type', '').startswith('application/json'):
+                        body.append(chunk)
+                if r.status_code != 200:
+                    error = f"HTTP {r.status_code}"
+                elif body:
+                    errcode = json.loads(b''.join(body)).get('errcode')
+                    if errcode:
+                        error = f"errcode {errcode}"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        elapsed = time.perf_counter() - start
+        return elapsed, ttfb, size, error
+
+    paths = list(scenario_paths(name, args.requests, args.distinct or args.requests))
+    before = process_usage(proc.pid)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one, paths))
+    wall = time.perf_counter() - started
+    after = process_usage(proc.pid)
+
+    ok = [r for r in results if r[3] is None]
+    errors = {}
+    for r in results:
+        if r[3] is not None:
+            errors[r[3]] = errors.get(r[3], 0) + 1
+    total_bytes = sum(r[2] for r in ok)
+    report = {
+        'requests': len(results),
+        'errors': errors,
+        'concurrency': args.concurrency,
+        'wall_seconds': wall,
+        'requests_per_second': len(results) / wall if wall > 0 else None,
+        'bytes': total_bytes,
+        'latency': percentiles([r[0] for r in ok]),
+        'ttfb': percentiles([r[1] for r in ok if r[1] is not None]),
+        # 单个请求的下载速度（字节/秒）
+        'throughput': percentiles([r[2] / r[0] for r in ok if r[0] > 0 and r[2]]),
+        'cpu_seconds_per_request': None,
+        'rss_bytes': None,
+        'peak_rss_bytes': None,
+    }
+    if before and after:
+        report['cpu_seconds_per_request'] = (after[0] - before[0]) / max(len(results), 1)
+        report['rss_bytes'] = after[1]
+        report['peak_rss_bytes'] = after[2]
+    return report
+
+
+def print_report(name, report):
+    def ms(stats, key):
+        return f"{stats[key] * 1000:8.1f}" if stats else "       -"
+
+    lat, ttfb, tput = report['latency'], report['ttfb'], report['throughput']
+    print(f"[{name}] 请求: {report['requests']} | 错误: {sum(report['errors'].values())} | "
+          f"RPS: {report['requests_per_second']:.1f} | 用时: {report['wall_seconds']:.2f}秒")
+    print(f"    延迟(ms)   p50 {ms(lat, 'p50')} | p95 {ms(lat, 'p95')} | p99 {ms(lat, 'p99')}")
+    print(f"    首字节(ms) p50 {ms(ttfb, 'p50')} | p95 {ms(ttfb, 'p95')} | p99 {ms(ttfb, 'p99')}")
+    if tput and report['bytes'] >= 1024 * 1024:
+        print(f"    吞吐量     p50 {tput['p50'] / 1024 / 1024:8.1f} MB/s | 总计 {report['bytes'] / 1024 / 1024:.1f}MB")
+    if report['cpu_seconds_per_request'] is not None:
+        print(f"    服务进程   CPU {report['cpu_seconds_per_request'] * 1000:.2f} ms/请求 | "
+              f"RSS {report['rss_bytes'] / 1024 / 1024:.1f}MB (峰值 {report['peak_rss_bytes'] / 1024 / 1024:.1f}MB)")
+    if report['errors']:
+        print(f"    错误: {report['errors']}")
+
+
+def compare(results, baseline, threshold):
+    """逐项对比，返回变差超过阈值的指标列表"""
+    regressions = []
+    for name, report in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for metric, key in COMPARE_METRICS:
+            new, old = report.get(metric), base.get(metric)
+            if key is not None:
+                new = new and new.get(key)
+                old = old and old.get(key)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            label = f"{name}.{metric}" + (f".{key}" if key else '')
+            flag = '  <-- 变差' if change > threshold else ''
+            print(f"    {label:<40} {old:10.4f} -> {new:10.4f} ({change:+.1%}){flag}")
+            if change > threshold:
+                regressions.append(label)
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"逗号分隔: {', '.join(SCENARIOS)}")
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-n', '--requests', type=int, default=100, help='每个场景的请求数')
+    parser.add_argument('--distinct', type=int, default=0,
+                        help='不同视频的数量，小于请求数时会命中缓存（默认每个请求都不同）')
+    parser.add_argument('--size', type=parse_bytes, default=parse_bytes('10M'), help='每个视频的大小，如 20M')
+    parser.add_argument('--extract-latency', type=float, default=0.2, help='模拟 extract_info 耗时（秒）')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    parser.add_argument('--no-cache', action='store_true', help='关闭媒体缓存')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('-o', '--output', help='结果 JSON 文件')
+    parser.add_argument('--compare', help='基线结果 JSON 文件')
+    parser.add_argument('--threshold', type=float, default=0.1, help='允许的变差比例')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+
+    work_dir = tempfile.mkdtemp(prefix='youtube-bench-')
+    proc, base_url = start_server(args, work_dir)
+    results = {
+        'meta': {
+            'timestamp': time.time(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('serve', 'port', 'output', 'compare')},
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in scenarios:
+            report = run_scenario(name, base_url, proc, args)
+            results['scenarios'][name] = report
+            print_report(name, report)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"与基线对比 ({baseline.get('meta', {}).get('revision')}):")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"变差超过 {args.threshold:.0%} 的指标: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+yt-dlp 下载的网络并发参数：分片并发数、音视频并行下载、HTTP 分块大小、外部下载器
+
+部署时通过环境变量设置默认值，单个请求可以在上限内覆盖
+"""
+import shutil
+import subprocess
+
+from yt_dlp.downloader.external import get_external_downloader
+from yt_dlp.utils import parse_bytes
+
+# 允许使用的外部下载器，native 为 yt-dlp 内置下载器
+DOWNLOADERS = ('native', 'aria2c', 'axel', 'curl', 'wget', 'ffmpeg')
+
+
+class DownloadOptions:
+    """
+    fragments: DASH/HLS 分片并发数
+    parallel_streams: 分离的视频流和音频流同时下载，再由 ffmpeg 合并
+    http_chunk_size: HTTP 分块下载的块大小（字节），0 表示不分块
+    downloader: 外部下载器名称，native 表示使用内置下载器
+    """
+    __slots__ = ('fragments', 'parallel_streams', 'http_chunk_size', 'downloader')
+
+    def __init__(self, fragments=1, parallel_streams=False, http_chunk_size=0, downloader='native'):
+        self.fragments = fragments
+        self.parallel_streams = parallel_streams
+        self.http_chunk_size = http_chunk_size
+        self.downloader = downloader
+
+    def ydl_params(self):
+        params = {
+            'concurrent_fragment_downloads': self.fragments,
+            'http_chunk_size': self.http_chunk_size or None,
+            'external_downloader': None,
+        }
+        if self.downloader != 'native':
+            params['external_downloader'] = {'default': self.downloader}
+        return params
+
+    def to_dict(self):
+        """可 JSON 序列化，DownloadOptions(**d) 还原，用于持久化后台任务"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def labels(self):
+        """用于 Prometheus 指标的标签"""
+        return {
+            'downloader': self.downloader,
+            'fragments': str(self.fragments),
+            'parallel': '1' if self.parallel_streams else '0',
+        }
+
+    def describe(self):
+        chunk = f"{self.http_chunk_size/1024/1024:.0f}MB" if self.http_chunk_size else "关闭"
+        return (f"下载器={self.downloader}, 分片并发={self.fragments}, "
+                f"音视频并行={'是' if self.parallel_streams else '否'}, 分块={chunk}")
+
+
+def _parse_bool(value):
+    value = str(value).strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(value)
+
+
+def parse_download_options(params, defaults, max_fragments):
+    """
+    从请求参数（fragments/parallel/chunk_size/downloader）解析下载参数，未指定的使用 defaults
+    参数非法时抛出 ValueError
+    """
+    fragments = defaults.fragments
+    parallel_streams = defaults.parallel_streams
+    http_chunk_size = defaults.http_chunk_size
+    downloader = defaults.downloader
+
+    value = params.get('fragments')
+    if value not in (None, ''):
+        try:
+            fragments = int(value)
+        except ValueError:
+            raise ValueError(f"fragments 参数无效: {value}")
+        if not 1 <= fragments <= max_fragments:
+            raise ValueError(f"fragments 参数必须在 1 到 {max_fragments} 之间")
+
+    value = params.get('parallel')
+    if value not in (None, ''):
+        try:
+            parallel_streams = _parse_bool(value)
+        except ValueError:
+            raise ValueError(f"parallel 参数无效: {value}")
+
+    value = params.get('chunk_size')
+    if value not in (None, ''):
+        # 支持 10485760 或 10M 这样的写法
+        http_chunk_size = parse_bytes(str(value))
+        if http_chunk_size is None or http_chunk_size < 0:
+            raise ValueError(f"chunk_size 参数无效: {value}")
+
+    value = params.get('downloader')
+    if value not in (None, ''):
+        downloader = str(value).lower()
+    if downloader not in DOWNLOADERS:
+        raise ValueError(f"不支持的下载器: {downloader}，可选: {', '.join(DOWNLOADERS)}")
+    if downloader != 'native':
+        ed = get_external_downloader(downloader)
+        if ed is None or not ed.available():
+            raise ValueError(f"下载器 {downloader} 未安装")
+
+    return DownloadOptions(fragments, parallel_streams, http_chunk_size, downloader)
+
+
+def can_merge():
+    return shutil.which('ffmpeg') is not None
+
+
+def merge_streams(video_path, audio_path, output_path):
+    """用 ffmpeg 将分别下载的视频流和音频流无损合并为 mp4，失败时抛出 RuntimeError"""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+        '-i', video_path, '-i', audio_path,
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        output_path,
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        error = proc.stderr.decode('utf-8', 'replace').strip()
+        raise RuntimeError(f"ffmpeg 合并失败 (返回码 {proc.returncode}): {error}")
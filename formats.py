@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+格式选择：把 info['formats'] 解析为一张紧凑的表，再按声明式的质量策略排序选择
+
+选择结果是 /youtube/download 接受的格式字符串：
+- "视频ID+音频ID"：分离的视频流和音频流，下载后由 ffmpeg 合并
+- "格式ID"：音视频合一的格式，质量足够时优先使用，省去合并
+"""
+from collections import namedtuple
+
+# 编码名称规范化，yt-dlp 的 vcodec 形如 avc1.640028 / vp09.00.40.08 / av01.0.08M.08
+CODEC_ALIASES = {
+    'avc1': 'avc1', 'avc': 'avc1', 'h264': 'avc1',
+    'vp9': 'vp9', 'vp09': 'vp9',
+    'av1': 'av1', 'av01': 'av1',
+}
+
+# 视频/音频的扩展名对应关系，判断音频能否直接封装进目标容器
+AUDIO_EXT = {'mp4': 'm4a', 'webm': 'webm'}
+
+Format = namedtuple('Format', [
+    'format_id', 'height', 'codec', 'ext', 'tbr', 'size', 'has_video', 'has_audio',
+])
+
+
+def _codec_family(vcodec):
+    if not vcodec or vcodec == 'none':
+        return None
+    return CODEC_ALIASES.get(vcodec.split('.')[0].lower(), vcodec.split('.')[0].lower())
+
+
+def _height(f):
+    height = f.get('height')
+    if height:
+        return int(height)
+    resolution = f.get('resolution') or ''
+    if 'x' in resolution:
+        try:
+            return int(resolution.split('x')[1])
+        except ValueError:
+            pass
+    return 0
+
+
+def _size(f, duration):
+    """文件大小：优先 filesize，其次 filesize_approx，最后用码率和时长估算，未知为 None"""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        return int(size)
+    tbr = f.get('tbr')
+    if tbr and duration:
+        return int(tbr * 1000 / 8 * duration)
+    return None
+
+
+def parse_formats(info):
+    """将 info dict 的格式列表解析为 Format 元组列表，只解析一次供多个策略复用"""
+    duration = info.get('duration')
+    table = []
+    for f in info.get('formats') or []:
+        has_video = f.get('vcodec') not in (None, 'none')
+        has_audio = f.get('acodec') not in (None, 'none')
+        if not f.get('format_id') or not (has_video or has_audio):
+            continue
+        # storyboard 等图片格式没有编码信息
+        if not has_video and f.get('acodec') is None:
+            continue
+        table.append(Format(
+            format_id=str(f['format_id']),
+            height=_height(f) if has_video else 0,
+            codec=_codec_family(f.get('vcodec')),
+            ext=(f.get('ext') or '').lower(),
+            tbr=f.get('tbr') or f.get('abr') or 0,
+            size=_size(f, duration),
+            has_video=has_video,
+            has_audio=has_audio,
+        ))
+    return table
+
+
+class FormatPolicy:
+    """
+    max_height / min_height: 视频高度范围
+    codecs: 视频编码偏好顺序，如 ('avc1', 'vp9', 'av1')，空表示不限
+    containers: 允许的视频扩展名，空表示不限
+    max_size: 总大小上限（字节），大小未知的格式在设置上限时会被跳过
+    max_tbr: 视频码率上限（kbps）
+    prefer_muxed: 音视频合一格式的高度不低于分离格式（或不低于 muxed_min_height）时优先使用
+    """
+    __slots__ = ('name', 'max_height', 'min_height', 'codecs', 'containers', 'max_size', 'max_tbr',
+                 'prefer_muxed', 'muxed_min_height')
+
+    def __init__(self, name, max_height=1080, min_height=0, codecs=('avc1', 'av1', 'vp9'),
+                 containers=('mp4',), max_size=None, max_tbr=None, prefer_muxed=True,
+                 muxed_min_height=None):
+        self.name = name
+        self.max_height = max_height
+        self.min_height = min_height
+        self.codecs = tuple(codecs)
+        self.containers = tuple(containers)
+        self.max_size = max_size
+        self.max_tbr = max_tbr
+        self.prefer_muxed = prefer_muxed
+        self.muxed_min_height = muxed_min_height
+
+    def replace(self, **changes):
+        fields = {k: getattr(self, k) for k in self.__slots__}
+        fields.update(changes)
+        return FormatPolicy(**fields)
+
+    def cache_key(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def _accepts_video(self, f):
+        if not self.min_height <= f.height <= (self.max_height or f.height):
+            return False
+        if self.codecs and f.codec not in self.codecs:
+            return False
+        if self.containers and f.ext not in self.containers:
+            return False
+        if self.max_tbr and f.tbr > self.max_tbr:
+            return False
+        return True
+
+    def _video_key(self, f):
+        # 高度优先，其次编码偏好，同高度同编码选码率更高的
+        codec_rank = self.codecs.index(f.codec) if self.codecs else 0
+        return -f.height, codec_rank, -f.tbr
+
+    def _fits(self, *formats):
+        if not self.max_size:
+            return True
+        sizes = [f.size for f in formats]
+        return None not in sizes and sum(sizes) <= self.max_size
+
+
+POLICIES = {
+    # 与原先的选择规则一致：最高 1080p 的 mp4
+    'default': FormatPolicy('default'),
+    # 兼容性优先：H.264，720p 以内有合一格式就不合并
+    'compat': FormatPolicy('compat', max_height=720, codecs=('avc1',), muxed_min_height=360),
+    # 体积优先：480p 以内，总大小不超过 100MB
+    'small': FormatPolicy('small', max_height=480, max_size=100 * 1024 * 1024, muxed_min_height=360),
+    # 画质优先：不限分辨率和容器，优先 AV1
+    'best': FormatPolicy('best', max_height=None, codecs=('av1', 'vp9', 'avc1'), containers=()),
+}
+
+
+class Selection:
+    __slots__ = ('video', 'audio')
+
+    def __init__(self, video, audio=None):
+        self.video = video
+        self.audio = audio
+
+    @property
+    def format_string(self):
+        if self.audio is None:
+            return self.video.format_id
+        return f"{self.video.format_id}+{self.audio.format_id}"
+
+    @property
+    def size(self):
+        """总大小，未知时为 None"""
+        sizes = [f.size for f in (self.video, self.audio) if f is not None]
+        return None if None in sizes else sum(sizes)
+
+    @property
+    def muxed(self):
+        return self.audio is None
+
+
+def _rank_audio(table, video_ext):
+    audio = [f for f in table if f.has_audio and not f.has_video]
+    preferred = AUDIO_EXT.get(video_ext)
+    # 同容器的音频可以直接封装，码率相近时优先；其余按码率排序
+    return sorted(audio, key=lambda f: (f.tbr or 0) * (1.2 if f.ext == preferred else 1), reverse=True)
+
+
+def select_format(table, policy):
+    """
+    按策略选择格式，返回 Selection
+    找不到视频时抛出 LookupError('video')，找不到音频时抛出 LookupError('audio')
+    """
+    videos = sorted((f for f in table if f.has_video and not f.has_audio and policy._accepts_video(f)),
+                    key=policy._video_key)
+    muxed = sorted((f for f in table if f.has_video and f.has_audio and policy._accepts_video(f)
+                    and policy._fits(f)), key=policy._video_key)
+
+    pair = None
+    audio_found = False
+    for video in videos:
+        for audio in _rank_audio(table, video.ext):
+            audio_found = True
+            if policy._fits(video, audio):
+                pair = Selection(video, audio)
+                break
+        if pair or not audio_found:
+            break
+
+    if muxed and (pair is None or policy.prefer_muxed):
+        best_muxed = muxed[0]
+        threshold = policy.muxed_min_height or (pair.video.height if pair else 0)
+        if pair is None or best_muxed.height >= threshold:
+            return Selection(best_muxed)
+    if pair is not None:
+        return pair
+    if videos and not audio_found:
+        raise LookupError('audio')
+    raise LookupError('video')
+
+
+def resolve_policy(name=None, overrides=None, default='default'):
+    """
+    按名称取预设策略并应用覆盖项，参数非法时抛出 ValueError
+    overrides 支持 max_height、codec（逗号分隔）、container（逗号分隔）、max_size_mb、max_tbr、muxed
+    """
+    name = name or default
+    if name not in POLICIES:
+        raise ValueError(f"未知的格式策略: {name}，可选: {', '.join(POLICIES)}")
+    policy = POLICIES[name]
+    changes = {}
+    for key, value in (overrides or {}).items():
+        if value in (None, ''):
+            continue
+        try:
+            if key == 'max_height':
+                changes['max_height'] = int(value) or None
+            elif key == 'max_tbr':
+                changes['max_tbr'] = float(value) or None
+            elif key == 'max_size_mb':
+                changes['max_size'] = int(float(value) * 1024 * 1024) or None
+            elif key == 'codec':
+                codecs = tuple(CODEC_ALIASES.get(c.strip().lower(), c.strip().lower())
+                               for c in str(value).split(',') if c.strip())
+                changes['codecs'] = codecs
+            elif key == 'container':
+                changes['containers'] = tuple(c.strip().lower() for c in str(value).split(',') if c.strip())
+            elif key == 'muxed':
+                changes['prefer_muxed'] = str(value).lower() in ('1', 'true', 'yes')
+        except ValueError:
+            raise ValueError(f"格式策略参数 {key} 无效: {value}")
+    return policy.replace(**changes) if changes else policy
+
+
+def estimate_size(info, format_str):
+    """
+    按格式字符串估算下载大小（字节），只支持 "ID" 或 "ID+ID" 的形式
+    格式不存在或大小未知时返回 None
+    """
+    table = {f.format_id: f for f in parse_formats(info)}
+    total = 0
+    for format_id in format_str.split('+'):
+        f = table.get(format_id)
+        if f is None or f.size is None:
+            return None
+        total += f.size
+    return total
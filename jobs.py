@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+后台下载任务：提交后立即返回任务ID，由有界线程池执行，客户端轮询状态并获取结果
+配置了 journal 时任务状态写入 SQLite，进程重启后未完成的任务以原任务ID重新排队
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from log_config import request_id_var
+
+logger = logging.getLogger('youtube.jobs')
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """等待中的任务数已达上限"""
+
+
+class Job:
+    __slots__ = ('id', 'video_id', 'format', 'client', 'options', 'state', 'progress', 'errcode', 'msg',
+                 'result', 'created_at', 'started_at', 'finished_at')
+
+    def __init__(self, video_id, format_str, client=None, options=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.video_id = video_id
+        self.format = format_str
+        self.client = client
+        self.options = options
+        self.state = QUEUED
+        self.progress = {}
+        self.errcode = 0
+        self.msg = "ok"
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def update_progress(self, **fields):
+        """供下载进度回调使用，字段包括 phase/stream/format_id/downloaded_bytes/total_bytes"""
+        progress = dict(self.progress)
+        progress.update(fields)
+        self.progress = progress
+
+    def to_dict(self):
+        progress = dict(self.progress)
+        total = progress.get('total_bytes') or 0
+        if total:
+            progress['percent'] = round(progress.get('downloaded_bytes', 0) * 100 / total, 1)
+        return {
+            'job_id': self.id,
+            'id': self.video_id,
+            'format': self.format,
+            'state': self.state,
+            'progress': progress,
+            'errcode': self.errcode,
+            'msg': self.msg,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    runner(job) 在线程池中执行并返回 SharedFile
+    结果在任务完成 result_ttl 秒后释放，期间可多次获取
+    journal: 可选的 journal.Journal，任务每次状态变化时写入
+    restore_result(video_id, format_str): 重启后为已完成的任务找回结果（SharedFile），找不到时返回 None
+    """
+
+    def __init__(self, runner, max_workers, max_queue, result_ttl, journal=None, restore_result=None):
+        self._runner = runner
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._journal = journal
+        self._restore_result = restore_result
+
+    def _save(self, job):
+        if self._journal is None:
+            return
+        try:
+            self._journal.save_job(job)
+        except Exception as e:
+            # 日志写入失败不影响任务本身，只是重启后无法恢复
+            logger.error(f"写入任务日志失败 - 任务ID: {job.id} | 错误: {str(e)}")
+
+    def submit(self, video_id, format_str, client=None, options=None):
+        self.purge_expired()
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j.state == QUEUED)
+            if queued >= self.max_queue:
+                raise QueueFull(f"任务队列已满 ({queued}/{self.max_queue})")
+            job = Job(video_id, format_str, client, options)
+            self._jobs[job.id] = job
+        self._save(job)
+        self._executor.submit(self._run, job)
+        logger.info(f"已提交下载任务 - 任务ID: {job.id} | ID: {video_id} | 格式: {format_str}")
+        return job
+
+    def _run(self, job):
+        # 任务执行期间的日志以任务ID作为关联ID
+        token = request_id_var.set(job.id)
+        job.state = RUNNING
+        job.started_at = time.time()
+        self._save(job)
+        try:
+            result = self._runner(job)
+        except Exception as e:
+            job.errcode = getattr(e, 'errcode', 900)
+            job.msg = getattr(e, 'msg', f"视频下载失败: {str(e)}")
+            job.state = FAILED
+            logger.error(f"下载任务失败 - 任务ID: {job.id} | 错误: {job.msg}")
+        else:
+            with self._lock:
+                job.result = result
+            job.update_progress(phase='finished')
+            job.state = FINISHED
+            logger.info(f"下载任务完成 - 任务ID: {job.id} | 用时: {time.time() - job.started_at:.2f}秒")
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            request_id_var.reset(token)
+
+    def get(self, job_id):
+        self.purge_expired()
+        return self._jobs.get(job_id)
+
+    def acquire_result(self, job_id):
+        """返回已增加引用计数的结果，使用完毕后调用 release"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.result is None:
+                return None
+            job.result.retain()
+            return job.result
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {QUEUED: 0, RUNNING: 0, FINISHED: 0, FAILED: 0}
+        for job in jobs:
+            counts[job.state] += 1
+        return {'workers': self.max_workers, 'max_queue': self.max_queue, **counts}
+
+    def purge_expired(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished_at and now - job.finished_at > self.result_ttl:
+                    del self._jobs[job_id]
+                    expired.append(job)
+        for job in expired:
+            if job.result is not None:
+                job.result.release()
+                job.result = None
+            if self._journal is not None:
+                try:
+                    self._journal.delete_job(job.id)
+                except Exception as e:
+                    logger.error(f"删除任务日志失败 - 任务ID: {job.id} | 错误: {str(e)}")
+
+    def recover(self, resume_ttl):
+        """
+        进程启动时调用：认领已退出进程留下的未完成任务，以原任务ID重新排队；
+        超过 resume_ttl 秒未更新的任务丢弃
+        result_ttl 内结束的任务恢复到内存中，已完成的任务从 restore_result 找回结果
+        """
+        if self._journal is None:
+            return
+        now = time.time()
+        self._journal.purge_jobs(now - self.result_ttl)
+        restored = 0
+        for row in self._journal.finished_jobs(now - self.result_ttl):
+            job = self._job_from_row(row)
+            job.state = row['state']
+            job.errcode = row['errcode']
+            job.msg = row['msg']
+            job.started_at = row['started_at']
+            job.finished_at = row['finished_at']
+            if job.state == FINISHED:
+                job.result = self._restore_result(job.video_id, job.format) if self._restore_result else None
+                if job.result is None:
+                    # 结果文件已被淘汰，客户端需要重新提交
+                    continue
+                job.update_progress(phase='finished')
+            with self._lock:
+                self._jobs.setdefault(job.id, job)
+            restored += 1
+
+        claimed = self._journal.claim_jobs(resume_ttl)
+        for row, options in claimed:
+            job = self._job_from_row(row, options)
+            with self._lock:
+                self._jobs[job.id] = job
+            self._executor.submit(self._run, job)
+            logger.info(f"恢复未完成的下载任务 - 任务ID: {job.id} | ID: {job.video_id} | 格式: {job.format}")
+        if restored or claimed:
+            logger.info(f"已从任务日志恢复 - 重新排队: {len(claimed)} | 已结束: {restored}")
+
+    @staticmethod
+    def _job_from_row(row, options=None):
+        job = Job(row['video_id'], row['format'], row['client'], options, job_id=row['id'])
+        job.created_at = row['created_at']
+        return job
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
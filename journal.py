@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+下载日志：用 SQLite 持久化后台任务和下载工作目录，进程重启后续传未完成的下载
+
+- jobs：后台任务的格式、下载参数、状态，重启后由某个 worker 认领未完成的任务重新排队
+- downloads：进行中或中断的下载工作目录；目录中保留 yt-dlp 的 .part 文件，再次下载同一视频时续传
+- 工作目录在下载期间持有 .lock 文件锁，垃圾回收跳过被锁住的目录，
+  没有记录的目录和最后修改超过 TTL 的中断目录会被删除
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+from download_options import DownloadOptions
+
+logger = logging.getLogger('youtube.journal')
+
+# 未完成的任务状态
+UNFINISHED = ('queued', 'running')
+
+LOCK_NAME = '.lock'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    client TEXT,
+    options TEXT,
+    state TEXT NOT NULL,
+    errcode INTEGER NOT NULL DEFAULT 0,
+    msg TEXT,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS downloads (
+    work_dir TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+
+def work_dir_name(video_id, format_str):
+    """同一 (视频ID, 格式) 总是使用同一个工作目录，重试时 yt-dlp 才能找到之前的 .part 文件"""
+    safe_id = re.sub(r'[^0-9A-Za-z_-]', '_', video_id)[:64]
+    digest = hashlib.sha1(format_str.encode('utf-8')).hexdigest()[:12]
+    return f"{safe_id}-{digest}"
+
+
+def lock_dir(path):
+    """
+    创建目录并对其中的锁文件加排他锁，成功时返回需要保持打开的文件对象，已被其他进程或线程锁住时返回 None
+    关闭返回的文件即释放锁
+    """
+    os.makedirs(path, exist_ok=True)
+    f = open(os.path.join(path, LOCK_NAME), 'a')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def dir_activity(path):
+    """
+    目录及其中文件的最后修改时间，续传的 .part 文件会不断更新
+    创建锁文件也会更新目录的修改时间，需要在加锁之前读取
+    """
+    latest = os.path.getmtime(path)
+    for entry in os.scandir(path):
+        if entry.name != LOCK_NAME:
+            latest = max(latest, entry.stat(follow_symlinks=False).st_mtime)
+    return latest
+
+
+def dir_size(path):
+    """目录中所有文件（含子目录，不含锁文件）的总大小，遍历期间被删除的文件跳过"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name == LOCK_NAME:
+                continue
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def process_token(pid=None):
+    """
+    进程标识：PID 加进程启动时间，容器重启后 PID 常被复用，只比较 PID 会把已退出的进程当成存活
+    没有 /proc、进程已退出或无法读取（如 hidepid 挂载）时只使用 PID，存活检查退回到 os.kill
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # 第二个字段（进程名）可能包含空格，从右括号之后开始计数，启动时间是第 22 个字段
+            start_time = f.read().rpartition(')')[2].split()[19]
+    except (OSError, IndexError):
+        return str(pid)
+    return f"{pid}:{start_time}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _owner_alive(owner):
+    if not owner:
+        return False
+    pid = int(owner.partition(':')[0])
+    if ':' not in owner:
+        return _pid_alive(pid)
+    token = process_token(pid)
+    if ':' not in token:
+        # 读不到启动时间，只能按 PID 判断
+        return _pid_alive(pid)
+    return token == owner
+
+
+class Journal:
+    """
+    线程安全，多个 worker 进程可以共用同一个数据库文件
+    认领任务时使用 BEGIN IMMEDIATE，同一个任务只会被一个进程认领
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._owner = None
+
+    def _connection(self):
+        # fork 之后在子进程中重新连接
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+            self._owner = process_token()
+        return self._conn
+
+    @property
+    def owner(self):
+        """当前进程的标识，fork 之后重新计算"""
+        with self._lock:
+            self._connection()
+            return self._owner
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    # 后台任务
+
+    def save_job(self, job):
+        options = json.dumps(job.options.to_dict()) if job.options else None
+        self._execute(
+            'INSERT OR REPLACE INTO jobs (id, video_id, format, client, options, state, errcode, msg, owner, '
+            'created_at, started_at, finished_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job.id, job.video_id, job.format, job.client, options, job.state, job.errcode, job.msg,
+             self.owner, job.created_at, job.started_at, job.finished_at, time.time())
+        )
+
+    def delete_job(self, job_id):
+        self._execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def claim_jobs(self, ttl):
+        """
+        认领所属进程已退出的未完成任务，改为排队状态并归属当前进程，返回 [(记录, DownloadOptions)]
+        超过 ttl 秒没有更新的任务不再恢复，直接删除
+        """
+        now = time.time()
+        claimed = []
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(
+                    f"SELECT * FROM jobs WHERE state IN ({','.join('?' * len(UNFINISHED))}) ORDER BY created_at",
+                    UNFINISHED
+                ).fetchall()
+                for row in rows:
+                    if _owner_alive(row['owner']):
+                        continue
+                    if now - row['updated_at'] > ttl:
+                        conn.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+                        logger.info(f"丢弃过期的未完成任务 - 任务ID: {row['id']} | ID: {row['video_id']}")
+                        continue
+                    conn.execute("UPDATE jobs SET owner = ?, state = 'queued', updated_at = ? WHERE id = ?",
+                                 (self._owner, now, row['id']))
+                    options = DownloadOptions(**json.loads(row['options'])) if row['options'] else None
+                    claimed.append((row, options))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return claimed
+
+    def finished_jobs(self, since):
+        """since 之后结束的任务，重启后继续提供结果或错误信息"""
+        return self._execute(
+            f"SELECT * FROM jobs WHERE state NOT IN ({','.join('?' * len(UNFINISHED))}) AND finished_at >= ?",
+            (*UNFINISHED, since)
+        )
+
+    def purge_jobs(self, before):
+        self._execute(
+            f"DELETE FROM jobs WHERE state NOT IN ({','.join('?' * len(UNFINISHED))}) AND finished_at < ?",
+            (*UNFINISHED, before)
+        )
+
+    # 下载工作目录
+
+    def start_download(self, work_dir, video_id, format_str):
+        now = time.time()
+        self._execute(
+            "INSERT INTO downloads (work_dir, video_id, format, state, owner, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'running', ?, ?, ?) "
+            "ON CONFLICT(work_dir) DO UPDATE SET state = 'running', owner = excluded.owner, updated_at = excluded.updated_at",
+            (work_dir, video_id, format_str, self.owner, now, now)
+        )
+
+    def interrupt_download(self, work_dir):
+        """下载失败但保留部分文件，之后的相同请求从这里续传"""
+        self._execute("UPDATE downloads SET state = 'interrupted', owner = NULL, updated_at = ? WHERE work_dir = ?",
+                      (time.time(), work_dir))
+
+    def finish_download(self, work_dir):
+        self._execute('DELETE FROM downloads WHERE work_dir = ?', (work_dir,))
+
+    def downloads(self):
+        return self._execute('SELECT * FROM downloads ORDER BY created_at')
+
+    def collect_garbage(self, root, ttl, orphan_grace=60):
+        """
+        清理工作目录：跳过被锁住（正在使用）的目录；
+        有记录的目录在最后修改后保留 ttl 秒用于续传，没有记录的目录（旧版本或转换留下的）
+        超过 orphan_grace 秒后删除，避免删除其他进程刚创建、还未加锁的目录
+        返回 (删除的目录数, 释放的字节数)
+        """
+        if not os.path.isdir(root):
+            return 0, 0
+        now = time.time()
+        known = {row['work_dir']: row for row in self.downloads()}
+        removed = freed = 0
+        for entry in os.scandir(root):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            path = os.path.join(root, entry.name)
+            row = known.pop(path, None)
+            try:
+                idle = now - dir_activity(path)
+            except FileNotFoundError:
+                continue
+            if idle <= (ttl if row is not None else orphan_grace):
+                continue
+            lock = lock_dir(path)
+            if lock is None:
+                continue
+            try:
+                size = dir_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+                freed += size
+                if row is not None:
+                    self.finish_download(path)
+                    logger.info(f"清理过期的部分下载 - ID: {row['video_id']} | 格式: {row['format']} | "
+                                f"大小: {size/1024/1024:.2f}MB")
+            finally:
+                lock.close()
+        # 目录已经不存在的记录
+        for path, row in known.items():
+            if not os.path.exists(path):
+                self.finish_download(path)
+        return removed, freed
+
+    def stats(self):
+        jobs = self._execute('SELECT state, COUNT(*) AS n FROM jobs GROUP BY state')
+        downloads = self._execute('SELECT state, COUNT(*) AS n FROM downloads GROUP BY state')
+        return {
+            'path': self.path,
+            'jobs': {row['state']: row['n'] for row in jobs},
+            'downloads': {row['state']: row['n'] for row in downloads},
+        }
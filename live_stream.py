@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+边下载边发送：不等待下载和合并完成，直接把数据流式发送给客户端
+
+- 单个音视频合一的格式：直接代理原始数据；HLS 格式由 ffmpeg 封装
+- 视频+音频两个格式：ffmpeg 读取两路流，实时封装为 fragmented MP4 输出到 stdout
+"""
+import logging
+import shutil
+import subprocess
+
+import requests
+
+logger = logging.getLogger('youtube.stream')
+
+# ffmpeg 可以直接读取的协议
+STREAMABLE_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')
+
+CHUNK_SIZE = 64 * 1024
+
+_session = requests.Session()
+
+
+def select_stream_formats(info, format_str):
+    """
+    将 "视频ID+音频ID" 或单个格式ID 解析为 info['formats'] 中的格式
+    格式字符串不是简单的ID组合、找不到对应格式、协议不支持或缺少 ffmpeg 时返回 None
+    """
+    formats = {f.get('format_id'): f for f in info.get('formats', [])}
+    selected = []
+    for format_id in format_str.split('+'):
+        f = formats.get(format_id)
+        if not f or not f.get('url') or f.get('protocol', 'https') not in STREAMABLE_PROTOCOLS:
+            return None
+        selected.append(f)
+    if len(selected) == 1:
+        f = selected[0]
+        if f.get('vcodec') == 'none' or f.get('acodec') == 'none':
+            return None
+    elif len(selected) != 2 or not shutil.which('ffmpeg'):
+        return None
+    return selected
+
+
+def _ffmpeg_command(formats):
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin']
+    for f in formats:
+        headers = ''.join(f"{k}: {v}\r\n" for k, v in (f.get('http_headers') or {}).items())
+        if headers:
+            cmd += ['-headers', headers]
+        cmd += ['-i', f['url']]
+    if len(formats) == 1:
+        # 单个 HLS 格式：音视频在同一路流中
+        cmd += ['-map', '0:v:0?', '-map', '0:a:0?']
+    else:
+        cmd += ['-map', '0:v:0', '-map', '1:a:0']
+    cmd += [
+        '-c', 'copy',
+        # 空 moov + 按关键帧分片，客户端收到第一个分片即可开始播放
+        '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+        '-f', 'mp4', 'pipe:1',
+    ]
+    return cmd
+
+
+def _proxy_stream(f, video_id):
+    with _session.get(f['url'], headers=f.get('http_headers') or {}, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(CHUNK_SIZE):
+            yield chunk
+
+
+def _ffmpeg_stream(formats, video_id):
+    proc = subprocess.Popen(_ffmpeg_command(formats), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            chunk = proc.stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        proc.wait()
+        if proc.returncode != 0:
+            error = proc.stderr.read().decode('utf-8', 'replace').strip()
+            logger.error(f"ffmpeg 实时封装失败 - ID: {video_id} | 返回码: {proc.returncode} | 错误: {error}")
+    finally:
+        # 客户端断开时 GeneratorExit 会走到这里，结束 ffmpeg 进程
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def _is_hls(f):
+    return str(f.get('protocol', '')).startswith('m3u8')
+
+
+def stream_formats(formats, video_id):
+    """返回边下载边发送的数据生成器"""
+    if len(formats) == 1 and _is_hls(formats[0]):
+        logger.info(f"ffmpeg 实时封装 HLS 格式 - ID: {video_id} | 格式: {formats[0].get('format_id')}")
+        return _ffmpeg_stream(formats, video_id)
+    if len(formats) == 1:
+        logger.info(f"直接代理音视频合一格式 - ID: {video_id} | 格式: {formats[0].get('format_id')}")
+        return _proxy_stream(formats[0], video_id)
+    logger.info(f"ffmpeg 实时封装 - ID: {video_id} | "
+                f"格式: {formats[0].get('format_id')}+{formats[1].get('format_id')}")
+    return _ffmpeg_stream(formats, video_id)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+日志配置：文本或 JSON 格式、按子系统设置级别、请求关联ID、采样，经队列由后台线程写出
+
+环境变量
+  YOUTUBE_LOG_FORMAT            text（默认）/ json，json 为每行一个对象
+  YOUTUBE_LOG_LEVEL             youtube 日志的级别，默认 INFO
+  YOUTUBE_LOG_LEVELS            按子系统覆盖级别，如 "cache=WARNING,ydl_pool=DEBUG"，子系统即 youtube.<名称>
+  YOUTUBE_LOG_SAMPLE_INTERVAL   带 sample_key 的日志（下载进度、格式列表）每个 key 每隔多少秒最多输出一条，
+                                默认 10，0 表示不采样
+  YOUTUBE_LOG_QUEUE_SIZE        日志队列长度，默认 10000，队列满时丢弃并计数；0 表示在调用线程中直接写出
+"""
+import atexit
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+LOG_FORMATS = ('text', 'json')
+
+# 当前请求（或后台任务）的关联ID，线程池中执行时需要用 contextvars.copy_context().run 传递
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# LogRecord 自带的属性，其余属性（extra 传入的字段）输出到 JSON 中
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+# 只供过滤器使用，不输出
+_INTERNAL_ATTRS = {'sample_key', 'request_id', 'suppressed', 'request_prefix', 'suppressed_suffix'}
+
+
+def request_id_from_header(value):
+    """沿用客户端或反向代理传入的 X-Request-ID，格式不合法或未提供时生成新的"""
+    if value and _REQUEST_ID_PATTERN.match(value):
+        return value
+    return uuid.uuid4().hex[:16]
+
+
+def progress_enabled(env_name):
+    """进度条开关：未设置时文本日志下开启，JSON 日志下关闭（进度条会混入日志行）"""
+    value = os.environ.get(env_name)
+    if value is None:
+        return log_format() == 'text'
+    return value == '1'
+
+
+def log_format():
+    fmt = os.environ.get('YOUTUBE_LOG_FORMAT', 'text').lower()
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"不支持的日志格式: {fmt}，可选: {', '.join(LOG_FORMATS)}")
+    return fmt
+
+
+class ContextFilter(logging.Filter):
+    """在调用线程中为日志记录附加请求关联ID"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    带 sample_key 的记录每个 key 每 interval 秒最多通过一条，
+    通过的记录带上 suppressed：上一条之后被丢弃的条数
+    """
+
+    def __init__(self, interval, max_keys=10000):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None or self.interval <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._last.get(key, (None, 0))
+            if last is not None and now - last < self.interval:
+                self._last[key] = (last, suppressed + 1)
+                return False
+            if key not in self._last and len(self._last) >= self.max_keys:
+                # key 通常是视频ID加格式，数量无上限，超出时整体清空
+                self._last.clear()
+            self._last[key] = (now, 0)
+        record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """原有的文本格式，有关联ID时加在消息前面"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(request_prefix)s%(message)s%(suppressed_suffix)s',
+                         datefmt='%m-%d %H:%M:%S')
+
+    def format(self, record):
+        request_id = getattr(record, 'request_id', None)
+        suppressed = getattr(record, 'suppressed', 0)
+        record.request_prefix = f"[{request_id}] " if request_id else ''
+        record.suppressed_suffix = f" (已省略 {suppressed} 条)" if suppressed else ''
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON，extra 传入的字段原样输出"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in _INTERNAL_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """写入有界队列，队列满时丢弃记录并计数，不阻塞调用线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 消息参数和异常堆栈在调用线程中转为文本，后台线程只做格式化和写出
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_state = {'handler': None, 'listener': None, 'output': None, 'queue_size': 0}
+
+
+def _start_listener():
+    handler = _state['handler']
+    handler.queue = queue.Queue(_state['queue_size'])
+    listener = logging.handlers.QueueListener(handler.queue, _state['output'], respect_handler_level=True)
+    listener.start()
+    _state['listener'] = listener
+
+
+def _stop_listener():
+    listener = _state['listener']
+    if listener is not None:
+        _state['listener'] = None
+        listener.stop()
+
+
+def setup_logging():
+    """配置 youtube 日志记录器，重复调用时直接返回"""
+    logger = logging.getLogger('youtube')
+    if _state['output'] is not None:
+        return logger
+
+    logger.setLevel(os.environ.get('YOUTUBE_LOG_LEVEL', 'INFO').upper())
+    for item in os.environ.get('YOUTUBE_LOG_LEVELS', '').split(','):
+        name, sep, level = item.partition('=')
+        if sep:
+            logging.getLogger(f"youtube.{name.strip()}").setLevel(level.strip().upper())
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if log_format() == 'json' else TextFormatter())
+    _state['output'] = output
+
+    queue_size = int(os.environ.get('YOUTUBE_LOG_QUEUE_SIZE', 10000))
+    if queue_size > 0:
+        _state['queue_size'] = queue_size
+        handler = _state['handler'] = NonBlockingQueueHandler(None)
+        _start_listener()
+        atexit.register(_stop_listener)
+        # gunicorn 在 master 中导入应用后 fork，子进程中没有写出线程，需要重新创建队列和线程
+        os.register_at_fork(after_in_child=_start_listener)
+    else:
+        handler = output
+
+    interval = float(os.environ.get('YOUTUBE_LOG_SAMPLE_INTERVAL', 10))
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(interval))
+    logger.addHandler(handler)
+    return logger
+
+
+def stats():
+    handler = _state['handler']
+    if handler is None:
+        return {'queue': False}
+    return {'queue': True, 'queued': handler.queue.qsize(), 'dropped': handler.dropped}
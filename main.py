@@ -3,516 +3,1670 @@
 import logging
 import yt_dlp  # 替换pytube为yt-dlp
 from flask import Flask, request, jsonify, g, stream_with_context, Response, url_for
+from werkzeug.middleware.proxy_fix import ProxyFix
+from prometheus_client import CONTENT_TYPE_LATEST
 import time
 import tempfile
 import os
 import shutil
 import sys
+import uuid
+import copy
+import threading
+import json
+import contextvars
+from requests import RequestException
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse, parse_qs, urlencode
 from tqdm import tqdm
+from media_cache import MediaCache
+from singleflight import SingleFlight, SharedFile
+from ttl_cache import TTLCache
+from ydl_pool import YDLPool
+from jobs import JobManager, QueueFull, FAILED
+from journal import Journal, work_dir_name, lock_dir, dir_size
+from live_stream import STREAMABLE_PROTOCOLS, select_stream_formats, stream_formats
+from formats import parse_formats, select_format, resolve_policy, estimate_size
+from admission import AdmissionController, AdmissionRejected
+from download_options import DownloadOptions, parse_download_options, can_merge, merge_streams
+from transcode import parse_variant, variant_format, run_ffmpeg, ffmpeg_command as transcode_command
+from transfers import TransferRegistry
+import twitter
+import metrics
+from log_config import setup_logging, progress_enabled, request_id_var, request_id_from_header
+import log_config
+from delivery import (DELIVERY_MODES, MAX_CHUNK_SIZE, file_etag, resolve_range,
+                      read_chunks, proxy_redirect_header, ClosingFile)
 
-# 配置日志记录
-def setup_logging():
-    """配置日志记录器"""
-    logger = logging.getLogger(__name__)
-    
-    # 设置日志级别
-    logger.setLevel(logging.DEBUG)
-    
-    # 创建控制台处理器
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG)
-    
-    # 设置日志格式
-    formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%m-%d %H:%M:%S'
-    )
-    console_handler.setFormatter(formatter)
-    
-    # 添加处理器到日志记录器
-    logger.addHandler(console_handler)
-    
-    return logger
-
-# 创建日志记录器
+# 创建日志记录器，格式、级别、采样等配置见 log_config.py
 logger = setup_logging()
+# 按子系统区分，可用 YOUTUBE_LOG_LEVELS 单独调整级别
+download_logger = logging.getLogger('youtube.download')
+transfer_logger = logging.getLogger('youtube.transfer')
+
+# 下载进度条（每个流一个 tqdm）和文件传输进度条；关闭下载进度条时改为按采样间隔输出进度日志
+DOWNLOAD_PROGRESS = progress_enabled('YOUTUBE_DOWNLOAD_PROGRESS')
+PROGRESS_INTERVAL = float(os.environ.get('YOUTUBE_PROGRESS_INTERVAL', 0.5))
+
+# 下载目录：work 存放进行中的下载，cache 存放已完成的媒体文件
+DOWNLOAD_DIR = os.environ.get('YOUTUBE_DOWNLOAD_DIR', '/tmp/youtube')
+WORK_DIR = os.path.join(DOWNLOAD_DIR, 'work')
+CACHE_DIR = os.environ.get('YOUTUBE_CACHE_DIR', os.path.join(DOWNLOAD_DIR, 'cache'))
+# 缓存预算（字节），设为 0 关闭缓存
+CACHE_MAX_BYTES = int(os.environ.get('YOUTUBE_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+# 缓存淘汰策略: lru / lfu
+CACHE_POLICY = os.environ.get('YOUTUBE_CACHE_POLICY', 'lru')
+# 命中次数和访问时间写回磁盘的间隔（秒）
+CACHE_FLUSH_INTERVAL = float(os.environ.get('YOUTUBE_CACHE_FLUSH_INTERVAL', 60))
+
+media_cache = MediaCache(CACHE_DIR, CACHE_MAX_BYTES, CACHE_POLICY)
+
+def flush_media_cache():
+    try:
+        media_cache.flush()
+    except Exception as e:
+        logger.error(f"写回媒体缓存统计失败 - 错误: {str(e)}")
+
+def start_cache_flusher():
+    """后台线程定期写回缓存命中统计，命中路径上不做磁盘写入"""
+    def run():
+        while True:
+            time.sleep(CACHE_FLUSH_INTERVAL)
+            flush_media_cache()
+    threading.Thread(target=run, name='cache-flush', daemon=True).start()
+
+# 下载日志：记录后台任务和中断的下载，重启后续传 .part 文件、恢复未完成的任务
+JOURNAL_PATH = os.environ.get('YOUTUBE_JOURNAL_PATH', os.path.join(DOWNLOAD_DIR, 'journal.sqlite3'))
+# 中断的部分下载保留时间（秒），超过后由垃圾回收删除
+PARTIAL_TTL = int(os.environ.get('YOUTUBE_PARTIAL_TTL', 86400))
+# 工作目录垃圾回收的最小间隔（秒），在开始新的下载时检查
+WORK_GC_INTERVAL = int(os.environ.get('YOUTUBE_WORK_GC_INTERVAL', 600))
+
+journal = Journal(JOURNAL_PATH)
+
+# 视频信息缓存：extract_info 的结果和接口响应，失败结果使用更短的 TTL
+INFO_CACHE_SIZE = int(os.environ.get('YOUTUBE_INFO_CACHE_SIZE', 1024))
+INFO_TTL = int(os.environ.get('YOUTUBE_INFO_TTL', 1800))
+INFO_ERROR_TTL = int(os.environ.get('YOUTUBE_INFO_ERROR_TTL', 60))
+
+info_cache = TTLCache(INFO_CACHE_SIZE, INFO_TTL)
+response_cache = TTLCache(INFO_CACHE_SIZE, INFO_TTL)
+
+# 默认格式策略，可用策略见 formats.POLICIES，请求中可用 policy 参数切换
+default_format_policy = resolve_policy(os.environ.get('YOUTUBE_FORMAT_POLICY', 'default'))
+
+# YoutubeDL 实例池：按用途分配置档复用实例，cookies.txt 修改后自动重新加载
+COOKIE_FILE = 'cookies.txt'
+YDL_POOL_SIZE = int(os.environ.get('YOUTUBE_YDL_POOL_SIZE', 8))
+YDL_MAX_AGE = int(os.environ.get('YOUTUBE_YDL_MAX_AGE', 1800))
+
+ydl_pool = YDLPool({
+    'info': {
+        'format': 'bestvideo[ext=mp4][vcodec!=none]',  
+        'quiet': True,
+        'no_warnings': True,
+        'cookiefile': COOKIE_FILE,
+    },
+    'twitter': {
+        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': True,
+        # 只接受推特的解析器，推文中嵌入的其他网站链接不会被解析和代理
+        'allowed_extractors': ['twitter'],
+    },
+    'playlist': {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'cookiefile': COOKIE_FILE,
+        # 只展开 YouTube 的播放列表和频道，其他网站的地址不会被请求
+        'allowed_extractors': ['youtube:tab', 'youtube:playlist'],
+    },
+    # format、outtmpl、progress_hooks 在每次下载时指定
+    'download': {
+        'merge_output_format': 'mp4',
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,  # 禁用内置进度条显示
+        'cookiefile': COOKIE_FILE,
+    },
+}, size=YDL_POOL_SIZE, max_age=YDL_MAX_AGE, cookiefile=COOKIE_FILE)
+
+# 文件下发模式: auto / stream / x-accel / x-sendfile，见 delivery.py
+DELIVERY_MODE = os.environ.get('YOUTUBE_DELIVERY_MODE', 'auto')
+if DELIVERY_MODE not in DELIVERY_MODES:
+    raise ValueError(f"不支持的文件下发模式: {DELIVERY_MODE}")
+# x-accel 模式下缓存目录在 nginx 中对应的 internal location
+X_ACCEL_PREFIX = os.environ.get('YOUTUBE_X_ACCEL_PREFIX', '/youtube-cache/')
 
 app = Flask(__name__)
+# 前面可信的反向代理层数，只从这几层添加的 X-Forwarded-For/Proto/Host 中取客户端地址，
+# 默认 0 表示直接对外服务，忽略这些请求头（客户端可以伪造）
+TRUSTED_PROXIES = int(os.environ.get('YOUTUBE_TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES, x_host=TRUSTED_PROXIES)
 
-# 添加请求前钩子，记录开始时间
+# 添加请求前钩子，记录开始时间，设置请求关联ID
 @app.before_request
 def before_request():
     g.start_time = time.time()
+    g.request_id = request_id_from_header(request.headers.get('X-Request-ID'))
+    g.request_id_token = request_id_var.set(g.request_id)
+
+@app.teardown_request
+def teardown_request(exc):
+    # 流式响应在发送结束后才执行，期间的日志都带有关联ID
+    if hasattr(g, 'request_id_token'):
+        request_id_var.reset(g.request_id_token)
 
 # 修改请求后钩子，只对非流式响应记录处理时间
 @app.after_request
 def after_request(response):
+    if hasattr(g, 'request_id'):
+        response.headers['X-Request-ID'] = g.request_id
     if hasattr(g, 'start_time'):
         elapsed_time = time.time() - g.start_time
         # 只对非流式响应记录处理时间
-        if not response.direct_passthrough:  # 普通响应
+        if not response.is_streamed:  # 普通响应
             # logger.info(f"请求: {request.path} | 状态码: {response.status_code} | 处理时间: {elapsed_time:.3f}秒")
-            pass
+            metrics.REQUEST_SECONDS.labels(request.endpoint or 'unknown').observe(elapsed_time)
+            if response.is_json:
+                errcode = (response.get_json(silent=True) or {}).get('errcode')
+                if errcode:
+                    metrics.ERRORS.labels(str(errcode)).inc()
     return response
 
-# 添加全局变量来存储下载状态
-download_stats = {}
+def observe_first_byte(mode):
+    """记录从收到请求到发出第一个字节的时间，需要在请求上下文中调用"""
+    if hasattr(g, 'start_time'):
+        metrics.TTFB_SECONDS.labels(mode).observe(time.time() - g.start_time)
 
-# 添加全局变量来跟踪进度条状态
-_transfer_progress_bar = None
+# 进行中的文件传输，按传输ID区分；YOUTUBE_TRANSFER_PROGRESS=0 时不渲染 tqdm 进度条（JSON 日志下默认不渲染）
+def record_transfer(transfer):
+    metrics.BYTES_SERVED.labels(transfer.mode).inc(transfer.bytes_sent)
+    if transfer.completed and transfer.elapsed > 0:
+        metrics.TRANSFER_THROUGHPUT.labels(transfer.mode).observe(transfer.rate)
 
-# 添加新的请求完成钩子
-@app.teardown_request
-def teardown_request(exception=None):
-    """在请求完全结束时（包括流式传输完成后）清理资源"""
-    global _transfer_progress_bar
-    
-    # 清理进度条
-    if _transfer_progress_bar:
-        _transfer_progress_bar.close()
-        _transfer_progress_bar = None
-    
-    # 清理下载统计信息
-    if request.endpoint == 'youtube_download' and request.path in download_stats:
-        stats = download_stats[request.path]
-        if stats.get('completed', False):  # 只在成功完成时记录
-            logger.info(f"数据传输已完成 - 路径: {request.path}")
-        else:
-            logger.info(f"下载请求被中断 - 路径: {request.path}")
-        del download_stats[request.path]  # 清理统计信息
-
-def generate_file(temp_path, request_path, video_id):
-    global _transfer_progress_bar
-    chunk_size = 8192
-    file_size_local = os.path.getsize(temp_path)
-    bytes_sent = 0
-    start_time = time.time()
-    first_chunk_sent = False
-    progress_bar_initialized = False
-    
-    # 确保之前的进度条被清理
-    if _transfer_progress_bar:
-        _transfer_progress_bar.close()
-        _transfer_progress_bar = None
+transfers = TransferRegistry(
+    show_progress=progress_enabled('YOUTUBE_TRANSFER_PROGRESS'),
+    progress_interval=PROGRESS_INTERVAL,
+    on_finish=record_transfer
+)
+
+def generate_file(temp_path, request_path, video_id, start=0, length=None, on_first_byte=None):
+    """
+    分块读取文件的生成器，客户端断开时由 GeneratorExit 结束
+    on_first_byte 在发出第一块数据时调用，默认按 Flask 请求上下文记录首字节时间
+    """
+    on_first_byte = on_first_byte or (lambda: observe_first_byte('stream'))
+    file_size_local = os.path.getsize(temp_path) - start if length is None else length
+    transfer = transfers.start(video_id, request_path, 'stream', file_size_local)
     
     # 先记录传输开始的统计信息
-    logger.info(
+    transfer_logger.info(
         f"开始文件传输 - ID: {video_id} | "
+        f"传输ID: {transfer.id} | "
         f"路径: {request_path} | "
         f"文件大小: {file_size_local/1024/1024:.2f}MB"
     )
     
+    completed = False
     try:
         with open(temp_path, 'rb') as f:
-            while True:
-                chunk = f.read(chunk_size)
-                if not chunk:
-                    break
-                
-                # 先发送第一个数据块
-                if not first_chunk_sent:
-                    first_chunk_sent = True
-                    bytes_sent += len(chunk)
-                    yield chunk
-                    continue
-                
-                # 在第二个数据块之前初始化进度条
-                if not progress_bar_initialized and file_size_local > 0:  # 添加文件大小检查
-                    _transfer_progress_bar = tqdm(
-                        total=file_size_local,
-                        unit='B',
-                        unit_scale=True,
-                        ascii=True,  # 改用 ASCII 字符而不是 Unicode
-                        ncols=90,
-                        mininterval=0.1,
-                        desc=f"传输进度 [{video_id}]",
-                        leave=True,
-                        bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} ({rate_fmt}) [{elapsed}]'
-                    )
-                    # 更新已发送的第一个数据块的进度
-                    _transfer_progress_bar.update(bytes_sent)
-                    progress_bar_initialized = True
-                
-                bytes_sent += len(chunk)
-                if _transfer_progress_bar:
-                    _transfer_progress_bar.update(len(chunk))
+            f.seek(start)
+            for chunk in read_chunks(f, file_size_local):
+                if not transfer.bytes_sent:
+                    on_first_byte()
+                transfer.add(len(chunk))
                 yield chunk
 
-        # 传输完成后记录统计信息
-        end_time = time.time()
-        total_time = end_time - start_time
-        avg_speed = file_size_local / total_time / (1024 * 1024)
-        
-        # 关闭并清理进度条
-        if _transfer_progress_bar:
-            _transfer_progress_bar.close()
-            _transfer_progress_bar = None
-        
-        # 标记为已完成
-        if request_path in download_stats:
-            download_stats[request_path]['completed'] = True
+        completed = True
             
     except GeneratorExit:
-        if _transfer_progress_bar:
-            _transfer_progress_bar.close()
-            _transfer_progress_bar = None
-        logger.info(f"下载被客户端中断 - ID: {video_id} | "
-                   f"路径: {request_path} | "
-                   f"已传输: {bytes_sent/1024/1024:.2f}MB")
+        # 异步服务器在客户端收完 Content-Length 指定的字节并断开后，可能不再请求下一块就关闭生成器
+        completed = transfer.bytes_sent >= file_size_local
+        if not completed:
+            transfer_logger.info(f"下载被客户端中断 - ID: {video_id} | "
+                       f"传输ID: {transfer.id} | "
+                       f"路径: {request_path} | "
+                       f"已传输: {transfer.bytes_sent/1024/1024:.2f}MB")
         raise
+    finally:
+        if completed:
+            transfer_logger.info(f"数据传输已完成 - ID: {video_id} | "
+                        f"传输ID: {transfer.id} | "
+                        f"用时: {transfer.elapsed:.2f}秒 | "
+                        f"平均速度: {transfer.rate/1024/1024:.2f}MB/s")
+        transfers.finish(transfer, completed)
+
+def cached_response(kind, url, build, variant=None, root_url=None):
+    """
+    按 (类型, URL, 变体, 访问地址) 缓存接口响应，player_url 依赖访问地址
+    variant 区分同一 URL 的不同响应（如格式策略）；响应不含本服务地址时 root_url 为 None
+    """
+    key = (kind, url, variant, root_url)
+    video_info = response_cache.get(key)
+    if video_info is not None:
+        return video_info
+    video_info = build(url)
+    ttl = INFO_ERROR_TTL if video_info.get('errcode') else INFO_TTL
+    response_cache.set(key, video_info, ttl)
+    return video_info
+
+def extract_video_info(url):
+    """获取 YouTube 视频的 info dict，优先使用缓存"""
+    info = info_cache.get(url)
+    if info is not None:
+        logger.info(f"命中视频信息缓存 - URL: {url}")
+        return info
+    with ydl_pool.acquire('info') as ydl:
+        # 保存可序列化的副本，下载时通过 process_ie_result 复用
+        with metrics.EXTRACT_SECONDS.labels('youtube').time():
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    info_cache.set(url, info)
+    return info
+
+def download_page_url(root_url, video_id, format_str):
+    """/youtube/download 的完整地址，root_url 为服务根地址（以 / 结尾）"""
+    return f"{root_url}youtube/download?{urlencode({'id': video_id, 'format': format_str})}"
 
 # 使用 yt-dlp 获取 YouTube 视频信息
-def get_video_info(url):
+def get_video_info(url, policy=None, root_url=None):
+    """root_url 默认取当前 Flask 请求的根地址，在请求上下文之外调用时必须指定"""
+    policy = policy or default_format_policy
+    root_url = root_url or request.url_root
+    return cached_response('youtube', url, lambda u: build_video_info(u, policy, root_url),
+                           policy.cache_key(), root_url)
+
+def build_video_info(url, policy, root_url):
     try:
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4][vcodec!=none]',  
-            'quiet': True,
-            'no_warnings': True,
-            'cookiefile': 'cookies.txt',
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            formats = info.get('formats', [])
-            
-            def get_size(f):
-                if not f:
-                    return float('inf')
-                filesize = f.get('filesize')
-                if filesize is not None:
-                    return filesize
-                filesize_approx = f.get('filesize_approx')
-                if filesize_approx is not None:
-                    return filesize_approx
-                return float('inf')
-            
-            video_formats = [f for f in formats if f.get('vcodec') != 'none']
-            
-            logger.info(f"找到 {len(video_formats)} 个视频格式")
-            
-            for f in video_formats:
-                height = f.get('height')
-                if not height:
-                    resolution = f.get('resolution', '')
-                    if 'x' in resolution:
-                        height = int(resolution.split('x')[1])
-                
-                logger.info(f"可用视频格式: ID={f.get('format_id')}, "
-                          f"分辨率={height}p, "
-                          f"编码={f.get('vcodec')}, "
-                          f"音频={f.get('acodec')}, "
-                          f"大小={get_size(f)/(1024*1024):.2f}MB")
-            
-            resolutions = [1080, 720, 480, 360]
-            selected_video_format = None
-            
-            for res in resolutions:
-                matching_formats = [
-                    f for f in video_formats 
-                    if (f.get('height') == res or 
-                        (f.get('resolution', '').endswith(f'x{res}') or 
-                         f.get('resolution', '').startswith(f'{res}x')))
-                ]
-                if matching_formats:
-                    logger.info(f"找到 {len(matching_formats)} 个 {res}p 格式")
-                    mp4_formats = [f for f in matching_formats if f.get('ext', '').lower() == 'mp4']
-                    if mp4_formats:
-                        selected_video_format = mp4_formats[0]
-                        logger.info(f"选择 {res}p 格式，扩展名为 mp4")
-                        break
-            
-            if not selected_video_format:
-                logger.error("未找到合适的视频格式")
-                return {
-                    'errcode': 901, 
-                    'msg': "未找到合适的视频格式"
-                }
-            
-            audio_formats = [
-                f for f in formats 
-                if f.get('acodec') != 'none' and f.get('vcodec') == 'none'
-            ]
-            
-            logger.info(f"找到 {len(audio_formats)} 个音频格式")
-            
-            selected_audio_format = None
-            if audio_formats:
-                def get_audio_quality(f):
-                    tbr = f.get('tbr', 0)
-                    return tbr if tbr is not None else 0
-                
-                selected_audio_format = max(audio_formats, key=get_audio_quality)
-            
-            if not selected_audio_format:
+        info = extract_video_info(url)
+        table = parse_formats(info)
+        logger.info(f"找到 {len(table)} 个格式 - 策略: {policy.name}")
+        # 完整的格式列表只在 DEBUG 级别按采样间隔输出
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("可用格式: " + ', '.join(f"{f.format_id}({f.height or '-'}p/{f.codec or '-'}/{f.ext})"
+                                                 for f in table),
+                         extra={'sample_key': 'formats'})
+        try:
+            selection = select_format(table, policy)
+        except LookupError as e:
+            if e.args[0] == 'audio':
                 logger.error("未找到合适的音频格式")
-                return {
-                    'errcode': 902, 
-                    'msg': "未找到合适的音频格式"
-                }
-            
-            video_size = get_size(selected_video_format)
-            audio_size = get_size(selected_audio_format)
-            total_size = video_size + audio_size
-            
-            format_string = f"{selected_video_format['format_id']}+{selected_audio_format['format_id']}"
-            
-            logger.info(f"选择的视频格式: "
-                        f"ID={selected_video_format.get('format_id')} | "
-                        f"分辨率={selected_video_format.get('height')}p | "
-                        f"大小={video_size/(1024*1024):.2f}MB")
-            logger.info(f"选择的音频格式: "
-                        f"ID={selected_audio_format.get('format_id')} | "
-                        f"比特率={selected_audio_format.get('tbr')}kbps | "
-                        f"大小={audio_size/(1024*1024):.2f}MB")
-            logger.info(f"预计总文件大小: {total_size/(1024*1024):.2f}MB")
-            logger.info(f"最终下载格式字符串: {format_string}")
-            
-            player_url = url_for('youtube_download', id=info.get('id'), format=format_string, _external=True)
-            
-            upload_date = info.get('upload_date', '')
-            formatted_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:]} 00:00:00" if upload_date else ""
-            
-            video_info = {
-                'errcode': 0,
-                'msg': "ok",
-                'title': info.get('title', ''),
-                'vid': info.get('id', ''),
-                'author': info.get('uploader', ''),
-                'published_date': formatted_date,
-                'duration': info.get('duration', 0),
-                'views': info.get('view_count', 0),
-                'description': info.get('description', ''),
-                'thumbnail': info.get('thumbnail', ''),
-                'watch_url': url,
-                'player_url': player_url,
-                'format': format_string,
-                'size': total_size,
-                'size_mb': round(total_size / (1024 * 1024), 2)
-            }
-            return video_info
+                return {'errcode': 902, 'msg': "未找到合适的音频格式"}
+            logger.error("未找到合适的视频格式")
+            return {'errcode': 901, 'msg': "未找到合适的视频格式"}
+
+        video = selection.video
+        total_size = selection.size or 0
+        format_string = selection.format_string
+        logger.info(f"选择的格式: {format_string} | "
+                    f"分辨率={video.height}p | 编码={video.codec} | "
+                    f"{'音视频合一' if selection.muxed else '需要合并'} | "
+                    f"预计大小={total_size/(1024*1024):.2f}MB")
+
+        player_url = download_page_url(root_url, info.get('id'), format_string)
+        
+        upload_date = info.get('upload_date', '')
+        formatted_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:]} 00:00:00" if upload_date else ""
+        
+        video_info = {
+            'errcode': 0,
+            'msg': "ok",
+            'title': info.get('title', ''),
+            'vid': info.get('id', ''),
+            'author': info.get('uploader', ''),
+            'published_date': formatted_date,
+            'duration': info.get('duration', 0),
+            'views': info.get('view_count', 0),
+            'description': info.get('description', ''),
+            'thumbnail': info.get('thumbnail', ''),
+            'watch_url': url,
+            'player_url': player_url,
+            'format': format_string,
+            'size': total_size,
+            'size_mb': round(total_size / (1024 * 1024), 2),
+            'height': video.height,
+            'vcodec': video.codec,
+            'policy': policy.name,
+        }
+        return video_info
     except Exception as e:
         logger.error(f"解析视频信息时发生错误: {str(e)}", exc_info=True)
         return {'errcode': 900, 'msg': f"解析youtube视频信息失败, 错误信息: {str(e)}"}
 
+# 推特下载：变体大小上限（字节），请求中可用 max_size_mb 覆盖
+TWITTER_MAX_BYTES = int(os.environ.get('YOUTUBE_TWITTER_MAX_BYTES', 512 * 1024 * 1024))
+# CDN 地址的缓存时间（秒），地址带有过期时间时取两者中较小的
+TWITTER_URL_TTL = int(os.environ.get('YOUTUBE_TWITTER_URL_TTL', 600))
+# 代理下载的连接池大小
+TWITTER_POOL_SIZE = int(os.environ.get('YOUTUBE_TWITTER_POOL_SIZE', 32))
+# 同一推文在 TWITTER_HIT_WINDOW 秒内被下载 TWITTER_CACHE_HITS 次后写入媒体缓存，0 表示不缓存
+TWITTER_CACHE_HITS = int(os.environ.get('YOUTUBE_TWITTER_CACHE_HITS', 3))
+TWITTER_HIT_WINDOW = int(os.environ.get('YOUTUBE_TWITTER_HIT_WINDOW', 3600))
+
+twitter_client = twitter.TwitterClient(TWITTER_POOL_SIZE)
+twitter_url_cache = TTLCache(INFO_CACHE_SIZE, TWITTER_URL_TTL)
+twitter_hits = twitter.HitCounter(TWITTER_HIT_WINDOW)
+# 热门推文写入媒体缓存的线程，同一推文同时只有一个写入任务
+twitter_cache_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='twitter-cache')
+twitter_caching = set()
+twitter_caching_lock = threading.Lock()
+
+def extract_twitter_info(url):
+    """获取推特视频的 info dict，优先使用缓存"""
+    info = info_cache.get(url)
+    if info is None:
+        with ydl_pool.acquire('twitter') as ydl:
+            with metrics.EXTRACT_SECONDS.labels('twitter').time():
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+        info_cache.set(url, info)
+    return info
+
+def resolve_twitter_variant(url, max_bytes, refresh=False):
+    """
+    选择推特视频的变体，结果按 CDN 地址的有效期缓存
+    refresh 为 True 时丢弃缓存重新解析（CDN 地址失效）；没有可用格式时抛出 LookupError
+    """
+    key = (url, max_bytes)
+    if refresh:
+        twitter_url_cache.pop(key)
+        info_cache.pop(url)
+    else:
+        variant = twitter_url_cache.get(key)
+        if variant is not None:
+            return variant
+    variant = twitter.select_variant(extract_twitter_info(url), url, max_bytes)
+    ttl = TWITTER_URL_TTL
+    if variant.expires_at:
+        ttl = min(ttl, variant.expires_at - time.time() - twitter.EXPIRY_MARGIN)
+    twitter_url_cache.set(key, variant, ttl)
+    logger.info(f"选择推特视频变体 - 推文: {variant.tweet_id} | 格式: {variant.format_id} | "
+                f"码率: {variant.tbr or '未知'}k | "
+                f"大小: {f'{variant.size/1024/1024:.2f}MB' if variant.size else '未知'} | "
+                f"{'HLS' if variant.hls else 'MP4'}")
+    return variant
+
+def twitter_download_url(root_url, url):
+    """/twitter/download 的完整地址"""
+    return f"{root_url}twitter/download?{urlencode({'url': url})}"
+
 # 获取推特视频信息
-def get_twitter_video_info(url):
+def get_twitter_video_info(url, root_url=None):
+    """root_url 与 get_video_info 相同，默认取当前 Flask 请求的根地址"""
+    root_url = root_url or request.url_root
+    return cached_response('twitter', url, lambda u: build_twitter_video_info(u, root_url),
+                           root_url=root_url)
+
+def build_twitter_video_info(url, root_url):
     try:
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+        info = extract_twitter_info(url)
+        try:
+            # 与 /twitter/download 共用变体缓存
+            variant = resolve_twitter_variant(url, TWITTER_MAX_BYTES)
+        except LookupError:
+            variant = None
+        # CDN 地址带签名会过期，player_url 指向本服务的代理下载地址
+        player_url = twitter_download_url(root_url, url) if variant else None
+        upload_date = info.get('upload_date', '')
+        formatted_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:]} 00:00:00" if upload_date else ""
 
-            formats = info.get('formats', [])
-            best_format = next(
-                (f for f in reversed(formats) if f.get('acodec') != 'none' and f.get('vcodec') != 'none'), None)
-            player_url = best_format['url'] if best_format else None
-            upload_date = info.get('upload_date', '')
-            formatted_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:]} 00:00:00" if upload_date else ""
-
-            video_info = {
-                'errcode': 0,
-                'msg': "ok",
-                'title': info.get('title', ''),
-                'vid': info.get('id', ''),
-                'author': info.get('uploader', ''),
-                'published_date': formatted_date,
-                'duration': info.get('duration', 0),
-                'views': info.get('view_count', 0),
-                'description': info.get('description', ''),
-                'thumbnail': info.get('thumbnail', ''),
-                'watch_url': url,
-                'player_url': player_url
-            }
-            return video_info
+        video_info = {
+            'errcode': 0,
+            'msg': "ok",
+            'title': info.get('title', ''),
+            'vid': info.get('id', ''),
+            'author': info.get('uploader', ''),
+            'published_date': formatted_date,
+            'duration': info.get('duration', 0),
+            'views': info.get('view_count', 0),
+            'description': info.get('description', ''),
+            'thumbnail': info.get('thumbnail', ''),
+            'watch_url': url,
+            'player_url': player_url,
+            'cdn_url': variant.url if variant else None,
+            'format': variant.format_id if variant else None,
+            'size': variant.size if variant else None,
+            'tbr': variant.tbr if variant else None,
+        }
+        return video_info
     except Exception as e:
         return {'errcode': 900, 'msg': f"解析推特视频信息失败, 错误信息: {e}"}
 
+# 请求中可以覆盖的格式策略参数
+POLICY_OVERRIDES = ('max_height', 'codec', 'container', 'max_size_mb', 'max_tbr', 'muxed')
+
+def request_format_policy(params):
+    """从请求参数解析格式策略，参数非法时抛出 ValueError"""
+    return resolve_policy(params.get('policy'), {k: params.get(k) for k in POLICY_OVERRIDES},
+                          default=default_format_policy.name)
+
+# 以下 *_response 函数与框架无关，由 main.py 和 async_app.py 的路由共用
+def youtube_info_response(args, root_url):
+    """/youtube 的响应内容"""
+    try:
+        policy = request_format_policy(args)
+    except ValueError as e:
+        return {'errcode': 400, 'msg': str(e)}
+    url = f"https://www.youtube.com/watch?v={args.get('id')}"
+    return get_video_info(url, policy, root_url)
+
+def twitter_info_response(args, root_url):
+    """/twitter 的响应内容"""
+    url = args.get("url")
+    if not url:
+        return {'errcode': 400, 'msg': "缺少url参数"}
+    if not twitter.is_twitter_url(url):
+        return {'errcode': 400, 'msg': "无效的推特URL"}
+    return get_twitter_video_info(url, root_url)
+
 @app.route("/youtube")
 def youtube_info():
-    video_id = request.args.get("id")
-    url = f"https://www.youtube.com/watch?v={video_id}"
-    video_info = get_video_info(url)
-    return jsonify(video_info)
+    return jsonify(youtube_info_response(request.args, request.url_root))
 
 @app.route("/twitter")
 def twitter_info():
-    url = request.args.get("url")
-    if not url:
-        return jsonify({'errcode': 400, 'msg': "缺少url参数"})
-    
-    if "twitter.com" in url or "x.com" in url:
-        video_info = get_twitter_video_info(url)
-        return jsonify(video_info)
-    else:
-        return jsonify({'errcode': 400, 'msg': "无效的推特URL"})
+    return jsonify(twitter_info_response(request.args, request.url_root))
 
-@app.route("/youtube/download")
-def youtube_download():
-    temp_dir = None
-    temp_path = None
-    data = (request.get_json() or request.form) if request.method == 'POST' else {}
-    video_id = data.get("id") or request.args.get("id")
-    format_str = data.get("format") or request.args.get("format")
+# 批量解析配置：并发解析线程数、单次请求最多解析的视频数（含播放列表展开）
+BATCH_WORKERS = int(os.environ.get('YOUTUBE_BATCH_WORKERS', 8))
+BATCH_MAX_ITEMS = int(os.environ.get('YOUTUBE_BATCH_MAX_ITEMS', 500))
+
+# 所有批量请求共享一个有界线程池
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+# 路径中第二段为视频ID的单视频地址
+YOUTUBE_VIDEO_PATHS = ('shorts', 'embed', 'live', 'v')
+
+def _host_matches(host, domain):
+    """主机为 domain 本身或它的子域名"""
+    return host == domain or host.endswith(f".{domain}")
+
+def parse_batch_item(item):
+    """
+    将批量请求中的一项解析为 (类型, 规范化URL)
+    类型为 youtube / twitter / playlist，无法识别时返回 None
+    """
+    item = str(item).strip()
+    if not item:
+        return None
+    # 不含 / 的视为 YouTube 视频ID
+    if '/' not in item:
+        return 'youtube', f"https://www.youtube.com/watch?v={item}"
+
+    url = item if '://' in item else f"https://{item}"
+    if twitter.is_twitter_url(url):
+        return 'twitter', url
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https'):
+        return None
+    host = (parsed.hostname or '').lower()
+    query = parse_qs(parsed.query)
+    segments = [segment for segment in parsed.path.split('/') if segment]
+    if _host_matches(host, 'youtu.be'):
+        if segments:
+            return 'youtube', f"https://www.youtube.com/watch?v={segments[0]}"
+        return None
+    if _host_matches(host, 'youtube.com'):
+        if parsed.path == '/watch' and 'v' in query:
+            return 'youtube', f"https://www.youtube.com/watch?v={query['v'][0]}"
+        # /embed/videoseries?list=... 是播放列表
+        if len(segments) >= 2 and segments[0] in YOUTUBE_VIDEO_PATHS and segments[1] != 'videoseries':
+            return 'youtube', f"https://www.youtube.com/watch?v={segments[1]}"
+        # 播放列表、频道等需要先展开
+        return 'playlist', url
+    return None
+
+def batch_items(data):
+    """批量请求中要解析的条目，参数缺失或类型不对时抛出 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError("请求体必须是JSON对象")
+    items = data.get('items')
+    if not items:
+        ids = data.get('ids') or []
+        urls = data.get('urls') or []
+        if not isinstance(ids, list) or not isinstance(urls, list):
+            raise ValueError("ids和urls参数必须是数组")
+        items = ids + urls
+    if not isinstance(items, list) or not items:
+        raise ValueError("缺少items参数")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"单次最多解析 {BATCH_MAX_ITEMS} 个视频")
+    return items
+
+def expand_playlist(url):
+    """
+    用 extract_flat 展开播放列表或频道，只获取视频ID不解析格式
+    多取一个条目，调用方据此判断播放列表是否超出 BATCH_MAX_ITEMS
+    """
+    with ydl_pool.acquire('playlist', playlistend=BATCH_MAX_ITEMS + 1) as ydl:
+        with metrics.EXTRACT_SECONDS.labels('playlist').time():
+            info = ydl.extract_info(url, download=False)
+    entries = []
+    for entry in info.get('entries') or []:
+        if entry and entry.get('id'):
+            entries.append(entry['id'])
+    return entries
+
+def queue_playlist(url, video_ids, submit):
+    """
+    将展开的视频交给 submit(kind, url) 排队解析，返回播放列表的汇总行
+    超出 BATCH_MAX_ITEMS 的视频不再解析，汇总行中 truncated 为 true
+    """
+    truncated = len(video_ids) > BATCH_MAX_ITEMS
+    count = 0
+    for video_id in video_ids[:BATCH_MAX_ITEMS]:
+        if submit('youtube', f"https://www.youtube.com/watch?v={video_id}"):
+            count += 1
+        else:
+            truncated = True
+    if truncated:
+        logger.warning(f"播放列表超出批量解析上限，只解析前 {count} 个视频 - URL: {url}")
+    return {'errcode': 0, 'msg': "ok", 'playlist': url, 'count': count, 'truncated': truncated}
+
+def resolve_batch_item(kind, url, policy=None, root_url=None):
+    if kind == 'playlist':
+        try:
+            return expand_playlist(url)
+        except Exception as e:
+            logger.error(f"展开播放列表失败 - URL: {url} | 错误: {str(e)}")
+            return {'errcode': 900, 'msg': f"展开播放列表失败, 错误信息: {str(e)}"}
+    if kind == 'twitter':
+        return get_twitter_video_info(url, root_url)
+    return get_video_info(url, policy, root_url)
+
+@app.route("/youtube/batch", methods=['POST'])
+def youtube_batch():
+    """批量解析视频信息，结果以 NDJSON 按完成顺序逐行返回"""
+    data = request.get_json(silent=True) or {}
+    try:
+        items = batch_items(data)
+        policy = request_format_policy(data)
+    except ValueError as e:
+        return jsonify({'errcode': 400, 'msg': str(e)})
+
+    logger.info(f"开始批量解析 - 数量: {len(items)}")
+    # 解析在线程池中进行，访问地址在这里取出，player_url 和响应缓存依赖它
+    root_url = request.url_root
+
+    def generate():
+        futures = {}
+        seen = set()
+        start_time = time.time()
+        resolved = 0
+
+        def submit(kind, url, item):
+            """返回 False 表示已达到 BATCH_MAX_ITEMS，条目没有排队"""
+            if url in seen:
+                return True
+            if len(seen) >= BATCH_MAX_ITEMS:
+                return False
+            seen.add(url)
+            future = batch_executor.submit(contextvars.copy_context().run, resolve_batch_item,
+                                           kind, url, policy, root_url)
+            futures[future] = (kind, url, item)
+            return True
+
+        for item in items:
+            parsed = parse_batch_item(item)
+            if parsed is None:
+                yield json.dumps({'item': item, 'errcode': 400, 'msg': "无法识别的视频ID或URL"},
+                                 ensure_ascii=False) + '\n'
+                continue
+            submit(*parsed, item)
+
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, url, item = futures.pop(future)
+                    result = future.result()
+                    if kind == 'playlist' and isinstance(result, list):
+                        result = queue_playlist(url, result, lambda k, u: submit(k, u, item))
+                    resolved += 1
+                    yield json.dumps({'item': item, **result}, ensure_ascii=False) + '\n'
+            logger.info(f"批量解析完成 - 数量: {resolved} | 用时: {time.time() - start_time:.2f}秒")
+        except GeneratorExit:
+            for future in futures:
+                future.cancel()
+            logger.info(f"批量解析被客户端中断 - 已完成: {resolved}")
+            raise
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def collect_cache_stats():
+    return {
+        'errcode': 0,
+        'msg': "ok",
+        'info_cache': info_cache.stats(),
+        'response_cache': response_cache.stats(),
+        'twitter_url_cache': twitter_url_cache.stats(),
+        'media_cache': {
+            'entries': len(media_cache),
+            'size': media_cache.size,
+            'max_bytes': media_cache.max_bytes,
+            'policy': media_cache.policy,
+        },
+    }
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(collect_cache_stats())
+
+def file_response(path, video_id, on_close, filename=None, mimetype='video/mp4'):
+    """
+    构造文件响应，支持 ETag/If-None-Match 和单区间 Range
+    on_close 在响应结束后调用（释放缓存或清理临时文件）
+    filename 默认为 <视频ID>.mp4
+    """
+    filename = filename or f"{video_id}.mp4"
+    stat = os.stat(path)
+    etag = file_etag(stat)
+
+    def finish(response, close_callback=on_close):
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        # 注册回调函数，在响应结束后清理文件
+        if close_callback:
+            response.call_on_close(close_callback)
+        return response
+
+    if request.if_none_match.contains_weak(etag):
+        return finish(Response(status=304))
+
+    # 交给反向代理发送：只用于缓存中的文件，临时文件在响应结束后就会被删除
+    if DELIVERY_MODE in ('x-accel', 'x-sendfile') and \
+            os.path.dirname(os.path.abspath(path)) == os.path.abspath(CACHE_DIR):
+        header = proxy_redirect_header(DELIVERY_MODE, path, CACHE_DIR, X_ACCEL_PREFIX)
+        if header:
+            transfer_logger.info(f"交由反向代理发送文件 - ID: {video_id} | {header[0]}: {header[1]}")
+            response = Response(mimetype=mimetype)
+            response.headers[header[0]] = header[1]
+            return finish(response)
+
+    status, start, length = resolve_range(request, stat.st_size, etag)
+    if status == 416:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f"bytes */{stat.st_size}"
+        return finish(response)
+
+    # wsgi.file_wrapper 会一直发送到文件末尾，只用于到达文件末尾的区间
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if DELIVERY_MODE == 'auto' and file_wrapper and start + length == stat.st_size:
+        # 由服务器 sendfile 发送，进程内无法统计已发送字节数
+        transfer = transfers.start(video_id, request.path, 'sendfile', length)
+
+        def close_sendfile():
+            # 字节数按响应长度计
+            transfer.add(length)
+            transfers.finish(transfer, completed=True)
+            on_close()
+
+        f = ClosingFile(open(path, 'rb'), close_sendfile)
+        f.seek(start)
+        observe_first_byte('sendfile')
+        transfer_logger.info(
+            f"开始文件传输(file_wrapper) - ID: {video_id} | "
+            f"传输ID: {transfer.id} | "
+            f"路径: {request.path} | "
+            f"大小: {length/1024/1024:.2f}MB"
+        )
+        response = Response(file_wrapper(f, MAX_CHUNK_SIZE), status=status,
+                            mimetype=mimetype, direct_passthrough=True)
+        response.headers['Content-Length'] = length
+        if status == 206:
+            response.headers['Content-Range'] = f"bytes {start}-{start + length - 1}/{stat.st_size}"
+        # 回调由 ClosingFile 在文件关闭时执行
+        return finish(response, close_callback=None)
+
+    response = Response(
+        stream_with_context(generate_file(path, request.path, video_id, start, length)),
+        status=status,
+        mimetype=mimetype
+    )
+    response.headers['Content-Length'] = length
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{start + length - 1}/{stat.st_size}"
+    return finish(response)
+
+def generate_live(formats, video_id, request_path, on_first_byte=None):
+    """边下载边发送的数据生成器，on_first_byte 与 generate_file 相同"""
+    on_first_byte = on_first_byte or (lambda: observe_first_byte('live'))
+    transfer = transfers.start(video_id, request_path, 'live')
+    completed = False
+    try:
+        for chunk in stream_formats(formats, video_id):
+            if not transfer.bytes_sent:
+                transfer_logger.info(f"首字节已发送 - ID: {video_id} | 用时: {transfer.elapsed:.2f}秒")
+                on_first_byte()
+            transfer.add(len(chunk))
+            yield chunk
+        completed = True
+        transfer_logger.info(f"边下载边发送完成 - ID: {video_id} | "
+                    f"已传输: {transfer.bytes_sent/1024/1024:.2f}MB | 用时: {transfer.elapsed:.2f}秒")
+    except GeneratorExit:
+        transfer_logger.info(f"下载被客户端中断 - ID: {video_id} | "
+                    f"已传输: {transfer.bytes_sent/1024/1024:.2f}MB")
+        raise
+    finally:
+        transfers.finish(transfer, completed)
+
+def acquire_live_slot(client):
+    """
+    边下载边发送的每个请求都有自己的 ffmpeg 进程和上游连接，与普通下载一样占用一个下载名额，
+    计入全局和每个客户端的并发上限；最多等待 DOWNLOAD_WAIT 秒，资源不足时抛出 AdmissionRejected
+    """
+    return admission.acquire(client or 'local', 0, timeout=DOWNLOAD_WAIT)
+
+def live_stream_response(url, video_id, format_str, client=None):
+    """
+    边下载边发送，没有 Content-Length，使用分块传输
+    格式无法实时封装时返回 None，由调用方回退到普通下载；名额不足时抛出 AdmissionRejected
+    """
+    info = extract_video_info(url)
+    formats = select_stream_formats(info, format_str)
+    if not formats:
+        logger.info(f"格式不支持边下载边发送，回退到普通下载 - ID: {video_id} | 格式: {format_str}")
+        return None
+
+    reservation = acquire_live_slot(client)
+    response = Response(stream_with_context(generate_live(formats, video_id, request.path)),
+                        mimetype='video/mp4')
+    # 响应结束或客户端断开（包括响应体从未开始发送）时归还名额
+    response.call_on_close(reservation.release)
+    response.headers['Content-Disposition'] = f'attachment; filename="{video_id}.mp4"'
+    return response
+
+class DownloadFailed(Exception):
+    """下载失败，errcode/msg 直接返回给客户端"""
+
+    def __init__(self, errcode, msg):
+        super().__init__(msg)
+        self.errcode = errcode
+        self.msg = msg
+
+# 进行中的下载任务，相同 (视频ID, 格式) 的并发请求共享同一个 yt-dlp 任务
+download_flights = SingleFlight()
+
+# 准入控制：按预估大小预留工作目录的磁盘空间，并限制全局和每个客户端的并发下载数
+ADMISSION_BUDGET = int(os.environ.get('YOUTUBE_WORK_BUDGET_BYTES', 0))
+ADMISSION_MIN_FREE = int(os.environ.get('YOUTUBE_MIN_FREE_BYTES', 1024 * 1024 * 1024))
+MAX_DOWNLOADS = int(os.environ.get('YOUTUBE_MAX_DOWNLOADS', 8))
+DOWNLOADS_PER_CLIENT = int(os.environ.get('YOUTUBE_DOWNLOADS_PER_CLIENT', 2))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get('YOUTUBE_DOWNLOAD_QUEUE_SIZE', 64))
+# 同步下载请求最多排队等待的秒数，超时后返回 Retry-After
+DOWNLOAD_WAIT = float(os.environ.get('YOUTUBE_DOWNLOAD_WAIT', 30))
+RETRY_AFTER = int(os.environ.get('YOUTUBE_RETRY_AFTER', 30))
+# 格式大小和码率都未知时的预估值
+DEFAULT_ESTIMATE = int(os.environ.get('YOUTUBE_DEFAULT_ESTIMATE_BYTES', 512 * 1024 * 1024))
+# 后台任务最多排队等待的秒数，0 表示一直等待
+JOB_DOWNLOAD_WAIT = float(os.environ.get('YOUTUBE_JOB_DOWNLOAD_WAIT', 3600)) or None
+
+# 下载网络并发的默认值，请求中可用 fragments/parallel/chunk_size/downloader 覆盖
+MAX_CONCURRENT_FRAGMENTS = int(os.environ.get('YOUTUBE_MAX_CONCURRENT_FRAGMENTS', 16))
+default_download_options = parse_download_options({
+    'fragments': os.environ.get('YOUTUBE_CONCURRENT_FRAGMENTS', 4),
+    'parallel': os.environ.get('YOUTUBE_PARALLEL_STREAMS', 1),
+    'chunk_size': os.environ.get('YOUTUBE_HTTP_CHUNK_SIZE', 0),
+    'downloader': os.environ.get('YOUTUBE_EXTERNAL_DOWNLOADER', 'native'),
+}, DownloadOptions(), MAX_CONCURRENT_FRAGMENTS)
+
+def request_download_options(params):
+    """从请求参数解析下载参数，参数非法时抛出 ValueError"""
+    return parse_download_options(params, default_download_options, MAX_CONCURRENT_FRAGMENTS)
+
+admission = AdmissionController(
+    DOWNLOAD_DIR,
+    budget_bytes=ADMISSION_BUDGET,
+    min_free_bytes=ADMISSION_MIN_FREE,
+    max_active=MAX_DOWNLOADS,
+    per_client=DOWNLOADS_PER_CLIENT,
+    max_waiting=DOWNLOAD_QUEUE_SIZE,
+    retry_after=RETRY_AFTER,
+)
+
+def request_client(req=None):
+    """
+    客户端标识，用于按客户端限制并发；经过可信代理时由 ProxyFix 换成代理记录的客户端地址
+    req 默认为当前 Flask 请求，async_app 传入 Quart 的请求
+    """
+    return (request if req is None else req).remote_addr
+
+def admission_rejected_response(e):
+    """准入被拒绝时的 (响应内容, 状态码, 响应头)"""
+    headers = {'Retry-After': str(e.retry_after)} if e.retry_after else {}
+    return {'errcode': e.errcode, 'msg': e.msg}, e.errcode, headers
 
+def download_failed(video_id, e):
+    """把 yt-dlp 的 DownloadError 转换为返回给客户端的 DownloadFailed"""
+    error_str = str(e).lower()  # 转换为小写以进行更可靠的匹配
+    if "sign in to confirm" in error_str:  # 简化匹配条件
+        download_logger.error(f"YouTube需要授权访问,可能cookies.txt文件配置错误")
+        return DownloadFailed(403, "需要YouTube授权，请联系管理员!")
+    download_logger.error(f"下载错误 - ID: {video_id} | 错误: {str(e)}")
+    first_line = str(e).split('\n')[0]
+    return DownloadFailed(901, f"视频下载失败: {first_line}")
+
+_gc_lock = threading.Lock()
+_gc_state = {'last': 0.0}
+
+def collect_work_garbage(force=False):
+    """清理过期的部分下载和残留的工作目录，非强制时按 WORK_GC_INTERVAL 节流"""
+    with _gc_lock:
+        now = time.time()
+        if not force and now - _gc_state['last'] < WORK_GC_INTERVAL:
+            return
+        _gc_state['last'] = now
+        try:
+            removed, freed = journal.collect_garbage(WORK_DIR, PARTIAL_TTL)
+        except Exception as e:
+            logger.error(f"清理工作目录失败 - 错误: {str(e)}")
+            return
+    if removed:
+        logger.info(f"已清理工作目录 - 目录数: {removed} | 释放: {freed/1024/1024:.2f}MB")
+
+def estimate_download_size(info, format_str):
+    """
+    下载需要预留的磁盘空间
+    格式大小未知时按视频时长和码率估算，都未知时使用 DEFAULT_ESTIMATE；
+    估算值不超过磁盘能提供的空间，否则只是猜测的大小就会被准入控制拒绝
+    """
+    estimated = estimate_size(info, format_str)
+    guessed = estimated is None
+    if guessed:
+        duration, tbr = info.get('duration'), info.get('tbr')
+        estimated = int(tbr * 1000 / 8 * duration) if duration and tbr else DEFAULT_ESTIMATE
+    if '+' in format_str:
+        # 合并时音视频分片和输出文件同时存在
+        estimated *= 2
+    if guessed:
+        capacity = admission.capacity()
+        if capacity:
+            estimated = min(estimated, capacity)
+    return estimated
+
+def download_video(video_id, format_str, progress=None, client=None, wait=None, options=None):
+    """
+    下载并合并视频，返回 SharedFile
+    文件优先发布到媒体缓存；超出缓存预算时保留在工作目录，最后一个使用者释放后删除
+    progress 为可选的进度回调，以关键字参数接收 phase/stream/format_id/downloaded_bytes/total_bytes
+    client/wait 用于准入控制：按客户端排队，最多等待 wait 秒（None 表示一直等待），
+    资源不足时抛出 AdmissionRejected
+    options 为 DownloadOptions，默认使用部署配置
+    """
+    if progress is None:
+        progress = lambda **fields: None
+    options = options or default_download_options
+
+    # 可能刚有相同任务完成并写入缓存
+    cache_entry = media_cache.lookup(video_id, format_str)
+    if cache_entry:
+        return SharedFile(cache_entry.path, lambda: media_cache.release(cache_entry))
+
+    url = f"https://www.youtube.com/watch?v={video_id}"
+
+    # 先解析视频信息，按格式大小预留磁盘空间
     try:
-        if not video_id:
-            return jsonify({'errcode': 400, 'msg': "缺少视频ID参数"})
-        if not format_str:
-            return jsonify({'errcode': 400, 'msg': "缺少format参数"})
-
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        logger.info(f"开始处理YouTube视频下载请求 - ID: {video_id} | URL: {url} | 格式: {format_str}")
-
-        # 使用固定的临时目录
-        temp_dir = "/tmp/youtube"
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
+        info = extract_video_info(url)
+    except yt_dlp.utils.DownloadError as e:
+        raise download_failed(video_id, e)
+    estimated = estimate_download_size(info, format_str)
+    progress(phase='waiting')
+    reservation = admission.acquire(client or 'local', estimated, timeout=wait)
+
+    work_lock = None
+    try:
+        collect_work_garbage()
+        # 相同 (视频ID, 格式) 使用固定的工作目录，yt-dlp 从上次中断留下的 .part 文件续传；
+        # 同一进程内的相同下载已由 download_flights 合并，目录被其他进程锁住时改用独立的临时目录
+        temp_dir = os.path.join(WORK_DIR, work_dir_name(video_id, format_str))
+        work_lock = lock_dir(temp_dir)
+        resumable = work_lock is not None
+        if not resumable:
+            temp_dir = os.path.join(WORK_DIR, uuid.uuid4().hex)
+            work_lock = lock_dir(temp_dir)
         temp_path = os.path.join(temp_dir, f"{video_id}.mp4")
-        logger.info(f"使用临时目录 - ID: {video_id} | 路径: {temp_dir}")
+        partial_bytes = dir_size(temp_dir)
+        journal.start_download(temp_dir, video_id, format_str)
+    except BaseException:
+        # 准备工作目录失败时归还预留的空间和名额，之后由 cleanup 负责
+        if work_lock is not None:
+            work_lock.close()
+        reservation.release()
+        raise
+    download_logger.info(f"使用临时目录 - ID: {video_id} | 路径: {temp_dir} | "
+                f"预留空间: {estimated/1024/1024:.1f}MB")
+    if partial_bytes:
+        download_logger.info(f"发现中断的下载，继续下载 - ID: {video_id} | 格式: {format_str} | "
+                    f"已有: {partial_bytes/1024/1024:.2f}MB")
 
-        # 修改进度条逻辑
-        progress_bar = None
-        total_bytes = 0
-        current_file = None
-        downloaded_streams = set()  # 用于跟踪已下载完成的流
-        
-        def progress_hook(d):
-            nonlocal progress_bar, total_bytes, current_file, downloaded_streams
-            
-            if d['status'] == 'downloading':
-                # 获取当前下载的文件信息
-                format_id = d.get('info_dict', {}).get('format_id', '')
-                vcodec = d.get('info_dict', {}).get('vcodec', '')
-                acodec = d.get('info_dict', {}).get('acodec', '')
-                
-                # 判断是视频流还是音频流
-                stream_type = "视频" if vcodec != 'none' else "音频" if acodec != 'none' else "未知"
-                
-                # 如果是新的文件，更新进度条
-                if format_id != current_file:
-                    current_file = format_id
-                    if progress_bar:
-                        progress_bar.close()
-                    total_bytes = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
-                    progress_bar = tqdm(
-                        total=total_bytes,
-                        unit='B',
-                        unit_scale=True,
-                        desc=f"下载{stream_type}流 [{video_id}] (格式: {format_id})",
-                        ncols=90,
-                        ascii=True,
-                        mininterval=0.1,
-                        bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} ({rate_fmt}) [{elapsed}]'
-                    )
-                
-                # 更新进度
-                if progress_bar:
-                    downloaded = d.get('downloaded_bytes', 0)
+    def cleanup(keep_partial=False):
+        """keep_partial: 下载中断时保留部分文件，之后的相同请求继续下载"""
+        try:
+            if keep_partial:
+                journal.interrupt_download(temp_dir)
+                download_logger.info(f"保留部分下载文件 - ID: {video_id} | 路径: {temp_dir} | "
+                            f"大小: {dir_size(temp_dir)/1024/1024:.2f}MB")
+            else:
+                if os.path.exists(temp_dir):
+                    shutil.rmtree(temp_dir)
+                    download_logger.info(f"已清理临时文件 - ID: {video_id} | 路径: {temp_path}")
+                journal.finish_download(temp_dir)
+        except Exception as e:
+            download_logger.error(f"清理临时文件失败 - ID: {video_id} | 错误: {str(e)}")
+        finally:
+            work_lock.close()
+            reservation.release()
+
+    # 每个流一个进度条，音视频并行下载时两个流同时更新
+    progress_bars = {}
+    stream_totals = {}
+    downloaded_streams = set()  # 用于跟踪已下载完成的流
+    hook_lock = threading.Lock()
+    merge_started = None
+    stream_ids = format_str.split('+')
+    # 音视频并行下载：两个格式都在已解析的信息中时，分别下载后由 ffmpeg 合并
+    format_ids = {f.get('format_id') for f in info.get('formats') or []}
+    parallel = (options.parallel_streams and len(stream_ids) == 2
+                and all(fid in format_ids for fid in stream_ids) and can_merge())
+
+    def progress_hook(d):
+        nonlocal merge_started
+
+        # 获取当前下载的文件信息
+        info_dict = d.get('info_dict', {})
+        format_id = info_dict.get('format_id', '')
+        vcodec = info_dict.get('vcodec', '')
+        acodec = info_dict.get('acodec', '')
+
+        if d['status'] == 'downloading':
+            # 判断是视频流还是音频流
+            stream_type = "视频" if vcodec != 'none' else "音频" if acodec != 'none' else "未知"
+            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            downloaded = d.get('downloaded_bytes', 0)
+
+            with hook_lock:
+                # 分片下载时只有第一次回调带有总大小
+                total_bytes = stream_totals.setdefault(format_id, total_bytes) or total_bytes
+                if DOWNLOAD_PROGRESS:
+                    # 如果是新的文件，创建进度条
+                    progress_bar = progress_bars.get(format_id)
+                    if progress_bar is None:
+                        progress_bar = progress_bars[format_id] = tqdm(
+                            total=total_bytes,
+                            unit='B',
+                            unit_scale=True,
+                            desc=f"下载{stream_type}流 [{video_id}] (格式: {format_id})",
+                            ncols=90,
+                            ascii=True,
+                            mininterval=PROGRESS_INTERVAL,
+                            bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} ({rate_fmt}) [{elapsed}]'
+                        )
+                    # 更新进度
                     progress_bar.update(downloaded - progress_bar.n)
-            
-            elif d['status'] == 'finished':
+            if not DOWNLOAD_PROGRESS:
+                # 每个流按采样间隔输出一条
+                percent = f"{downloaded / total_bytes:.0%}" if total_bytes else "未知"
+                download_logger.info(
+                    f"下载{stream_type}流 - ID: {video_id} | 格式: {format_id} | "
+                    f"进度: {percent} | 已下载: {downloaded/1024/1024:.2f}MB",
+                    extra={'sample_key': f"progress:{video_id}:{format_id}", 'video_id': video_id,
+                           'format_id': format_id, 'downloaded_bytes': downloaded, 'total_bytes': total_bytes})
+            progress(
+                phase='downloading',
+                stream='video' if vcodec != 'none' else 'audio' if acodec != 'none' else 'unknown',
+                format_id=format_id,
+                downloaded_bytes=downloaded,
+                total_bytes=total_bytes,
+            )
+
+        elif d['status'] == 'finished':
+            with hook_lock:
+                progress_bar = progress_bars.pop(format_id, None)
                 if progress_bar:
                     progress_bar.close()
-                    progress_bar = None
-                
                 # 记录已完成的流
-                if current_file:
-                    downloaded_streams.add(current_file)
-                    
-                # 如果是分开的视频和音频流，检查是否都已下载完成
-                if '+' in format_str:
-                    expected_streams = set(format_str.split('+'))
-                    if downloaded_streams == expected_streams:
-                        logger.info("开始合并MP4视频...")
+                downloaded_streams.add(format_id)
+
+                # 如果是分开的视频和音频流，检查是否都已下载完成（并行下载时由下面的代码合并）
+                if len(stream_ids) > 1 and not parallel and downloaded_streams == set(stream_ids):
+                    download_logger.info("开始合并MP4视频...")
+                    merge_started = time.time()
+                    progress(phase='merging')
+
+    def fetch(ydl_opts):
+        with ydl_pool.acquire('download', **ydl_opts) as ydl:
+            # 复用已解析的视频信息，跳过再次解析
+            try:
+                ydl.process_ie_result(copy.deepcopy(info), download=True)
+            except yt_dlp.utils.DownloadError as e:
+                # 缓存中的流地址可能已失效，重新解析后再试一次
+                download_logger.warning(f"缓存的视频信息不可用，重新解析 - ID: {video_id} | 错误: {str(e)}")
+                info_cache.pop(url)
+                ydl.download([url])
+
+    ydl_opts = {
+        'format': format_str,
+        'outtmpl': temp_path,
+        'progress_hooks': [progress_hook],
+        **options.ydl_params(),
+    }
+
+    start_time = time.time()
+    download_logger.info(f"开始下载视频... {options.describe()}")
         
-        ydl_opts = {
-            'format': format_str,
-            'merge_output_format': 'mp4',
-            'quiet': True,
-            'no_warnings': True,
-            'noprogress': True,  # 禁用内置进度条显示
-            'outtmpl': temp_path,
-            'progress_hooks': [progress_hook],
-            'cookiefile': 'cookies.txt',
-        }
+    try:
+        if parallel:
+            stream_paths = [os.path.join(temp_dir, f"{video_id}.f{fid}") for fid in stream_ids]
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix='stream') as executor:
+                # 复制上下文，下载线程中的日志带有请求关联ID
+                futures = [executor.submit(contextvars.copy_context().run, fetch,
+                                           dict(ydl_opts, format=fid, outtmpl=path))
+                           for fid, path in zip(stream_ids, stream_paths)]
+                for future in futures:
+                    future.result()
+            download_logger.info("开始合并MP4视频...")
+            merge_started = time.time()
+            progress(phase='merging')
+            # 先写入临时文件再改名，合并中途退出时不会留下不完整的结果被续传当成已完成
+            merge_path = f"{temp_path}.merge.mp4"
+            try:
+                merge_streams(stream_paths[0], stream_paths[1], merge_path)
+                os.replace(merge_path, temp_path)
+            except RuntimeError as e:
+                download_logger.error(f"合并失败 - ID: {video_id} | 错误: {str(e)}")
+                raise DownloadFailed(901, f"视频合并失败: {str(e)}")
+            for path in stream_paths:
+                os.remove(path)
+        else:
+            fetch(ydl_opts)
+    except yt_dlp.utils.DownloadError as e:
+        cleanup(keep_partial=resumable)
+        raise download_failed(video_id, e)
+    except BaseException:
+        cleanup()
+        raise
+        
+    file_size = os.path.getsize(temp_path)
+    download_time = time.time() - start_time
+    avg_speed = file_size / (1024 * 1024 * download_time) if download_time > 0 else 0
+    labels = options.labels()
+    if merge_started:
+        metrics.DOWNLOAD_SECONDS.labels(**labels).observe(merge_started - start_time)
+        metrics.MERGE_SECONDS.observe(time.time() - merge_started)
+    else:
+        metrics.DOWNLOAD_SECONDS.labels(**labels).observe(download_time)
+    if download_time > 0:
+        metrics.DOWNLOAD_THROUGHPUT.labels(**labels).observe(file_size / download_time)
+        
+    download_logger.info(f"视频合并完成: 文件大小={file_size/1024/1024:.2f}MB, 用时={download_time:.2f}秒, "
+                f"平均速度={avg_speed:.2f}MB/s | {options.describe()}")
+
+    # 发布到缓存，之后的相同请求直接命中
+    try:
+        cache_entry = media_cache.publish(video_id, format_str, temp_path)
+    except BaseException:
+        cleanup()
+        raise
+    if cache_entry:
+        cleanup()
+        return SharedFile(cache_entry.path, lambda: media_cache.release(cache_entry))
+    # 文件留在工作目录，预留的空间在最后一个使用者释放后归还
+    return SharedFile(temp_path, cleanup)
+
+# 输出变体转换：ffmpeg 进程数上限，相同 (视频ID, 格式, 变体) 的并发请求共享一次转换
+TRANSCODE_WORKERS = int(os.environ.get('YOUTUBE_TRANSCODE_WORKERS', 2))
+transcode_executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix='transcode')
+transcode_flights = SingleFlight()
+
+def direct_transcode_inputs(info, format_str, variant):
+    """
+    直接读取源地址的 ffmpeg 输入，只取变体需要的流
+    格式不是简单的ID组合或协议不支持时返回 None
+    """
+    formats = {f.get('format_id'): f for f in info.get('formats') or []}
+    inputs = []
+    for format_id in format_str.split('+'):
+        f = formats.get(format_id)
+        if not f or not f.get('url') or f.get('protocol', 'https') not in STREAMABLE_PROTOCOLS:
+            return None
+        has_video = f.get('vcodec') not in (None, 'none')
+        has_audio = f.get('acodec') not in (None, 'none')
+        kind = 'av' if has_video and has_audio else 'video' if has_video else 'audio'
+        if variant.profile.audio_only and not has_audio:
+            # 只要音频时跳过视频流
+            continue
+        inputs.append((f['url'], f.get('http_headers'), kind, f))
+    if not inputs or (variant.profile.audio_only and len(inputs) > 1):
+        inputs = [i for i in inputs if i[2] == 'audio'] or inputs[:1]
+    return inputs
+
+def transcode_video(video_id, format_str, variant, client=None, options=None):
+    """
+    生成输出变体并返回 SharedFile，结果缓存在 (视频ID, 格式#变体) 下
+    只要音频或截取片段时直接读取源地址；其余情况先下载完整文件（优先使用缓存）再转换
+    """
+    cache_format = variant_format(format_str, variant)
+    cache_entry = media_cache.lookup(video_id, cache_format)
+    if cache_entry:
+        return SharedFile(cache_entry.path, lambda: media_cache.release(cache_entry))
 
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    try:
+        info = extract_video_info(url)
+    except yt_dlp.utils.DownloadError as e:
+        raise download_failed(video_id, e)
+    audio_codecs = [f.get('acodec') or '' for f in info.get('formats') or []
+                    if f.get('format_id') in format_str.split('+') and f.get('acodec') not in (None, 'none')]
+    # 源音频已经是 AAC 时 m4a 直接复制
+    audio_copy = bool(audio_codecs) and all(c.startswith('mp4a') for c in audio_codecs)
+
+    # 加锁防止垃圾回收删除转换中的目录
+    temp_dir = os.path.join(WORK_DIR, uuid.uuid4().hex)
+    work_lock = lock_dir(temp_dir)
+    output_path = os.path.join(temp_dir, variant.filename(video_id))
+
+    def cleanup():
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        work_lock.close()
+
+    def run(inputs):
+        cmd = transcode_command([(source, headers, kind) for source, headers, kind, _ in inputs],
+                                variant, output_path, audio_copy)
         start_time = time.time()
-        logger.info("开始下载视频...")
-            
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-        except yt_dlp.utils.DownloadError as e:
-            error_str = str(e).lower()  # 转换为小写以进行更可靠的匹配
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-            if "sign in to confirm" in error_str:  # 简化匹配条件
-                logger.error(f"YouTube需要授权访问,可能cookies.txt文件配置错误")
-                return jsonify({
-                    'errcode': 403,
-                    'msg': "需要YouTube授权，请联系管理员!"
-                })
+        transcode_executor.submit(run_ffmpeg, cmd).result()
+        elapsed = time.time() - start_time
+        metrics.TRANSCODE_SECONDS.labels(variant.profile.name).observe(elapsed)
+        download_logger.info(f"输出变体转换完成 - ID: {video_id} | 变体: {variant.key} | "
+                    f"大小: {os.path.getsize(output_path)/1024/1024:.2f}MB | 用时: {elapsed:.2f}秒")
+
+    try:
+        done = False
+        source = media_cache.lookup(video_id, format_str)
+        if source is None and (variant.profile.audio_only or variant.trimmed):
+            inputs = direct_transcode_inputs(info, format_str, variant)
+            if inputs:
+                download_logger.info(f"直接读取源地址转换 - ID: {video_id} | 变体: {variant.key} | "
+                            f"格式: {'+'.join(i[3].get('format_id') for i in inputs)}")
+                try:
+                    run(inputs)
+                    done = True
+                except RuntimeError as e:
+                    # 流地址可能已失效，改为下载完整文件后转换
+                    download_logger.warning(f"直接转换失败，改为下载完整文件 - ID: {video_id} | 错误: {str(e)}")
+                    info_cache.pop(url)
+        if not done:
+            if source is not None:
+                media = SharedFile(source.path, lambda: media_cache.release(source))
             else:
-                # 直接返回下载错误，而不是raise
-                logger.error(f"下载错误 - ID: {video_id} | 错误: {str(e)}")
-                return jsonify({
-                    'errcode': 901,
-                    'msg': f"视频下载失败: {str(e).split('\n')[0]}"
-                })
-            
-        file_size = os.path.getsize(temp_path)
-        download_time = time.time() - start_time
-        avg_speed = file_size / (1024 * 1024 * download_time) if download_time > 0 else 0
-            
-        logger.info(f"视频合并完成: 文件大小={file_size/1024/1024:.2f}MB, 用时={download_time:.2f}秒, 平均速度={avg_speed:.2f}MB/s")
+                media, _ = download_flights.do(
+                    (video_id, format_str),
+                    lambda: download_video(video_id, format_str, client=client, wait=DOWNLOAD_WAIT,
+                                           options=options)
+                )
+            try:
+                run([(media.path, None, 'av', None)])
+            finally:
+                media.release()
+    except RuntimeError as e:
+        cleanup()
+        download_logger.error(f"输出变体转换失败 - ID: {video_id} | 变体: {variant.key} | 错误: {str(e)}")
+        raise DownloadFailed(904, f"转换失败: {str(e)}")
+    except BaseException:
+        cleanup()
+        raise
 
-        def cleanup():
+    try:
+        cache_entry = media_cache.publish(video_id, cache_format, output_path)
+    except BaseException:
+        cleanup()
+        raise
+    if cache_entry:
+        cleanup()
+        return SharedFile(cache_entry.path, lambda: media_cache.release(cache_entry))
+    return SharedFile(output_path, cleanup)
+
+def request_twitter_max_bytes(params):
+    """max_size_mb 参数，未指定时使用 TWITTER_MAX_BYTES，参数非法时抛出 ValueError"""
+    value = params.get('max_size_mb')
+    if value in (None, ''):
+        return TWITTER_MAX_BYTES
+    try:
+        max_mb = float(value)
+    except ValueError:
+        raise ValueError(f"max_size_mb 参数无效: {value}")
+    if max_mb <= 0:
+        raise ValueError("max_size_mb 参数必须大于 0")
+    return int(max_mb * 1024 * 1024)
+
+def twitter_cache_key(tweet, max_bytes):
+    """媒体缓存中的 (视频ID, 格式)，按大小上限区分，命中缓存时不需要解析推文"""
+    return f"twitter:{tweet}", f"best@{max_bytes}"
+
+def cache_twitter_variant(url, tweet, max_bytes):
+    """下载热门推文的完整文件并写入媒体缓存，在 twitter_cache_executor 中执行"""
+    key = twitter_cache_key(tweet, max_bytes)
+    temp_path = media_cache.new_temp_path()
+    try:
+        variant = resolve_twitter_variant(url, max_bytes)
+        start_time = time.time()
+        if variant.hls:
+            headers = ''.join(f"{k}: {v}\r\n" for k, v in (variant.format.get('http_headers') or {}).items())
+            run_ffmpeg(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y']
+                       + (['-headers', headers] if headers else [])
+                       + ['-i', variant.url, '-c', 'copy', '-movflags', '+faststart', temp_path])
+        else:
             try:
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    logger.info(f"已清理临时文件 - ID: {video_id} | 路径: {temp_path}")
-            except Exception as e:
-                logger.error(f"清理临时文件失败 - ID: {video_id} | 错误: {str(e)}")
-
-        response = Response(
-            stream_with_context(generate_file(temp_path, request.path, video_id)),
-            mimetype='video/mp4'
-        )
-        response.headers['Content-Disposition'] = f'attachment; filename="{video_id}.mp4"'
-        response.headers['Content-Length'] = os.path.getsize(temp_path)
-        
-        # 注册回调函数，在响应结束后清理文件
-        response.call_on_close(cleanup)
+                twitter_client.download(variant, temp_path)
+            except twitter.UpstreamError as e:
+                if not e.expired:
+                    raise
+                variant = resolve_twitter_variant(url, max_bytes, refresh=True)
+                twitter_client.download(variant, temp_path)
+        cache_entry = media_cache.publish(*key, temp_path)
+        if cache_entry:
+            media_cache.release(cache_entry)
+            logger.info(f"热门推文已写入媒体缓存 - 推文: {tweet} | 格式: {variant.format_id} | "
+                        f"大小: {cache_entry.size/1024/1024:.2f}MB | 用时: {time.time() - start_time:.2f}秒")
+    except Exception as e:
+        logger.error(f"热门推文写入媒体缓存失败 - 推文: {tweet} | 错误: {str(e)}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        with twitter_caching_lock:
+            twitter_caching.discard(key)
 
-        return response
+def note_twitter_download(url, tweet, max_bytes):
+    """记录一次推文下载，窗口内次数达到 TWITTER_CACHE_HITS 时在后台写入媒体缓存"""
+    if not TWITTER_CACHE_HITS or not media_cache.enabled:
+        return
+    key = twitter_cache_key(tweet, max_bytes)
+    if twitter_hits.record(key) < TWITTER_CACHE_HITS:
+        return
+    with twitter_caching_lock:
+        if key in twitter_caching:
+            return
+        twitter_caching.add(key)
+    logger.info(f"推文下载次数达到阈值，写入媒体缓存 - 推文: {tweet}")
+    twitter_cache_executor.submit(contextvars.copy_context().run, cache_twitter_variant, url, tweet, max_bytes)
+
+def open_twitter_download(url, tweet, max_bytes, request_headers):
+    """
+    准备 /twitter/download 的数据来源，Flask 和异步入口共用
+    返回 ('cache', SharedFile) / ('live', TwitterVariant) / ('proxy', 流式的 requests.Response)
+    request_headers 中的 Range 等请求头透传给 CDN；失败时抛出 DownloadFailed
+    """
+    cache_entry = media_cache.lookup(*twitter_cache_key(tweet, max_bytes))
+    if cache_entry:
+        logger.info(f"命中媒体缓存 - 推文: {tweet} | 路径: {cache_entry.path}")
+        return 'cache', SharedFile(cache_entry.path, lambda: media_cache.release(cache_entry))
+
+    def resolve(refresh=False):
+        try:
+            return resolve_twitter_variant(url, max_bytes, refresh)
+        except LookupError:
+            raise DownloadFailed(901, "未找到合适的视频格式")
+        except Exception as e:
+            logger.error(f"解析推特视频信息失败 - 推文: {tweet} | 错误: {str(e)}")
+            raise DownloadFailed(900, f"解析推特视频信息失败, 错误信息: {e}")
+
+    variant = resolve()
+    note_twitter_download(url, tweet, max_bytes)
+
+    for attempt in range(2):
+        if variant.hls:
+            if not can_merge():
+                raise DownloadFailed(901, "HLS 格式需要 ffmpeg")
+            return 'live', variant
+        try:
+            return 'proxy', twitter_client.open(variant, request_headers)
+        except twitter.UpstreamError as e:
+            if not e.expired or attempt:
+                raise DownloadFailed(901, f"推特视频下载失败: {str(e)}")
+            # 签名地址已失效，重新解析一次
+            logger.info(f"CDN 地址已失效，重新解析 - 推文: {tweet} | 状态码: {e.status}")
+            variant = resolve(refresh=True)
+        except RequestException as e:
+            raise DownloadFailed(901, f"推特视频下载失败: {str(e)}")
+
+def generate_proxy(upstream, video_id, request_path, on_first_byte=None):
+    """代理 CDN 响应的数据生成器，on_first_byte 与 generate_file 相同"""
+    on_first_byte = on_first_byte or (lambda: observe_first_byte('proxy'))
+    length = upstream.headers.get('Content-Length')
+    transfer = transfers.start(video_id, request_path, 'proxy', int(length) if length else None)
+    completed = False
+    try:
+        for chunk in twitter.iter_upstream(upstream):
+            if not transfer.bytes_sent:
+                on_first_byte()
+            transfer.add(len(chunk))
+            yield chunk
+        completed = True
+        transfer_logger.info(f"代理传输完成 - ID: {video_id} | "
+                    f"已传输: {transfer.bytes_sent/1024/1024:.2f}MB | 用时: {transfer.elapsed:.2f}秒")
+    except GeneratorExit:
+        transfer_logger.info(f"下载被客户端中断 - ID: {video_id} | "
+                    f"已传输: {transfer.bytes_sent/1024/1024:.2f}MB")
+        raise
+    finally:
+        transfers.finish(transfer, completed)
+
+class DownloadRequest:
+    """/youtube/download 的请求参数"""
+    __slots__ = ('video_id', 'format', 'options', 'variant', 'stream')
+
+    def __init__(self, video_id, format_str, options, variant=None, stream=False):
+        self.video_id = video_id
+        self.format = format_str
+        self.options = options
+        self.variant = variant
+        self.stream = stream
+
+    @property
+    def url(self):
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+def download_params(args, data):
+    """校验下载参数，返回 (视频ID, 格式, 下载参数, 合并后的参数)，data 为 POST 的表单或 JSON，参数非法时抛出 ValueError"""
+    video_id = data.get("id") or args.get("id")
+    format_str = data.get("format") or args.get("format")
+    if not video_id:
+        raise ValueError("缺少视频ID参数")
+    if not format_str:
+        raise ValueError("缺少format参数")
+    params = {**args, **data}
+    return video_id, format_str, request_download_options(params), params
+
+def download_request(args, data):
+    """校验 /youtube/download 的参数，参数非法时抛出 ValueError"""
+    video_id, format_str, options, params = download_params(args, data)
+    # profile/start/end 指定输出变体（只要音频、重新封装、缩放、截取片段）
+    variant = parse_variant(params.get('profile'), params.get('start'), params.get('end'))
+    # stream=1 时边下载边发送，不等待合并完成
+    stream = str(data.get("stream") or args.get("stream", "")).lower() in ('1', 'true')
+    return DownloadRequest(video_id, format_str, options, variant, stream)
+
+def download_task(req, client):
+    """
+    返回 (合并键, 下载函数, file_response 的参数)
+    指定输出变体时为转换任务，调用方使用 transcode_flights 合并，否则使用 download_flights
+    """
+    if req.variant:
+        return ((req.video_id, req.format, req.variant.key),
+                lambda: transcode_video(req.video_id, req.format, req.variant, client=client, options=req.options),
+                {'filename': req.variant.filename(req.video_id), 'mimetype': req.variant.profile.mimetype})
+    return ((req.video_id, req.format),
+            lambda: download_video(req.video_id, req.format, client=client, wait=DOWNLOAD_WAIT, options=req.options),
+            {})
+
+def twitter_request(args):
+    """校验 /twitter/download 的参数，返回 (URL, 推文ID, 大小上限)，参数非法时抛出 ValueError"""
+    url = args.get("url")
+    if not url:
+        raise ValueError("缺少url参数")
+    tweet = twitter.tweet_id(url)
+    if not twitter.is_twitter_url(url) or tweet is None:
+        raise ValueError("无效的推特URL")
+    return url, tweet, request_twitter_max_bytes(args)
+
+@app.route("/twitter/download")
+def twitter_download():
+    """
+    代理下载推特视频：MP4 变体透传 Range，HLS 变体实时封装，热门推文从媒体缓存发送
+    max_size_mb 为变体大小上限
+    """
+    try:
+        url, tweet, max_bytes = twitter_request(request.args)
+    except ValueError as e:
+        return jsonify({'errcode': 400, 'msg': str(e)})
+    logger.info(f"开始处理推特视频下载请求 - 推文: {tweet} | URL: {url}")
+    try:
+        kind, source = open_twitter_download(url, tweet, max_bytes, request.headers)
+    except DownloadFailed as e:
+        return jsonify({'errcode': e.errcode, 'msg': e.msg})
+
+    filename = f"{tweet}.mp4"
+    if kind == 'cache':
+        try:
+            return file_response(source.path, tweet, source.release, filename=filename)
+        except Exception:
+            source.release()
+            raise
+    if kind == 'live':
+        try:
+            reservation = acquire_live_slot(request_client())
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        response = Response(stream_with_context(generate_live([source.format], tweet, request.path)),
+                            mimetype='video/mp4')
+        response.call_on_close(reservation.release)
+    else:
+        response = Response(stream_with_context(generate_proxy(source, tweet, request.path)),
+                            status=source.status_code,
+                            mimetype=source.headers.get('Content-Type', 'video/mp4'))
+        response.headers.update(twitter.response_headers(source))
+        # 响应体未开始发送就结束时生成器不会执行，在这里归还连接
+        response.call_on_close(source.close)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route("/youtube/download")
+def youtube_download():
+    data = (request.get_json() or request.form) if request.method == 'POST' else {}
+    video_id = data.get("id") or request.args.get("id")
+
+    try:
+        try:
+            req = download_request(request.args, data)
+        except ValueError as e:
+            return jsonify({'errcode': 400, 'msg': str(e)})
+
+        logger.info(f"开始处理YouTube视频下载请求 - ID: {video_id} | URL: {req.url} | 格式: {req.format}"
+                    f"{f' | 变体: {req.variant.key}' if req.variant else ''}")
+
+        client = request_client()
+        if not req.variant:
+            # 命中缓存时跳过 yt-dlp，直接进入传输
+            cache_entry = media_cache.lookup(video_id, req.format)
+            if cache_entry:
+                logger.info(f"命中媒体缓存 - ID: {video_id} | 格式: {req.format} | 路径: {cache_entry.path}")
+                return file_response(cache_entry.path, video_id, lambda: media_cache.release(cache_entry))
+
+            if req.stream:
+                try:
+                    response = live_stream_response(req.url, video_id, req.format, client)
+                except AdmissionRejected as e:
+                    logger.warning(f"拒绝边下载边发送请求 - ID: {video_id} | 客户端: {client} | 原因: {e.msg}")
+                    return admission_rejected_response(e)
+                if response is not None:
+                    return response
+
+        key, task, response_options = download_task(req, client)
+        flights = transcode_flights if req.variant else download_flights
+        try:
+            media, shared = flights.do(key, task)
+        except DownloadFailed as e:
+            return jsonify({'errcode': e.errcode, 'msg': e.msg})
+        except AdmissionRejected as e:
+            logger.warning(f"拒绝下载请求 - ID: {video_id} | 客户端: {client} | 原因: {e.msg}")
+            return admission_rejected_response(e)
+        if shared:
+            logger.info(f"复用进行中的下载任务 - ID: {video_id} | 格式: {req.format}")
+
+        try:
+            return file_response(media.path, video_id, media.release, **response_options)
+        except Exception:
+            media.release()
+            raise
 
     except Exception as e:
-        # 发生错误时也要清理临时文件
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-                logger.info(f"已清理临时文件 - ID: {video_id} | 路径: {temp_path}")
-            except Exception as cleanup_error:
-                logger.error(f"清理临时文件失败 - ID: {video_id} | 错误: {str(cleanup_error)}")
-        
         logger.error(f"视频下载失败 - ID: {video_id} | 错误: {str(e)}", exc_info=True)
         return jsonify({'errcode': 900, 'msg': f"视频下载失败: {str(e)}"})
 
-if __name__ == "__main__":
-    # 清理并重建临时目录
-    temp_dir = "/tmp/youtube"
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
-    os.makedirs(temp_dir)
-    logger.info(f"已清理并重建临时目录: {temp_dir}")
-    
-    # 禁用自动重载，避免文件变动时中断下载任务
-    app.run(host="0.0.0.0", port=80, debug=True, use_reloader=True)
+# 后台下载任务配置：工作线程数、最大排队数、结果保留时间（秒）
+JOB_WORKERS = int(os.environ.get('YOUTUBE_JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('YOUTUBE_JOB_QUEUE_SIZE', 32))
+JOB_RESULT_TTL = int(os.environ.get('YOUTUBE_JOB_RESULT_TTL', 3600))
+
+def run_download_job(job):
+    media, shared = download_flights.do(
+        (job.video_id, job.format),
+        lambda: download_video(job.video_id, job.format, job.update_progress, client=job.client,
+                               wait=JOB_DOWNLOAD_WAIT, options=job.options)
+    )
+    if shared:
+        download_logger.info(f"任务复用进行中的下载 - 任务ID: {job.id} | ID: {job.video_id}")
+    return media
+
+# 未完成的任务在 JOB_RESUME_TTL 秒内重启时重新排队，超过后丢弃
+JOB_RESUME_TTL = int(os.environ.get('YOUTUBE_JOB_RESUME_TTL', 86400))
 
+def restore_job_result(video_id, format_str):
+    cache_entry = media_cache.lookup(video_id, format_str)
+    if cache_entry is None:
+        return None
+    return SharedFile(cache_entry.path, lambda: media_cache.release(cache_entry))
 
+job_manager = JobManager(run_download_job, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL,
+                         journal=journal, restore_result=restore_job_result)
+
+def submit_job_response(args, data, client, url_for):
+    """
+    提交后台任务，返回 (响应内容, 状态码, 响应头)
+    url_for 为当前框架的 url_for，用于生成任务状态和结果的地址；提交时会清理过期任务的结果文件
+    """
+    try:
+        video_id, format_str, options, _ = download_params(args, data)
+    except ValueError as e:
+        return {'errcode': 400, 'msg': str(e)}, 200, {}
+
+    try:
+        job = job_manager.submit(video_id, format_str, client=client, options=options)
+    except QueueFull as e:
+        logger.warning(f"拒绝下载任务 - ID: {video_id} | 原因: {str(e)}")
+        return ({'errcode': 429, 'msg': f"服务繁忙，请稍后重试: {str(e)}"}, 200,
+                {'Retry-After': str(RETRY_AFTER)})
 
+    return {
+        'errcode': 0,
+        'msg': "ok",
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id, _external=True),
+        'result_url': url_for('job_result', job_id=job.id, _external=True),
+    }, 200, {}
 
-        
\ No newline at end of file
+def job_status_response(job):
+    if not job:
+        return {'errcode': 404, 'msg': "任务不存在或已过期"}
+    return job.to_dict()
+
+def job_result_media(job):
+    """已完成任务的结果文件（SharedFile），任务不存在、失败或尚未完成时抛出 DownloadFailed；只增加引用计数，不阻塞"""
+    if not job:
+        raise DownloadFailed(404, "任务不存在或已过期")
+    if job.state == FAILED:
+        raise DownloadFailed(job.errcode, job.msg)
+    media = job_manager.acquire_result(job.id)
+    if not media:
+        raise DownloadFailed(409, f"任务尚未完成，当前状态: {job.state}")
+    return media
+
+@app.route("/jobs", methods=['POST'])
+def submit_job():
+    data = request.get_json(silent=True) or request.form
+    return submit_job_response(request.args, data, request_client(), url_for)
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    return jsonify(job_status_response(job_manager.get(job_id)))
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    try:
+        media = job_result_media(job)
+    except DownloadFailed as e:
+        return jsonify({'errcode': e.errcode, 'msg': e.msg})
+    try:
+        return file_response(media.path, job.video_id, media.release)
+    except Exception:
+        media.release()
+        raise
+
+def collect_stats():
+    return {
+        'errcode': 0,
+        'msg': "ok",
+        'transfers': [t.to_dict() for t in transfers.active()],
+        'downloads': [{'id': video_id, 'format': format_str}
+                      for video_id, format_str in download_flights.in_flight()],
+        'transcodes': [{'id': video_id, 'format': format_str, 'variant': key}
+                       for video_id, format_str, key in transcode_flights.in_flight()],
+        'jobs': job_manager.stats(),
+        'ydl_pool': ydl_pool.stats(),
+        'admission': admission.stats(),
+        'logging': log_config.stats(),
+        'journal': journal.stats(),
+    }
+
+@app.route("/stats")
+def stats():
+    return jsonify(collect_stats())
+
+metrics.register_state(
+    caches={'media': media_cache, 'info': info_cache, 'response': response_cache,
+            'twitter_url': twitter_url_cache},
+    dirs={'work': WORK_DIR, 'cache': CACHE_DIR},
+    gauges={
+        'youtube_active_downloads': ("进行中的 yt-dlp 下载任务数", lambda: len(download_flights.in_flight())),
+        'youtube_active_transfers': ("进行中的文件传输数", lambda: len(transfers.active())),
+        'youtube_queued_jobs': ("排队中的后台任务数", lambda: job_manager.stats()['queued']),
+        'youtube_reserved_bytes': ("下载预留的磁盘空间", lambda: admission.reserved_bytes),
+        'youtube_waiting_downloads': ("等待磁盘空间或下载名额的请求数", admission.waiting),
+    },
+)
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype=CONTENT_TYPE_LATEST)
+
+def prepare_storage():
+    """启动时准备下载目录：保留可续传的部分下载，清理过期和残留的工作目录，恢复媒体缓存索引"""
+    os.makedirs(WORK_DIR, exist_ok=True)
+    metrics.reset_multiprocess_dir()
+    collect_work_garbage(force=True)
+    for row in journal.downloads():
+        logger.info(f"保留中断的下载 - ID: {row['video_id']} | 格式: {row['format']} | 路径: {row['work_dir']}")
+    media_cache.recover()
+
+def worker_init():
+    """每个 worker 进程启动时调用：预热 YoutubeDL 实例，恢复已退出进程留下的后台任务"""
+    ydl_pool.warm()
+    job_manager.recover(JOB_RESUME_TTL)
+    if media_cache.enabled:
+        start_cache_flusher()
+
+def on_worker_exit():
+    job_manager.shutdown(wait=False)
+    twitter_cache_executor.shutdown(wait=False, cancel_futures=True)
+    flush_media_cache()
+    metrics.worker_exit()
+    # 保存池中实例的 cookies
+    ydl_pool.close()
+
+if __name__ == "__main__":
+    # 本地开发: python main.py --debug 或 YOUTUBE_DEBUG=1，使用 Flask 开发服务器
+    if '--debug' in sys.argv or os.environ.get('YOUTUBE_DEBUG') == '1':
+        prepare_storage()
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            # 重载器的父进程只负责重启子进程，任务只在实际处理请求的子进程中恢复
+            worker_init()
+        # 禁用自动重载，避免文件变动时中断下载任务
+        app.run(host="0.0.0.0", port=int(os.environ.get('YOUTUBE_PORT', 80)), debug=True, use_reloader=True)
+    else:
+        import server
+        server.run(app, on_starting=prepare_storage, on_worker_init=worker_init,
+                   on_worker_exit=on_worker_exit)
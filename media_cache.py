@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# coding=utf8
+"""按 (视频ID, 格式字符串) 内容寻址的磁盘媒体缓存"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('youtube.cache')
+
+# 支持的淘汰策略
+EVICTION_POLICIES = ('lru', 'lfu')
+
+
+class CacheEntry:
+    """缓存条目，pins 为当前正在读取该文件的请求数"""
+    __slots__ = ('key', 'video_id', 'format', 'path', 'size', 'hits', 'last_access', 'created', 'pins', 'dirty')
+
+    def __init__(self, key, video_id, format_str, path, size, hits=0, last_access=None, created=None):
+        self.key = key
+        self.video_id = video_id
+        self.format = format_str
+        self.path = path
+        self.size = size
+        self.hits = hits
+        self.last_access = last_access or time.time()
+        self.created = created or time.time()
+        self.pins = 0
+        # 命中次数和访问时间只在内存中更新，由 flush 批量写回磁盘
+        self.dirty = False
+
+
+class MediaCache:
+    """
+    磁盘媒体缓存
+
+    - 文件名为 (视频ID, 格式字符串) 的哈希，旁边保存一个 .json 元数据文件
+    - 命中时只更新内存中的命中次数和访问时间，不写磁盘；flush 把它们批量写回元数据和 atime，
+      由调用方定期和退出时调用，重启后 LRU/LFU 顺序最多丢失一个 flush 周期
+    - 多个 worker 进程共用缓存目录时，每个进程只统计自己知道的条目；
+      发布新文件前先与磁盘上的文件对账，总大小不会因为 worker 数量而成倍超出 max_bytes
+    - 新文件先写入 .tmp 目录，再通过 rename 原子发布
+    - 总大小超过 max_bytes 时按 lru/lfu 淘汰，被 pin 住的条目不会被淘汰
+    """
+
+    def __init__(self, root, max_bytes, policy='lru'):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"不支持的缓存淘汰策略: {policy}")
+        self.root = root
+        self.tmp_dir = os.path.join(root, '.tmp')
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(video_id, format_str):
+        return hashlib.sha1(f"{video_id}\n{format_str}".encode('utf-8')).hexdigest()
+
+    def _data_path(self, key):
+        return os.path.join(self.root, f"{key}.mp4")
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def recover(self):
+        """启动时重建索引：清理未发布的临时文件和孤立文件，保留已发布的缓存"""
+        os.makedirs(self.root, exist_ok=True)
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        entries = {}
+        for name in os.listdir(self.root):
+            key, ext = os.path.splitext(name)
+            if ext != '.json':
+                continue
+            entry = self._load_entry(key)
+            if entry is not None:
+                entries[key] = entry
+
+        # 没有元数据的媒体文件说明发布未完成，直接删除
+        for name in os.listdir(self.root):
+            key, ext = os.path.splitext(name)
+            if ext == '.mp4' and key not in entries:
+                self._remove_files(key)
+
+        with self._lock:
+            self._entries = entries
+            self._size = sum(e.size for e in entries.values())
+            self._evict_locked()
+        logger.info(f"媒体缓存已恢复 - 目录: {self.root} | 条目: {len(self._entries)} | "
+                    f"大小: {self._size/1024/1024:.2f}MB")
+
+    def _load_entry(self, key):
+        """从磁盘读取条目，元数据损坏或媒体文件缺失时删除残留文件"""
+        data_path = self._data_path(key)
+        try:
+            with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            stat = os.stat(data_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"丢弃损坏的缓存条目 - key: {key} | 错误: {str(e)}")
+            self._remove_files(key)
+            return None
+        return CacheEntry(
+            key, meta.get('video_id', ''), meta.get('format', ''), data_path,
+            stat.st_size, hits=meta.get('hits', 0), last_access=stat.st_atime, created=meta.get('created')
+        )
+
+    def _write_meta(self, entry):
+        """先写临时文件再 rename，读取方不会看到写了一半的元数据"""
+        staged_meta = self.new_temp_path('.json')
+        with open(staged_meta, 'w', encoding='utf-8') as f:
+            json.dump({'video_id': entry.video_id, 'format': entry.format, 'created': entry.created,
+                       'hits': entry.hits}, f)
+        os.replace(staged_meta, self._meta_path(entry.key))
+
+    def lookup(self, video_id, format_str):
+        """命中时返回已 pin 住的条目，使用完毕后必须调用 release"""
+        if not self.enabled:
+            return None
+        key = self.make_key(video_id, format_str)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # 多进程部署时条目可能由其他 worker 发布；元数据最后写入，存在即说明发布已完成
+                if os.path.exists(self._meta_path(key)):
+                    entry = self._load_entry(key)
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self._entries[key] = entry
+                self._size += entry.size
+            elif not os.path.exists(entry.path):
+                self._drop_locked(entry)
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.hits += 1
+            entry.last_access = time.time()
+            entry.pins += 1
+            entry.dirty = True
+        return entry
+
+    def flush(self):
+        """把内存中的命中次数和访问时间写回磁盘，返回写入的条目数"""
+        with self._lock:
+            dirty = [e for e in self._entries.values() if e.dirty]
+            for entry in dirty:
+                entry.dirty = False
+        written = 0
+        for entry in dirty:
+            try:
+                # 用 atime 记录最近访问时间，重启后 LRU 顺序不丢失；mtime 保持不变，ETag 不受影响
+                os.utime(entry.path, ns=(int(entry.last_access * 1e9), os.stat(entry.path).st_mtime_ns))
+                # 多个 worker 共用缓存时以最后写入的计数为准
+                self._write_meta(entry)
+                written += 1
+            except OSError:
+                # 条目已被淘汰
+                pass
+        return written
+
+    def release(self, entry):
+        with self._lock:
+            entry.pins = max(entry.pins - 1, 0)
+            if entry.pins == 0:
+                self._evict_locked()
+
+    def new_temp_path(self, suffix='.mp4'):
+        """返回缓存目录下的临时文件路径，与正式文件位于同一文件系统"""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}{suffix}")
+
+    def publish(self, video_id, format_str, src_path):
+        """
+        将下载完成的文件发布到缓存并返回已 pin 住的条目
+        缓存关闭或文件超出预算时返回 None，源文件保持不动
+        """
+        if not self.enabled:
+            return None
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            logger.info(f"文件超出缓存预算，不缓存 - ID: {video_id} | 大小: {size/1024/1024:.2f}MB")
+            return None
+
+        key = self.make_key(video_id, format_str)
+        data_path = self._data_path(key)
+
+        # 先移动到缓存临时目录（跨文件系统时是一次复制），再 rename 到最终位置
+        staged_path = self.new_temp_path()
+        shutil.move(src_path, staged_path)
+        os.replace(staged_path, data_path)
+
+        entry = CacheEntry(key, video_id, format_str, data_path, size, hits=1)
+        self._write_meta(entry)
+
+        on_disk = self._scan()
+        with self._lock:
+            self._reconcile_locked(on_disk)
+            old = self._entries.get(key)
+            if old is not None:
+                self._size -= old.size
+            entry.pins = 1
+            self._entries[key] = entry
+            self._size += size
+            self._evict_locked()
+        logger.info(f"已写入媒体缓存 - ID: {video_id} | 格式: {format_str} | "
+                    f"缓存总大小: {self._size/1024/1024:.2f}MB")
+        return entry
+
+    def _scan(self):
+        """磁盘上已发布的条目 key，元数据最后写入、最先删除，存在即说明条目完整"""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return None
+        return {key for key, ext in map(os.path.splitext, names) if ext == '.json'}
+
+    def _reconcile_locked(self, on_disk):
+        """加入其他 worker 发布的条目、去掉已被其他 worker 淘汰的条目，使总大小与磁盘一致"""
+        if on_disk is None:
+            return
+        for key in on_disk - self._entries.keys():
+            entry = self._load_entry(key)
+            if entry is not None:
+                self._entries[key] = entry
+                self._size += entry.size
+        for key in self._entries.keys() - on_disk:
+            entry = self._entries[key]
+            if entry.pins == 0:
+                self._entries.pop(key)
+                self._size -= entry.size
+
+    def _eviction_order(self, entry):
+        if self.policy == 'lfu':
+            return (entry.hits, entry.last_access)
+        return entry.last_access
+
+    def _evict_locked(self):
+        if self._size <= self.max_bytes:
+            return
+        candidates = sorted(
+            (e for e in self._entries.values() if e.pins == 0),
+            key=self._eviction_order
+        )
+        for entry in candidates:
+            if self._size <= self.max_bytes:
+                break
+            self._drop_locked(entry)
+            logger.info(f"淘汰媒体缓存 - ID: {entry.video_id} | 格式: {entry.format} | "
+                        f"大小: {entry.size/1024/1024:.2f}MB")
+
+    def _drop_locked(self, entry):
+        if self._entries.pop(entry.key, None) is not None:
+            self._size -= entry.size
+        self._remove_files(entry.key)
+
+    def _remove_files(self, key):
+        # 先删元数据，这样中途崩溃时 recover 会把剩下的媒体文件当作孤立文件清理
+        for path in (self._meta_path(key), self._data_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"删除缓存文件失败 - 路径: {path} | 错误: {str(e)}")
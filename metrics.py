@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+Prometheus 指标：各阶段耗时直方图、错误码和字节数计数，以及抓取时计算的缓存/磁盘状态
+
+多个 worker 进程时设置 PROMETHEUS_MULTIPROC_DIR，计数器和直方图由 prometheus_client 的
+多进程模式写入该目录，/metrics 汇总所有 worker；抓取时计算的状态（缓存命中、进行中的下载等）
+只反映响应抓取的那个 worker
+"""
+import glob
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from journal import dir_size
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    # 不带标签的指标在定义时就会创建数据文件
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+# 秒级耗时分桶，覆盖从毫秒级缓存命中到数分钟的长视频下载
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+# 吞吐量分桶（字节/秒），1MB/s 到 1GB/s
+THROUGHPUT_BUCKETS = tuple(2 ** i * 1024 * 1024 for i in range(11))
+
+REQUEST_SECONDS = Histogram(
+    'youtube_request_seconds', '非流式请求的处理时间', ['endpoint'], buckets=SECONDS_BUCKETS)
+EXTRACT_SECONDS = Histogram(
+    'youtube_extract_info_seconds', 'yt-dlp extract_info 耗时', ['site'], buckets=SECONDS_BUCKETS)
+# 下载相关指标按下载器、分片并发数、是否音视频并行区分，便于比较不同配置的效果
+DOWNLOAD_LABELS = ['downloader', 'fragments', 'parallel']
+DOWNLOAD_SECONDS = Histogram(
+    'youtube_download_seconds', '音视频流下载耗时（不含合并）', DOWNLOAD_LABELS, buckets=SECONDS_BUCKETS)
+MERGE_SECONDS = Histogram(
+    'youtube_merge_seconds', 'ffmpeg 合并耗时', buckets=SECONDS_BUCKETS)
+TTFB_SECONDS = Histogram(
+    'youtube_time_to_first_byte_seconds', '从收到下载请求到发出第一个字节的时间', ['mode'],
+    buckets=SECONDS_BUCKETS)
+TRANSFER_THROUGHPUT = Histogram(
+    'youtube_transfer_throughput_bytes_per_second', '完成的文件传输的平均速度', ['mode'],
+    buckets=THROUGHPUT_BUCKETS)
+DOWNLOAD_THROUGHPUT = Histogram(
+    'youtube_download_throughput_bytes_per_second', 'yt-dlp 下载的平均速度', DOWNLOAD_LABELS,
+    buckets=THROUGHPUT_BUCKETS)
+TRANSCODE_SECONDS = Histogram(
+    'youtube_transcode_seconds', '输出变体的 ffmpeg 转换耗时', ['profile'], buckets=SECONDS_BUCKETS)
+ERRORS = Counter('youtube_errors', '按错误码统计的失败响应', ['errcode'])
+BYTES_SERVED = Counter('youtube_bytes_served', '发送给客户端的字节数', ['mode'])
+
+
+class StateCollector:
+    """
+    抓取时读取的状态
+    caches: {名称: 带 hits/misses 属性且支持 len() 的缓存对象}
+    dirs: {名称: 目录路径}，统计磁盘占用
+    gauges: {指标名: (说明, 返回数值的函数)}
+    """
+
+    def __init__(self, caches, dirs, gauges):
+        self.caches = caches
+        self.dirs = dirs
+        self.gauges = gauges
+
+    def collect(self):
+        requests = CounterMetricFamily('youtube_cache_requests', '缓存查询次数', labels=['cache', 'result'])
+        entries = GaugeMetricFamily('youtube_cache_entries', '缓存条目数', labels=['cache'])
+        for name, cache in self.caches.items():
+            requests.add_metric([name, 'hit'], cache.hits)
+            requests.add_metric([name, 'miss'], cache.misses)
+            entries.add_metric([name], len(cache))
+        yield requests
+        yield entries
+
+        disk = GaugeMetricFamily('youtube_disk_usage_bytes', '目录磁盘占用', labels=['dir'])
+        for name, path in self.dirs.items():
+            disk.add_metric([name], dir_size(path))
+        yield disk
+
+        for metric_name, (doc, fn) in self.gauges.items():
+            yield GaugeMetricFamily(metric_name, doc, value=fn())
+
+
+_registry = REGISTRY
+
+
+def register_state(caches, dirs, gauges):
+    """注册抓取时计算的状态；多进程模式下使用单独的 registry，同时汇总所有 worker 的数据文件"""
+    global _registry
+    if MULTIPROC_DIR:
+        _registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(_registry)
+    _registry.register(StateCollector(caches, dirs, gauges))
+
+
+def render():
+    """/metrics 的响应内容"""
+    return generate_latest(_registry)
+
+
+def reset_multiprocess_dir():
+    """服务启动时（master 中，fork worker 之前）清除上次运行留下的数据文件，否则计数会累加到新进程上"""
+    if not MULTIPROC_DIR:
+        return
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, '*.db')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def worker_exit():
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+生产环境服务入口：gunicorn + gthread worker
+
+进程内状态（下载合并、后台任务、统计）按 worker 进程隔离，默认 1 个 worker、多线程；
+媒体缓存在磁盘上，多个 worker 之间共享
+
+异步版本（async_app.py）使用 hypercorn，单进程单事件循环，见 run_async
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger('youtube.server')
+
+
+def server_options():
+    """从环境变量读取 gunicorn 配置"""
+    host = os.environ.get('YOUTUBE_HOST', '0.0.0.0')
+    port = int(os.environ.get('YOUTUBE_PORT', 80))
+    return {
+        'bind': f"{host}:{port}",
+        'worker_class': 'gthread',
+        'workers': int(os.environ.get('YOUTUBE_WORKERS', 1)),
+        'threads': int(os.environ.get('YOUTUBE_THREADS', 32)),
+        # gthread 的心跳在主线程，长时间的下载请求不会触发超时
+        'timeout': int(os.environ.get('YOUTUBE_WORKER_TIMEOUT', 60)),
+        # 收到 SIGTERM 后等待进行中的请求结束的时间
+        'graceful_timeout': int(os.environ.get('YOUTUBE_GRACEFUL_TIMEOUT', 120)),
+        'keepalive': int(os.environ.get('YOUTUBE_KEEPALIVE', 5)),
+        'accesslog': os.environ.get('YOUTUBE_ACCESS_LOG') or None,
+    }
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, app, options, on_starting=None, on_worker_init=None, on_worker_exit=None):
+        self.application = app
+        self.options = options
+        self._on_starting = on_starting
+        self._on_worker_init = on_worker_init
+        self._on_worker_exit = on_worker_exit
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+        def on_starting(server):
+            # 只在 master 中执行一次，worker 重启时不会清理其他 worker 正在使用的文件
+            if self._on_starting:
+                self._on_starting()
+
+        def post_worker_init(worker):
+            # 在 worker 进程内初始化，连接和实例不能在 fork 前创建
+            if self._on_worker_init:
+                self._on_worker_init()
+
+        def worker_exit(server, worker):
+            if self._on_worker_exit:
+                self._on_worker_exit()
+
+        self.cfg.set('on_starting', on_starting)
+        self.cfg.set('post_worker_init', post_worker_init)
+        self.cfg.set('worker_exit', worker_exit)
+
+    def load(self):
+        return self.application
+
+
+def run(app, on_starting=None, on_worker_init=None, on_worker_exit=None):
+    options = server_options()
+    logger.info(f"以生产模式启动 - 监听: {options['bind']} | "
+                f"workers: {options['workers']} | threads: {options['threads']}")
+    ProductionServer(app, options, on_starting, on_worker_init, on_worker_exit).run()
+
+
+def hypercorn_config():
+    """从环境变量读取 hypercorn 配置，监听地址、keep-alive 和优雅退出时间与 gunicorn 相同"""
+    from hypercorn.config import Config
+
+    host = os.environ.get('YOUTUBE_HOST', '0.0.0.0')
+    port = int(os.environ.get('YOUTUBE_PORT', 80))
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    config.keep_alive_timeout = int(os.environ.get('YOUTUBE_KEEPALIVE', 5))
+    config.graceful_timeout = int(os.environ.get('YOUTUBE_GRACEFUL_TIMEOUT', 120))
+    # 大量并发连接时加大监听队列
+    config.backlog = int(os.environ.get('YOUTUBE_BACKLOG', 2048))
+    access_log = os.environ.get('YOUTUBE_ACCESS_LOG')
+    if access_log:
+        config.accesslog = access_log
+    return config
+
+
+def run_async(app):
+    """用 hypercorn 运行 ASGI 应用，收到 SIGTERM / SIGINT 后等待进行中的请求结束再退出"""
+    from hypercorn.asyncio import serve
+
+    config = hypercorn_config()
+    logger.info(f"以异步模式启动 - 监听: {', '.join(config.bind)} | "
+                f"keep-alive: {config.keep_alive_timeout}秒")
+
+    async def main():
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopping.set)
+        await serve(app, config, shutdown_trigger=stopping.wait)
+
+    asyncio.run(main())
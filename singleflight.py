@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding=utf8
+"""进程内的下载合并：相同 key 的并发请求只执行一次任务，结果由所有请求共享"""
+import asyncio
+import contextvars
+import threading
+
+
+class SharedFile:
+    """
+    多个请求共享的文件结果
+
+    引用计数由 SingleFlight 在任务完成时设置为参与者数量，
+    每个参与者用完后调用 release，最后一个释放时执行 on_release
+    """
+
+    def __init__(self, path, on_release):
+        self.path = path
+        self._on_release = on_release
+        self._lock = threading.Lock()
+        self._refs = 1
+
+    def retain(self, count=1):
+        with self._lock:
+            self._refs += count
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            last = self._refs == 0
+        if last and self._on_release:
+            self._on_release()
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'participants')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.participants = 1
+
+
+class SingleFlight:
+    """进行中任务的注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def in_flight(self):
+        with self._lock:
+            return list(self._flights)
+
+    def do(self, key, fn):
+        """
+        执行 fn 或等待已在执行的同 key 任务，返回 (结果, 是否复用了其他请求的任务)
+        fn 抛出的异常会传递给所有参与者
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                flight.participants += 1
+
+        if not leader:
+            flight.done.wait()
+        else:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                # 先移出注册表再统计参与者，之后到来的请求会发起新任务
+                with self._lock:
+                    del self._flights[key]
+                    participants = flight.participants
+                if isinstance(flight.result, SharedFile) and participants > 1:
+                    flight.result.retain(participants - 1)
+                flight.done.set()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, not leader
+
+
+class _AsyncFlight:
+    __slots__ = ('future', 'participants', 'settled')
+
+    def __init__(self, future):
+        self.future = future
+        self.participants = 0
+        self.settled = False
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的 asyncio 版本，只能在同一个事件循环中使用
+
+    相同 key 的协程共享一次在 executor 中执行的 flights.do（同时与同步请求、后台任务合并），
+    等待中的协程不占用线程。结果为 SharedFile 时每个协程持有一个引用；
+    等待中被取消的协程不计入引用，任务仍会继续执行
+    """
+
+    def __init__(self, flights, executor):
+        self._flights = flights
+        self._executor = executor
+        self._pending = {}
+
+    def in_flight(self):
+        return list(self._pending)
+
+    async def do(self, key, fn):
+        """与 SingleFlight.do 相同，返回 (结果, 是否复用了其他请求的任务)"""
+        flight = self._pending.get(key)
+        leader = flight is None
+        if leader:
+            loop = asyncio.get_running_loop()
+            # 复制上下文，任务中的日志带有发起请求的关联ID
+            context = contextvars.copy_context()
+            flight = _AsyncFlight(loop.run_in_executor(self._executor, context.run, self._flights.do, key, fn))
+            self._pending[key] = flight
+            # 先于等待的协程执行，协程恢复时引用计数已经设置好
+            flight.future.add_done_callback(lambda _: self._settle(key, flight))
+        flight.participants += 1
+
+        try:
+            result, shared = await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            if not flight.settled:
+                flight.participants -= 1
+            elif flight.future.exception() is None:
+                # 结果已经为本协程增加了引用
+                result = flight.future.result()[0]
+                if isinstance(result, SharedFile):
+                    result.release()
+            raise
+        return result, shared or not leader
+
+    def _settle(self, key, flight):
+        del self._pending[key]
+        flight.settled = True
+        if flight.future.cancelled() or flight.future.exception() is not None:
+            return
+        result = flight.future.result()[0]
+        if not isinstance(result, SharedFile):
+            return
+        if flight.participants == 0:
+            # 所有请求都已断开
+            result.release()
+        elif flight.participants > 1:
+            result.retain(flight.participants - 1)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding=utf8
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+MB = 1024 * 1024
+
+
+class _Controller(AdmissionController):
+    """磁盘剩余空间由测试控制"""
+
+    def __init__(self, disk_free=None, **kwargs):
+        super().__init__('/nonexistent', **kwargs)
+        self.disk_free = disk_free
+
+    def _disk_free(self):
+        return self.disk_free
+
+
+def _acquire_in_thread(controller, client, nbytes, timeout=5):
+    """在后台线程中排队，返回 (线程, 结果列表)，结果为 Reservation 或 AdmissionRejected"""
+    result = []
+
+    def run():
+        try:
+            result.append(controller.acquire(client, nbytes, timeout=timeout))
+        except AdmissionRejected as e:
+            result.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def _wait_queued(controller, count):
+    for _ in range(500):
+        if controller.waiting() == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"排队数没有达到 {count}")
+
+
+def test_reserve_and_release():
+    controller = _Controller(disk_free=1000 * MB, min_free_bytes=100 * MB)
+    assert controller.capacity() == 900 * MB
+    with controller.acquire('a', 300 * MB) as reservation:
+        assert reservation.granted
+        assert controller.reserved_bytes == 300 * MB
+    assert controller.reserved_bytes == 0 and controller.active == 0
+
+
+def test_larger_than_budget_rejected_without_retry():
+    controller = _Controller(budget_bytes=100 * MB)
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.acquire('a', 200 * MB)
+    assert exc.value.errcode == 507 and exc.value.retry_after is None
+
+
+def test_larger_than_disk_rejected_without_budget():
+    controller = _Controller(disk_free=500 * MB, min_free_bytes=100 * MB)
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.acquire('a', 450 * MB)
+    assert exc.value.errcode == 507
+    assert controller.waiting() == 0
+
+
+def test_fits_after_active_downloads_finish_waits():
+    controller = _Controller(disk_free=500 * MB, min_free_bytes=100 * MB)
+    first = controller.acquire('a', 300 * MB)
+    thread, result = _acquire_in_thread(controller, 'b', 300 * MB)
+    _wait_queued(controller, 1)
+    first.release()
+    thread.join(5)
+    assert result[0].granted
+
+
+def test_timeout_is_retryable():
+    controller = _Controller(max_active=1, retry_after=7)
+    held = controller.acquire('a', 0)
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.acquire('b', 0, timeout=0.05)
+    assert exc.value.errcode == 503 and exc.value.retry_after == 7
+    assert controller.waiting() == 0
+    held.release()
+
+
+def test_queue_full():
+    controller = _Controller(max_active=1, max_waiting=1)
+    held = controller.acquire('a', 0)
+    thread, result = _acquire_in_thread(controller, 'b', 0)
+    _wait_queued(controller, 1)
+    with pytest.raises(AdmissionRejected) as exc:
+        controller.acquire('c', 0, timeout=0)
+    assert exc.value.errcode == 503
+    held.release()
+    thread.join(5)
+    result[0].release()
+
+
+def test_clients_take_turns():
+    controller = _Controller(max_active=1)
+    held = controller.acquire('x', 0)
+    order = []
+
+    def run(client):
+        with controller.acquire(client, 0, timeout=5):
+            order.append(client)
+
+    # a 先排了三个请求，b 后到，放行时仍然轮流进行
+    threads = []
+    for client in ('a', 'a', 'a', 'b'):
+        threads.append(threading.Thread(target=run, args=(client,)))
+        threads[-1].start()
+        _wait_queued(controller, len(threads))
+    held.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['a', 'b', 'a', 'a']
+
+
+def test_per_client_limit_lets_other_clients_through():
+    controller = _Controller(per_client=1)
+    held = controller.acquire('a', 0)
+    thread, result = _acquire_in_thread(controller, 'a', 0)
+    _wait_queued(controller, 1)
+    other = controller.acquire('b', 0, timeout=1)
+    assert other.granted and not result
+    held.release()
+    thread.join(5)
+    assert result[0].granted
+    other.release()
+    result[0].release()
+
+
+def test_unsatisfiable_head_does_not_block_queue():
+    controller = _Controller(disk_free=1000 * MB, min_free_bytes=100 * MB)
+    held = controller.acquire('x', 500 * MB)
+    big_thread, big = _acquire_in_thread(controller, 'a', 800 * MB)
+    _wait_queued(controller, 1)
+    small_thread, small = _acquire_in_thread(controller, 'b', 100 * MB)
+    _wait_queued(controller, 2)
+    # 排队期间磁盘被其他程序占用，大请求永远放不下，应该被拒绝而不是挡住小请求
+    controller.disk_free = 700 * MB
+    held.release()
+    big_thread.join(5)
+    small_thread.join(5)
+    assert isinstance(big[0], AdmissionRejected) and big[0].errcode == 507
+    assert small[0].granted
+    small[0].release()
+
+
+def test_zero_byte_reservation_only_takes_a_slot():
+    # 边下载边发送不写磁盘：磁盘已满时也能获得名额，但仍受并发上限限制
+    controller = _Controller(disk_free=50 * MB, min_free_bytes=100 * MB, max_active=1)
+    held = controller.acquire('a', 0, timeout=0)
+    with pytest.raises(AdmissionRejected):
+        controller.acquire('b', 0, timeout=0)
+    held.release()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding=utf8
+import io
+import os
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from delivery import ClosingFile, file_etag, proxy_redirect_header, read_chunks, resolve_range
+
+ETAG = 'abc-64-1'
+
+
+def _request(**headers):
+    return Request(EnvironBuilder(headers=headers).get_environ())
+
+
+def test_no_range_sends_whole_file():
+    assert resolve_range(_request(), 100, ETAG) == (200, 0, 100)
+
+
+def test_single_range():
+    assert resolve_range(_request(Range='bytes=10-19'), 100, ETAG) == (206, 10, 10)
+    assert resolve_range(_request(Range='bytes=90-'), 100, ETAG) == (206, 90, 10)
+    assert resolve_range(_request(Range='bytes=-5'), 100, ETAG) == (206, 95, 5)
+
+
+def test_range_end_clamped_to_size():
+    assert resolve_range(_request(Range='bytes=50-500'), 100, ETAG) == (206, 50, 50)
+
+
+def test_unsatisfiable_range():
+    assert resolve_range(_request(Range='bytes=100-'), 100, ETAG) == (416, 0, 0)
+
+
+def test_malformed_or_multiple_ranges_send_whole_file():
+    assert resolve_range(_request(Range='bytes=abc'), 100, ETAG) == (200, 0, 100)
+    assert resolve_range(_request(Range='bytes=0-1,5-6'), 100, ETAG) == (200, 0, 100)
+
+
+def test_empty_file_ignores_range():
+    assert resolve_range(_request(Range='bytes=0-10'), 0, ETAG) == (200, 0, 0)
+
+
+def test_if_range_matching_etag():
+    request = _request(Range='bytes=0-9', **{'If-Range': f'"{ETAG}"'})
+    assert resolve_range(request, 100, ETAG) == (206, 0, 10)
+
+
+def test_if_range_stale_etag_or_date_sends_whole_file():
+    request = _request(Range='bytes=0-9', **{'If-Range': '"other"'})
+    assert resolve_range(request, 100, ETAG) == (200, 0, 100)
+    request = _request(Range='bytes=0-9', **{'If-Range': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+    assert resolve_range(request, 100, ETAG) == (200, 0, 100)
+
+
+def test_file_etag_changes_with_content(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'x' * 10)
+    first = file_etag(os.stat(path))
+    assert first == file_etag(os.stat(path))
+    path.write_bytes(b'x' * 11)
+    assert file_etag(os.stat(path)) != first
+
+
+def test_read_chunks_grows_and_stops_at_length():
+    data = b'x' * (1024 * 1024)
+    chunks = list(read_chunks(io.BytesIO(data), 300 * 1024))
+    assert [len(c) for c in chunks] == [64 * 1024, 128 * 1024, 108 * 1024]
+
+
+def test_proxy_redirect_header(tmp_path):
+    root = tmp_path / 'files'
+    assert proxy_redirect_header('x-accel', str(root / 'a' / 'b.mp4'), str(root), '/internal/') == \
+        ('X-Accel-Redirect', '/internal/a/b.mp4')
+    assert proxy_redirect_header('x-accel', str(tmp_path / 'b.mp4'), str(root), '/internal') is None
+    assert proxy_redirect_header('x-sendfile', 'b.mp4', str(root), '') == ('X-Sendfile', os.path.abspath('b.mp4'))
+    assert proxy_redirect_header('stream', 'b.mp4', str(root), '') is None
+
+
+def test_closing_file_runs_callback_once():
+    closed = []
+    f = ClosingFile(io.BytesIO(b'data'), lambda: closed.append(True))
+    assert f.read(2) == b'da'
+    f.close()
+    f.close()
+    assert closed == [True]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding=utf8
+import pytest
+
+from formats import estimate_size, parse_formats, resolve_policy, select_format
+
+MB = 1024 * 1024
+
+
+def _f(format_id, ext, vcodec, acodec, height=None, size=None, tbr=None, **extra):
+    return dict(format_id=format_id, ext=ext, vcodec=vcodec, acodec=acodec, height=height,
+                filesize=size, tbr=tbr, **extra)
+
+
+INFO = {
+    'duration': 100,
+    'formats': [
+        _f('sb0', 'mhtml', 'none', None),
+        _f('18', 'mp4', 'avc1.42001E', 'mp4a.40.2', 360, 10 * MB, 500),
+        _f('22', 'mp4', 'avc1.64001F', 'mp4a.40.2', 720, 40 * MB, 1500),
+        _f('137', 'mp4', 'avc1.640028', 'none', 1080, 150 * MB, 4000),
+        _f('399', 'mp4', 'av01.0.08M.08', 'none', 1080, 90 * MB, 2500),
+        _f('248', 'webm', 'vp9', 'none', 1080, 100 * MB, 3000),
+        _f('313', 'webm', 'vp9', 'none', 2160, 600 * MB, 16000),
+        _f('135', 'mp4', 'avc1.4d401f', 'none', 480, 30 * MB, 1000),
+        _f('140', 'm4a', 'none', 'mp4a.40.2', size=3 * MB, tbr=129),
+        _f('251', 'webm', 'none', 'opus', size=3 * MB, tbr=140),
+    ],
+}
+
+
+def _select(name=None, **overrides):
+    return select_format(parse_formats(INFO), resolve_policy(name, overrides)).format_string
+
+
+def test_parse_formats_skips_storyboards_and_normalizes_codecs():
+    table = {f.format_id: f for f in parse_formats(INFO)}
+    assert 'sb0' not in table
+    assert table['399'].codec == 'av1'
+    assert table['248'].codec == 'vp9'
+    assert table['140'].has_audio and not table['140'].has_video
+
+
+def test_default_prefers_h264_1080p_with_m4a():
+    # 1080p 分离格式高于 720p 合一格式，不使用合一格式
+    assert _select() == '137+140'
+
+
+def test_best_prefers_highest_resolution_and_av1():
+    assert _select('best') == '313+251'
+    assert _select('best', max_height=1080) == '399+140'
+
+
+def test_compat_uses_muxed_format():
+    assert _select('compat') == '22'
+    # 不优先合一格式时只在没有可用的分离格式时使用
+    assert _select('compat', muxed=0) == '135+140'
+    assert _select('compat', max_height=360, muxed=0) == '18'
+
+
+def test_small_respects_size_budget():
+    # 360p 以上的合一格式优先
+    assert _select('small') == '18'
+    assert _select('small', muxed=0) == '135+140'
+    # 分离格式超出预算时退回合一格式
+    assert _select('small', muxed=0, max_size_mb=20) == '18'
+
+
+def test_codec_override_order():
+    assert _select(codec='vp9,avc1', container='mp4,webm') == '248+251'
+
+
+def test_unknown_size_skipped_only_with_budget():
+    info = {'formats': [_f('137', 'mp4', 'avc1', 'none', 1080), _f('140', 'm4a', 'none', 'mp4a', tbr=128)]}
+    table = parse_formats(info)
+    assert select_format(table, resolve_policy()).format_string == '137+140'
+    with pytest.raises(LookupError):
+        select_format(table, resolve_policy('small'))
+
+
+def test_missing_audio_or_video():
+    video_only = parse_formats({'formats': [_f('137', 'mp4', 'avc1', 'none', 1080)]})
+    with pytest.raises(LookupError, match='audio'):
+        select_format(video_only, resolve_policy())
+    audio_only = parse_formats({'formats': [_f('140', 'm4a', 'none', 'mp4a')]})
+    with pytest.raises(LookupError, match='video'):
+        select_format(audio_only, resolve_policy())
+
+
+def test_resolve_policy_rejects_bad_input():
+    with pytest.raises(ValueError):
+        resolve_policy('nope')
+    with pytest.raises(ValueError):
+        resolve_policy(overrides={'max_height': 'tall'})
+    assert resolve_policy(overrides={'max_height': '0'}).max_height is None
+
+
+def test_estimate_size():
+    assert estimate_size(INFO, '137+140') == 153 * MB
+    assert estimate_size(INFO, '999') is None
+    # 没有文件大小时按码率和时长估算
+    info = {'duration': 8, 'formats': [_f('137', 'mp4', 'avc1', 'none', 1080, tbr=1000)]}
+    assert estimate_size(info, '137') == 1000 * 1000 // 8 * 8
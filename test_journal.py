@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding=utf8
+import os
+import subprocess
+import sys
+import time
+
+import journal
+from download_options import DownloadOptions
+from jobs import Job
+from journal import Journal, lock_dir, process_token, work_dir_name
+
+
+def _dead_owner():
+    """已退出进程的标识"""
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    token = process_token(proc.pid)
+    proc.wait()
+    return token
+
+
+def _set_owner(db, job_id, owner, updated_at=None):
+    db._execute('UPDATE jobs SET owner = ?, updated_at = ? WHERE id = ?',
+                (owner, updated_at or time.time(), job_id))
+
+
+def test_process_token_includes_start_time():
+    token = process_token()
+    assert token.startswith(f"{os.getpid()}:")
+    assert journal._owner_alive(token)
+    assert not journal._owner_alive(_dead_owner())
+    assert not journal._owner_alive(None)
+
+
+def test_unreadable_proc_falls_back_to_pid(monkeypatch):
+    def deny(path, *args, **kwargs):
+        raise PermissionError(path)
+
+    token = process_token()
+    monkeypatch.setattr(journal, 'open', deny, raising=False)
+    assert process_token() == str(os.getpid())
+    # 读不到启动时间时按 PID 判断存活
+    assert journal._owner_alive(token)
+    assert journal._owner_alive(str(os.getpid()))
+
+
+def test_claim_jobs_from_dead_owner(tmp_path):
+    db = Journal(str(tmp_path / 'journal.db'))
+    orphan = Job('abc', '22', client='1.2.3.4', options=DownloadOptions(fragments=4))
+    orphan.state = 'running'
+    mine = Job('def', '22')
+    db.save_job(orphan)
+    db.save_job(mine)
+    _set_owner(db, orphan.id, _dead_owner())
+
+    claimed = db.claim_jobs(ttl=3600)
+    assert [row['id'] for row, _ in claimed] == [orphan.id]
+    row, options = claimed[0]
+    assert options.fragments == 4
+    # 认领后归属当前进程，不会被再次认领
+    assert db.claim_jobs(ttl=3600) == []
+    assert db.stats()['jobs'] == {'queued': 2}
+
+
+def test_stale_unfinished_jobs_dropped(tmp_path):
+    db = Journal(str(tmp_path / 'journal.db'))
+    job = Job('abc', '22')
+    db.save_job(job)
+    _set_owner(db, job.id, _dead_owner(), updated_at=time.time() - 7200)
+    assert db.claim_jobs(ttl=3600) == []
+    assert db.stats()['jobs'] == {}
+
+
+def test_finished_jobs_and_purge(tmp_path):
+    db = Journal(str(tmp_path / 'journal.db'))
+    job = Job('abc', '22')
+    job.state = 'finished'
+    job.finished_at = time.time() - 100
+    db.save_job(job)
+    assert [row['id'] for row in db.finished_jobs(time.time() - 200)] == [job.id]
+    assert db.finished_jobs(time.time() - 50) == []
+    db.purge_jobs(time.time() - 50)
+    assert db.stats()['jobs'] == {}
+
+
+def test_collect_garbage(tmp_path):
+    db = Journal(str(tmp_path / 'journal.db'))
+    root = tmp_path / 'work'
+    old = time.time() - 7200
+
+    def make_dir(name, mtime):
+        path = root / name
+        path.mkdir(parents=True)
+        (path / 'video.mp4.part').write_bytes(b'x' * 10)
+        os.utime(path / 'video.mp4.part', (mtime, mtime))
+        os.utime(path, (mtime, mtime))
+        return str(path)
+
+    expired = make_dir(work_dir_name('a', '22'), old)
+    db.start_download(expired, 'a', '22')
+    db.interrupt_download(expired)
+    fresh = make_dir(work_dir_name('b', '22'), time.time())
+    db.start_download(fresh, 'b', '22')
+    db.interrupt_download(fresh)
+    orphan = make_dir('orphan', old)
+    locked = make_dir('locked', old)
+    lock = lock_dir(locked)
+    db.start_download(str(root / 'gone'), 'c', '22')
+
+    try:
+        removed, freed = db.collect_garbage(str(root), ttl=3600)
+    finally:
+        lock.close()
+
+    assert (removed, freed) == (2, 20)
+    assert not os.path.exists(expired) and not os.path.exists(orphan)
+    assert os.path.exists(fresh) and os.path.exists(locked)
+    assert [row['work_dir'] for row in db.downloads()] == [fresh]
+
+
+def test_dir_size_recursive_without_lock(tmp_path):
+    (tmp_path / 'a.part').write_bytes(b'x' * 10)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.part').write_bytes(b'x' * 5)
+    (tmp_path / journal.LOCK_NAME).write_bytes(b'x' * 3)
+    assert journal.dir_size(str(tmp_path)) == 15
+    assert journal.dir_size(str(tmp_path / 'missing')) == 0
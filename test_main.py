@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding=utf8
+import contextlib
+import os
+import tempfile
+
+# main 在导入时创建下载目录和任务日志，测试使用临时目录
+os.environ['YOUTUBE_DOWNLOAD_DIR'] = tempfile.mkdtemp(prefix='youtube-test-')
+for name in ('YOUTUBE_CACHE_DIR', 'YOUTUBE_JOURNAL_PATH', 'YOUTUBE_DELIVERY_MODE'):
+    os.environ.pop(name, None)
+
+import pytest
+import yt_dlp
+from werkzeug.wsgi import FileWrapper
+
+import main
+
+SIZE = 300000
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(bytes(range(256)) * (SIZE // 256) + b'x' * (SIZE % 256))
+    return str(path)
+
+
+def _file_response(path, closed, **headers):
+    environ = {'wsgi.file_wrapper': FileWrapper}
+    with main.app.test_request_context('/youtube/download', headers=headers, environ_overrides=environ):
+        return main.file_response(path, 'abc', lambda: closed.append(True))
+
+
+def test_file_wrapper_open_ended_range_sets_content_range(video):
+    closed = []
+    response = _file_response(video, closed, Range='bytes=1000-')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f"bytes 1000-{SIZE - 1}/{SIZE}"
+    assert response.headers['Content-Length'] == str(SIZE - 1000)
+    body = b''.join(response.response)
+    with open(video, 'rb') as f:
+        f.seek(1000)
+        assert body == f.read()
+    response.response.close()
+    assert closed == [True]
+
+
+def test_file_wrapper_full_file(video):
+    closed = []
+    response = _file_response(video, closed)
+    assert response.status_code == 200
+    assert 'Content-Range' not in response.headers
+    assert response.headers['Content-Length'] == str(SIZE)
+    response.response.close()
+
+
+def test_bounded_range_streams_with_content_range(video):
+    closed = []
+    response = _file_response(video, closed, Range='bytes=10-19')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f"bytes 10-19/{SIZE}"
+
+
+@pytest.mark.parametrize('item, expected', [
+    ('abc', ('youtube', 'https://www.youtube.com/watch?v=abc')),
+    ('https://www.youtube.com/watch?v=abc&t=1', ('youtube', 'https://www.youtube.com/watch?v=abc')),
+    ('youtu.be/abc?si=x', ('youtube', 'https://www.youtube.com/watch?v=abc')),
+    ('https://m.youtube.com/shorts/abc', ('youtube', 'https://www.youtube.com/watch?v=abc')),
+    ('https://www.youtube.com/embed/abc?start=1', ('youtube', 'https://www.youtube.com/watch?v=abc')),
+    ('https://www.youtube.com/live/abc', ('youtube', 'https://www.youtube.com/watch?v=abc')),
+    ('https://www.youtube.com/v/abc', ('youtube', 'https://www.youtube.com/watch?v=abc')),
+    ('https://www.youtube.com/embed/videoseries?list=PL1',
+     ('playlist', 'https://www.youtube.com/embed/videoseries?list=PL1')),
+    ('https://www.youtube.com/playlist?list=PL1', ('playlist', 'https://www.youtube.com/playlist?list=PL1')),
+    ('https://x.com/a/status/1', ('twitter', 'https://x.com/a/status/1')),
+    ('https://evilyoutube.com/playlist?list=PL1', None),
+    ('https://youtube.com.evil.com/watch?v=abc', None),
+    ('https://youtube.com@evil.com/watch?v=abc', None),
+    ('https://notyoutu.be/abc', None),
+    ('ftp://www.youtube.com/watch?v=abc', None),
+])
+def test_parse_batch_item(item, expected):
+    assert main.parse_batch_item(item) == expected
+
+
+def test_playlist_profile_only_allows_youtube_extractors():
+    with main.ydl_pool.acquire('playlist') as ydl:
+        assert set(ydl._ies) == {'YoutubeTab', 'YoutubePlaylist'}
+
+
+def test_request_client_ignores_forwarded_for_without_trusted_proxies():
+    assert main.TRUSTED_PROXIES == 0
+    environ = {'REMOTE_ADDR': '10.0.0.1'}
+    with main.app.test_request_context('/', headers={'X-Forwarded-For': '1.2.3.4'}, environ_overrides=environ):
+        assert main.request_client() == '10.0.0.1'
+
+
+def test_download_video_releases_reservation_when_setup_fails(monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError('journal unavailable')
+
+    monkeypatch.setattr(main, 'extract_video_info', lambda url: {'formats': []})
+    monkeypatch.setattr(main.journal, 'start_download', fail)
+    with pytest.raises(OSError):
+        main.download_video('abc', '22', client='a', wait=0)
+    assert main.admission.active == 0 and main.admission.reserved_bytes == 0
+    # 工作目录锁已释放，之后的相同下载可以续传
+    lock = main.lock_dir(os.path.join(main.WORK_DIR, main.work_dir_name('abc', '22')))
+    assert lock is not None
+    lock.close()
+
+
+class _FakeYDL:
+    """按 outtmpl 写入内容为格式ID的文件；stale 中的格式用缓存信息下载时失败，fail 中的格式重新解析后仍然失败"""
+
+    def __init__(self, pool, params):
+        self.pool = pool
+        self.params = params
+
+    def _write(self, how):
+        fid = self.params['format']
+        self.pool.calls.append((how, fid))
+        if fid in self.pool.fail:
+            with open(f"{self.params['outtmpl']}.part", 'wb') as f:
+                f.write(b'partial')
+            raise yt_dlp.utils.DownloadError('HTTP Error 403: Forbidden')
+        with open(self.params['outtmpl'], 'wb') as f:
+            f.write(fid.encode())
+
+    def process_ie_result(self, info, download):
+        if self.params['format'] in self.pool.stale:
+            self.pool.calls.append(('cached', self.params['format']))
+            raise yt_dlp.utils.DownloadError('HTTP Error 403: Forbidden')
+        self._write('cached')
+
+    def download(self, urls):
+        self._write('reextract')
+
+
+class _FakePool:
+    def __init__(self, stale=(), fail=()):
+        self.stale = set(stale)
+        self.fail = set(fail)
+        self.calls = []
+
+    @contextlib.contextmanager
+    def acquire(self, profile, **overrides):
+        yield _FakeYDL(self, overrides)
+
+
+def _merge(video_path, audio_path, output_path):
+    with open(output_path, 'wb') as out:
+        for path in (video_path, audio_path):
+            with open(path, 'rb') as f:
+                out.write(f.read())
+
+
+@pytest.fixture
+def parallel_download(monkeypatch):
+    """音视频分开下载再合并，ffmpeg 合并由 _merge 代替"""
+    info = {'formats': [{'format_id': '137'}, {'format_id': '140'}]}
+    monkeypatch.setattr(main, 'extract_video_info', lambda url: info)
+    monkeypatch.setattr(main, 'can_merge', lambda: True)
+    monkeypatch.setattr(main, 'merge_streams', _merge)
+    assert main.default_download_options.parallel_streams
+
+    def use_pool(**kwargs):
+        pool = _FakePool(**kwargs)
+        monkeypatch.setattr(main, 'ydl_pool', pool)
+        return pool
+    return use_pool
+
+
+def _read_and_release(shared):
+    with open(shared.path, 'rb') as f:
+        data = f.read()
+    shared.release()
+    return data
+
+
+def test_parallel_streams_merged(parallel_download):
+    pool = parallel_download()
+    shared = main.download_video('par1', '137+140')
+    assert _read_and_release(shared) == b'137140'
+    assert sorted(pool.calls) == [('cached', '137'), ('cached', '140')]
+    assert not os.path.exists(os.path.join(main.WORK_DIR, main.work_dir_name('par1', '137+140')))
+    assert main.admission.active == 0
+
+
+def test_parallel_stream_with_stale_url_is_reextracted(parallel_download):
+    pool = parallel_download(stale={'140'})
+    shared = main.download_video('par2', '137+140')
+    assert _read_and_release(shared) == b'137140'
+    assert ('reextract', '140') in pool.calls and ('reextract', '137') not in pool.calls
+
+
+def test_parallel_stream_failure_keeps_partial_files_for_resume(parallel_download):
+    work_dir = os.path.join(main.WORK_DIR, main.work_dir_name('par3', '137+140'))
+    parallel_download(stale={'140'}, fail={'140'})
+    with pytest.raises(main.DownloadFailed) as exc:
+        main.download_video('par3', '137+140')
+    assert exc.value.errcode == 901
+    assert main.admission.active == 0 and main.admission.reserved_bytes == 0
+    # 已完成的视频流和音频流的 .part 文件都保留在固定的工作目录中
+    assert sorted(os.listdir(work_dir)) == ['.lock', 'par3.f137', 'par3.f140.part']
+    assert work_dir in [row['work_dir'] for row in main.journal.downloads()]
+
+    parallel_download()
+    shared = main.download_video('par3', '137+140')
+    assert _read_and_release(shared) == b'137140'
+    assert not os.path.exists(work_dir)
+
+
+def test_download_request_merges_query_and_body():
+    req = main.download_request({'id': 'abc', 'stream': '1'}, {'format': '137+140', 'fragments': '8'})
+    assert (req.video_id, req.format, req.stream, req.variant) == ('abc', '137+140', True, None)
+    assert req.options.fragments == 8
+    assert req.url == 'https://www.youtube.com/watch?v=abc'
+    with pytest.raises(ValueError, match='format'):
+        main.download_request({'id': 'abc'}, {})
+    with pytest.raises(ValueError):
+        main.download_request({'id': 'abc', 'format': '22', 'profile': 'bogus'}, {})
+
+
+def test_admission_rejected_response():
+    body, status, headers = main.admission_rejected_response(main.AdmissionRejected("排队已满", retry_after=7))
+    assert (body['errcode'], status, headers) == (503, 503, {'Retry-After': '7'})
+    body, status, headers = main.admission_rejected_response(main.AdmissionRejected("空间不足"))
+    assert (status, headers) == (507, {})
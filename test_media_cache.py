@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding=utf8
+import os
+
+from media_cache import MediaCache
+
+
+def _publish(cache, tmp_path, video_id, size, format_str='22'):
+    src = tmp_path / f"{video_id}.src"
+    src.write_bytes(b'x' * size)
+    entry = cache.publish(video_id, format_str, str(src))
+    cache.release(entry)
+    return entry
+
+
+def test_publish_and_lookup(tmp_path):
+    cache = MediaCache(str(tmp_path / 'cache'), 1000)
+    cache.recover()
+    entry = _publish(cache, tmp_path, 'a', 100)
+    assert not (tmp_path / 'a.src').exists()
+
+    hit = cache.lookup('a', '22')
+    assert hit is entry and hit.pins == 1
+    cache.release(hit)
+    assert cache.lookup('a', '137') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction_skips_pinned(tmp_path):
+    cache = MediaCache(str(tmp_path / 'cache'), 250)
+    cache.recover()
+    _publish(cache, tmp_path, 'a', 100)
+    _publish(cache, tmp_path, 'b', 100)
+    pinned = cache.lookup('a', '22')
+
+    # a 最近访问过且被 pin 住，超出预算时淘汰 b
+    _publish(cache, tmp_path, 'c', 100)
+    assert cache.lookup('b', '22') is None
+    assert cache.size == 200
+    cache.release(pinned)
+
+
+def test_lfu_eviction(tmp_path):
+    cache = MediaCache(str(tmp_path / 'cache'), 250, policy='lfu')
+    cache.recover()
+    _publish(cache, tmp_path, 'a', 100)
+    _publish(cache, tmp_path, 'b', 100)
+    for _ in range(3):
+        cache.release(cache.lookup('a', '22'))
+
+    _publish(cache, tmp_path, 'c', 100)
+    assert cache.lookup('b', '22') is None
+    assert cache.lookup('a', '22') is not None
+
+
+def test_recover_keeps_hits_and_drops_orphans(tmp_path):
+    root = tmp_path / 'cache'
+    cache = MediaCache(str(root), 1000, policy='lfu')
+    cache.recover()
+    _publish(cache, tmp_path, 'a', 100)
+    for _ in range(4):
+        cache.release(cache.lookup('a', '22'))
+    assert cache.flush() == 1
+    # 发布中途崩溃留下的文件：没有元数据的媒体文件和临时目录中的文件
+    (root / 'orphan.mp4').write_bytes(b'x')
+    (root / '.tmp' / 'partial.mp4').write_bytes(b'x')
+
+    recovered = MediaCache(str(root), 1000, policy='lfu')
+    recovered.recover()
+    assert len(recovered) == 1
+    assert recovered.size == 100
+    assert not (root / 'orphan.mp4').exists()
+    assert os.listdir(root / '.tmp') == []
+    entry = recovered.lookup('a', '22')
+    assert entry.hits == 6
+
+
+def test_recover_drops_corrupt_meta(tmp_path):
+    root = tmp_path / 'cache'
+    cache = MediaCache(str(root), 1000)
+    cache.recover()
+    entry = _publish(cache, tmp_path, 'a', 100)
+    with open(os.path.join(str(root), f"{entry.key}.json"), 'w') as f:
+        f.write('{')
+
+    recovered = MediaCache(str(root), 1000)
+    recovered.recover()
+    assert len(recovered) == 0
+    assert not os.path.exists(entry.path)
+
+
+def test_lookup_does_not_write_until_flush(tmp_path):
+    cache = MediaCache(str(tmp_path / 'cache'), 1000)
+    cache.recover()
+    entry = _publish(cache, tmp_path, 'a', 100)
+    meta_path = tmp_path / 'cache' / f"{entry.key}.json"
+    before = meta_path.read_text()
+
+    cache.release(cache.lookup('a', '22'))
+    assert meta_path.read_text() == before
+    assert cache.flush() == 1
+    assert '"hits": 2' in meta_path.read_text()
+    # 没有新的命中时不再写入
+    assert cache.flush() == 0
+
+
+def test_shared_directory_stays_within_budget(tmp_path):
+    root = str(tmp_path / 'cache')
+    worker1 = MediaCache(root, 250)
+    worker2 = MediaCache(root, 250)
+    worker1.recover()
+    _publish(worker1, tmp_path, 'a', 100)
+    _publish(worker2, tmp_path, 'b', 100)
+    # worker1 发布时发现 worker2 的条目，总大小超出预算后淘汰最早的 a
+    _publish(worker1, tmp_path, 'c', 100)
+    assert worker1.size == 200
+    names = sorted(name for name in os.listdir(root) if name.endswith('.mp4'))
+    assert len(names) == 2
+    assert worker1.lookup('a', '22') is None
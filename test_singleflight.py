@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# coding=utf8
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SharedFile, SingleFlight
+
+
+class _Gate:
+    """让任务停在 fn 中，等所有参与者都进入 do 之后再放行"""
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+        self.entered = threading.Event()
+        self.proceed = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.entered.set()
+        self.proceed.wait(5)
+        if isinstance(self.result, BaseException):
+            raise self.result
+        return self.result
+
+
+def _wait_participants(flights, key, count):
+    for _ in range(500):
+        with flights._lock:
+            flight = flights._flights.get(key)
+            if flight is not None and flight.participants == count:
+                return
+        threading.Event().wait(0.01)
+    raise AssertionError('参与者没有全部进入')
+
+
+def _run_followers(flights, key, gate, count):
+    results = [None] * count
+    errors = [None] * count
+
+    def follower(i):
+        try:
+            results[i] = flights.do(key, gate)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=follower, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+def test_shared_file_released_once_by_all_participants():
+    released = []
+    shared = SharedFile('/tmp/video.mp4', lambda: released.append(True))
+    gate = _Gate(shared)
+    flights = SingleFlight()
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do('k', gate)))
+    leader.start()
+    gate.entered.wait(5)
+    threads, follower_results, errors = _run_followers(flights, 'k', gate, 2)
+    _wait_participants(flights, 'k', 3)
+    gate.proceed.set()
+    for t in [leader, *threads]:
+        t.join(5)
+
+    assert gate.calls == 1
+    assert errors == [None, None]
+    assert results == [(shared, False)]
+    assert follower_results == [(shared, True), (shared, True)]
+    assert flights.in_flight() == []
+
+    # 三个参与者各持有一个引用，最后一个释放时才执行清理
+    shared.release()
+    shared.release()
+    assert released == []
+    shared.release()
+    assert released == [True]
+
+
+def test_error_propagates_to_all_participants():
+    gate = _Gate(RuntimeError('boom'))
+    flights = SingleFlight()
+    leader_error = []
+
+    def leader():
+        try:
+            flights.do('k', gate)
+        except RuntimeError as e:
+            leader_error.append(e)
+
+    t = threading.Thread(target=leader)
+    t.start()
+    gate.entered.wait(5)
+    threads, _, errors = _run_followers(flights, 'k', gate, 2)
+    _wait_participants(flights, 'k', 3)
+    gate.proceed.set()
+    for thread in [t, *threads]:
+        thread.join(5)
+
+    assert gate.calls == 1
+    assert len(leader_error) == 1
+    assert all(e is leader_error[0] for e in errors)
+
+
+def test_finished_key_starts_new_flight():
+    flights = SingleFlight()
+    assert flights.do('k', lambda: 1) == (1, False)
+    assert flights.do('k', lambda: 2) == (2, False)
+
+
+def test_async_cancelled_waiter_does_not_hold_reference():
+    released = []
+    shared = SharedFile('/tmp/video.mp4', lambda: released.append(True))
+    gate = _Gate(shared)
+    executor = ThreadPoolExecutor(2)
+
+    async def scenario():
+        flights = AsyncSingleFlight(SingleFlight(), executor)
+        first = asyncio.ensure_future(flights.do('k', gate))
+        second = asyncio.ensure_future(flights.do('k', gate))
+        await asyncio.get_running_loop().run_in_executor(None, gate.entered.wait, 5)
+        second.cancel()
+        await asyncio.sleep(0)
+        gate.proceed.set()
+        result = await first
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        return result
+
+    try:
+        result = asyncio.run(scenario())
+    finally:
+        executor.shutdown()
+
+    assert result == (shared, False)
+    assert gate.calls == 1
+    shared.release()
+    assert released == [True]
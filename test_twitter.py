@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# coding=utf8
+import time
+
+import pytest
+
+import twitter
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://x.com/a/status/1', True),
+    ('https://mobile.twitter.com/a/status/1', True),
+    ('https://X.COM/a/status/1', True),
+    ('https://evil.com/a/status/1?u=x.com', False),
+    ('https://eviltwitter.com/a/status/1', False),
+    ('https://x.com.evil.com/a/status/1', False),
+    ('https://twitter.com@evil.com/a/status/1', False),
+    ('ftp://x.com/a/status/1', False),
+    ('x.com/a/status/1', False),
+])
+def test_is_twitter_url(url, expected):
+    assert twitter.is_twitter_url(url) is expected
+
+
+def test_tweet_id():
+    assert twitter.tweet_id('https://x.com/a/status/123?s=20') == '123'
+    assert twitter.tweet_id('https://twitter.com/i/web/statuses/456') == '456'
+    assert twitter.tweet_id('https://x.com/a') is None
+
+
+def test_rank_variants_prefers_highest_bitrate_within_limit():
+    formats = [
+        {'format_id': 'hls', 'url': 'u', 'tbr': 2000, 'protocol': 'm3u8_native'},
+        {'format_id': 'low', 'url': 'u', 'tbr': 950, 'protocol': 'https'},
+        {'format_id': 'high', 'url': 'u', 'tbr': 2000, 'protocol': 'https'},
+        {'format_id': 'audio', 'url': 'u', 'tbr': 128, 'vcodec': 'none'},
+    ]
+    ranked = [f['format_id'] for f, _ in twitter.rank_variants(formats, 8, None)]
+    assert ranked == ['high', 'hls', 'low']
+    # 都超出上限时选择最小的
+    ranked = [f['format_id'] for f, _ in twitter.rank_variants(formats, 8, 500 * 1000)]
+    assert ranked[0] == 'low'
+
+
+def test_url_expiry():
+    now = time.time()
+    assert twitter.url_expiry(f"https://video.twimg.com/a.mp4?expires={int(now) + 600}", now) == int(now) + 600
+    assert twitter.url_expiry('https://video.twimg.com/a.mp4?e=12', now) is None
+    assert twitter.url_expiry('https://video.twimg.com/a.mp4', now) is None
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+输出变体：在服务端用 ffmpeg 转换下载结果
+
+- audio-m4a / audio-mp3：只输出音频，只需要音频流
+- remux：重新封装为 faststart 的 mp4，不重新编码
+- 480p：缩放到 480p 并重新编码
+任意配置都可以加上 start/end 截取片段，截取时 ffmpeg 直接按时间定位源地址，只读取需要的字节范围
+"""
+import re
+import subprocess
+
+from yt_dlp.utils import parse_duration
+
+
+class OutputProfile:
+    """
+    name: 配置名称
+    ext / mimetype: 输出文件的扩展名和 MIME 类型
+    audio_only: 只需要音频流
+    video_args / audio_args: ffmpeg 编码参数；audio_copy_args 为音频编码已经符合要求时的参数
+    """
+    __slots__ = ('name', 'ext', 'mimetype', 'audio_only', 'video_args', 'audio_args', 'audio_copy_args')
+
+    def __init__(self, name, ext, mimetype, audio_only=False, video_args=(), audio_args=(),
+                 audio_copy_args=None):
+        self.name = name
+        self.ext = ext
+        self.mimetype = mimetype
+        self.audio_only = audio_only
+        self.video_args = list(video_args)
+        self.audio_args = list(audio_args)
+        self.audio_copy_args = list(audio_copy_args) if audio_copy_args is not None else None
+
+
+PROFILES = {
+    'remux': OutputProfile('remux', 'mp4', 'video/mp4', video_args=['-c:v', 'copy'], audio_args=['-c:a', 'copy']),
+    'audio-m4a': OutputProfile('audio-m4a', 'm4a', 'audio/mp4', audio_only=True,
+                               audio_args=['-c:a', 'aac', '-b:a', '192k'], audio_copy_args=['-c:a', 'copy']),
+    'audio-mp3': OutputProfile('audio-mp3', 'mp3', 'audio/mpeg', audio_only=True,
+                               audio_args=['-c:a', 'libmp3lame', '-b:a', '192k']),
+    '480p': OutputProfile('480p', 'mp4', 'video/mp4',
+                          video_args=['-vf', "scale=-2:'min(480,ih)'", '-c:v', 'libx264',
+                                      '-preset', 'veryfast', '-crf', '23'],
+                          audio_args=['-c:a', 'aac', '-b:a', '128k']),
+}
+
+
+class Variant:
+    """一个输出变体：配置加可选的截取区间（秒）"""
+    __slots__ = ('profile', 'start', 'end')
+
+    def __init__(self, profile, start=None, end=None):
+        self.profile = profile
+        self.start = start
+        self.end = end
+
+    @property
+    def trimmed(self):
+        return self.start is not None or self.end is not None
+
+    @property
+    def key(self):
+        """缓存中区分变体的字符串"""
+        if not self.trimmed:
+            return self.profile.name
+        return f"{self.profile.name}@{self.start or 0:g}-{'' if self.end is None else f'{self.end:g}'}"
+
+    def filename(self, video_id):
+        return f"{video_id}-{re.sub(r'[^0-9A-Za-z.@-]', '_', self.key)}.{self.profile.ext}"
+
+
+def _parse_time(value, name):
+    if value in (None, ''):
+        return None
+    seconds = parse_duration(str(value))
+    if seconds is None or seconds < 0:
+        raise ValueError(f"{name} 参数无效: {value}")
+    return float(seconds)
+
+
+def parse_variant(profile_name, start=None, end=None):
+    """
+    解析 profile/start/end 参数，都未指定时返回 None；只指定截取区间时使用 remux
+    start/end 支持秒数或 hh:mm:ss，参数非法时抛出 ValueError
+    """
+    start = _parse_time(start, 'start')
+    end = _parse_time(end, 'end')
+    if not profile_name and start is None and end is None:
+        return None
+    profile = PROFILES.get(profile_name or 'remux')
+    if profile is None:
+        raise ValueError(f"未知的输出配置: {profile_name}，可选: {', '.join(PROFILES)}")
+    if start is not None and end is not None and end <= start:
+        raise ValueError("end 必须大于 start")
+    return Variant(profile, start, end)
+
+
+def variant_format(format_str, variant):
+    """媒体缓存按 (视频ID, 格式字符串) 寻址，变体附加在格式字符串后面"""
+    return f"{format_str}#{variant.key}"
+
+
+def ffmpeg_command(inputs, variant, output_path, audio_copy=False):
+    """
+    inputs: [(地址或本地路径, HTTP 请求头 dict, 包含的流 'video'/'audio'/'av')]
+    audio_copy: 源音频编码已符合输出要求，可以直接复制
+    """
+    profile = variant.profile
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-y']
+    for source, headers, _ in inputs:
+        header_lines = ''.join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+        if header_lines:
+            cmd += ['-headers', header_lines]
+        if variant.start:
+            # 放在 -i 前面按输入定位，远程文件通过 Range 请求跳到对应位置
+            cmd += ['-ss', f"{variant.start:g}"]
+        cmd += ['-i', source]
+    if variant.end is not None:
+        cmd += ['-t', f"{variant.end - (variant.start or 0):g}"]
+
+    video_index = next((i for i, (_, _, kind) in enumerate(inputs) if kind in ('video', 'av')), None)
+    # 分离的音视频中音频在后面，合一格式或本地合并文件中取同一个输入
+    audio_inputs = [i for i, (_, _, kind) in enumerate(inputs) if kind in ('audio', 'av')]
+    audio_index = audio_inputs[-1] if audio_inputs else None
+    if not profile.audio_only and video_index is not None:
+        cmd += ['-map', f"{video_index}:v:0"] + profile.video_args
+    else:
+        cmd += ['-vn']
+    if audio_index is not None:
+        cmd += ['-map', f"{audio_index}:a:0?"]
+        cmd += profile.audio_copy_args if audio_copy and profile.audio_copy_args is not None else profile.audio_args
+    if profile.ext in ('mp4', 'm4a'):
+        cmd += ['-movflags', '+faststart']
+    cmd += [output_path]
+    return cmd
+
+
+def run_ffmpeg(cmd):
+    """执行 ffmpeg，失败时抛出 RuntimeError"""
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        error = proc.stderr.decode('utf-8', 'replace').strip()
+        raise RuntimeError(f"ffmpeg 返回码 {proc.returncode}: {error}")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding=utf8
+"""进行中的文件传输：每个传输独立记录状态，线程安全的注册表供 /stats 查询"""
+import itertools
+import threading
+import time
+
+from tqdm import tqdm
+
+
+class Transfer:
+    """单次文件传输的状态，total_bytes 为 None 表示长度未知（边下载边发送）"""
+    __slots__ = ('id', 'video_id', 'request_path', 'mode', 'total_bytes', 'bytes_sent',
+                 'started_at', 'finished_at', 'completed', 'progress_bar')
+
+    def __init__(self, transfer_id, video_id, request_path, mode, total_bytes):
+        self.id = transfer_id
+        self.video_id = video_id
+        self.request_path = request_path
+        self.mode = mode
+        self.total_bytes = total_bytes
+        self.bytes_sent = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.completed = False
+        self.progress_bar = None
+
+    def add(self, n):
+        self.bytes_sent += n
+        if self.progress_bar is not None:
+            self.progress_bar.update(n)
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def rate(self):
+        """平均速度，字节/秒"""
+        elapsed = self.elapsed
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def close_progress_bar(self):
+        if self.progress_bar is not None:
+            self.progress_bar.close()
+            self.progress_bar = None
+
+    def to_dict(self):
+        return {
+            'transfer_id': self.id,
+            'id': self.video_id,
+            'path': self.request_path,
+            'mode': self.mode,
+            'total_bytes': self.total_bytes,
+            'bytes_sent': self.bytes_sent,
+            'rate': round(self.rate, 1),
+            'elapsed': round(self.elapsed, 3),
+        }
+
+
+class TransferRegistry:
+    """
+    show_progress 为 True 时为每个已知长度的传输创建独立的 tqdm 进度条，
+    高并发下终端输出会成为瓶颈，可以关闭；progress_interval 为进度条最短刷新间隔（秒）
+    on_finish(transfer) 在传输结束时调用，用于统计指标
+    """
+
+    def __init__(self, show_progress=True, on_finish=None, progress_interval=0.1):
+        self.show_progress = show_progress
+        self.progress_interval = progress_interval
+        self.on_finish = on_finish
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._active = {}
+
+    def start(self, video_id, request_path, mode, total_bytes=None):
+        with self._lock:
+            transfer = Transfer(next(self._ids), video_id, request_path, mode, total_bytes)
+            self._active[transfer.id] = transfer
+        if self.show_progress and total_bytes and mode == 'stream':
+            transfer.progress_bar = tqdm(
+                total=total_bytes,
+                unit='B',
+                unit_scale=True,
+                ascii=True,  # 改用 ASCII 字符而不是 Unicode
+                ncols=90,
+                mininterval=self.progress_interval,
+                desc=f"传输进度 [{video_id}#{transfer.id}]",
+                leave=True,
+                bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} ({rate_fmt}) [{elapsed}]'
+            )
+        return transfer
+
+    def finish(self, transfer, completed):
+        transfer.completed = completed
+        transfer.finished_at = time.time()
+        transfer.close_progress_bar()
+        with self._lock:
+            self._active.pop(transfer.id, None)
+        if self.on_finish:
+            self.on_finish(transfer)
+
+    def active(self):
+        with self._lock:
+            return list(self._active.values())
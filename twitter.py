@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+推特视频：按码率和大小上限选择变体，通过连接池代理下载
+
+- 在大小上限内选择码率最高的变体，码率相同时优先 MP4；都超出上限时选择最小的
+- MP4 变体直接代理，透传 Range 等请求头，客户端可以拖动和断点续传
+- 只有 HLS 变体时由 ffmpeg 实时封装（见 live_stream.py）
+- CDN 地址带有签名，按地址中的过期时间缓存
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 64 * 1024
+
+TWITTER_DOMAINS = ('twitter.com', 'x.com')
+
+_TWEET_ID_PATTERN = re.compile(r'/status(?:es)?/(\d+)')
+
+# CDN 地址中可能表示过期时间（Unix 时间戳）的查询参数
+_EXPIRY_PARAMS = ('expires', 'expire', 'Expires', 'exp', 'e')
+# 距离过期不足这么多秒的地址不再使用
+EXPIRY_MARGIN = 30
+
+# 代理时透传给 CDN 的请求头和返回给客户端的响应头
+FORWARD_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+FORWARD_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
+
+def is_twitter_url(url):
+    """http(s) 地址且主机为 twitter.com / x.com 或它们的子域名"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if parsed.scheme not in ('http', 'https'):
+        return False
+    return any(host == domain or host.endswith(f".{domain}") for domain in TWITTER_DOMAINS)
+
+
+def tweet_id(url):
+    """推文ID，URL 中没有 /status/<ID> 时返回 None"""
+    match = _TWEET_ID_PATTERN.search(urlparse(url).path)
+    return match.group(1) if match else None
+
+
+class TwitterVariant:
+    """
+    选中的变体
+    format: yt-dlp 的格式 dict，HLS 变体交给 live_stream.stream_formats
+    size: 文件大小或按码率估算的大小（字节），未知时为 None
+    """
+    __slots__ = ('tweet_id', 'format', 'size', 'expires_at')
+
+    def __init__(self, tweet_id, f, size, expires_at=None):
+        self.tweet_id = tweet_id
+        self.format = f
+        self.size = size
+        self.expires_at = expires_at
+
+    @property
+    def url(self):
+        return self.format['url']
+
+    @property
+    def format_id(self):
+        return self.format.get('format_id')
+
+    @property
+    def tbr(self):
+        return self.format.get('tbr')
+
+    @property
+    def hls(self):
+        return str(self.format.get('protocol', '')).startswith('m3u8')
+
+
+def variant_size(f, duration):
+    size = f.get('filesize') or f.get('filesize_approx')
+    if not size and f.get('tbr') and duration:
+        size = int(f['tbr'] * 1000 / 8 * duration)
+    return size or None
+
+
+def rank_variants(formats, duration, max_bytes):
+    """
+    返回 [(格式, 大小)]，最优的在前
+    只考虑带视频和音频的格式（编码未知的 MP4 变体视为都有）；大小未知的视为在上限内
+    """
+    candidates = [(f, variant_size(f, duration)) for f in formats
+                  if f.get('url') and f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+
+    def key(item):
+        f, size = item
+        within = size is None or not max_bytes or size <= max_bytes
+        if within:
+            # 码率高的在前，相同码率 MP4 在前
+            return (0, -(f.get('tbr') or 0), str(f.get('protocol', '')).startswith('m3u8'))
+        return (1, size, 0)
+
+    return sorted(candidates, key=key)
+
+
+def url_expiry(url, now=None):
+    """CDN 地址中的过期时间（Unix 时间戳），没有时返回 None"""
+    now = now or time.time()
+    query = parse_qs(urlparse(url).query)
+    for name in _EXPIRY_PARAMS:
+        for value in query.get(name, ()):
+            try:
+                expires_at = float(value)
+            except ValueError:
+                continue
+            # 排除明显不是时间戳的值
+            if now - 86400 < expires_at < now + 365 * 86400:
+                return expires_at
+    return None
+
+
+def select_variant(info, url, max_bytes):
+    """从 info dict 选择变体，没有可用格式时抛出 LookupError"""
+    ranked = rank_variants(info.get('formats') or [], info.get('duration'), max_bytes)
+    if not ranked:
+        raise LookupError(url)
+    f, size = ranked[0]
+    return TwitterVariant(tweet_id(url) or info.get('id'), f, size, url_expiry(f['url']))
+
+
+class HitCounter:
+    """统计每个 key 在 window 秒内的访问次数，最多跟踪 max_keys 个 key"""
+
+    def __init__(self, window, max_keys=10000):
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._hits = OrderedDict()
+
+    def record(self, key):
+        """记录一次访问并返回窗口内的访问次数"""
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+                while len(self._hits) > self.max_keys:
+                    self._hits.popitem(last=False)
+            self._hits.move_to_end(key)
+            hits.append(now)
+            while hits and now - hits[0] > self.window:
+                hits.popleft()
+            return len(hits)
+
+
+class UpstreamError(Exception):
+    """CDN 返回错误状态码，status 为状态码"""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+    @property
+    def expired(self):
+        """签名地址失效时 CDN 返回 403/404/410，需要重新解析"""
+        return self.status in (403, 404, 410)
+
+
+class TwitterClient:
+    """共享连接池的 HTTP 客户端，pool_size 为每个 CDN 主机保持的连接数"""
+
+    def __init__(self, pool_size, timeout=30):
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def open(self, variant, request_headers=None):
+        """
+        打开 CDN 响应，request_headers 中的 Range 等请求头原样透传
+        返回流式的 requests.Response，使用完毕后必须 close；错误状态码抛出 UpstreamError
+        """
+        headers = dict(variant.format.get('http_headers') or {})
+        for name in FORWARD_REQUEST_HEADERS:
+            value = (request_headers or {}).get(name)
+            if value:
+                headers[name] = value
+        response = self._session.get(variant.url, headers=headers, stream=True, timeout=self.timeout)
+        # 304 和 416 是对透传的条件请求和 Range 的正常回应
+        if response.status_code >= 400 and response.status_code != 416:
+            response.close()
+            raise UpstreamError(response.status_code)
+        return response
+
+    def download(self, variant, path):
+        """下载完整文件到 path，返回字节数"""
+        written = 0
+        with self.open(variant) as response, open(path, 'wb') as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+
+def response_headers(upstream):
+    """需要返回给客户端的 CDN 响应头"""
+    return {name: upstream.headers[name] for name in FORWARD_RESPONSE_HEADERS if name in upstream.headers}
+
+
+def iter_upstream(upstream):
+    """逐块读取 CDN 响应，结束或客户端断开时关闭连接（归还连接池）"""
+    try:
+        for chunk in upstream.iter_content(CHUNK_SIZE):
+            yield chunk
+    finally:
+        upstream.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# coding=utf8
+"""
+按配置档分组的 YoutubeDL 实例池
+
+复用实例可以保留 cookies 解析结果、提取器状态（播放器 JS / 签名缓存）和 HTTP 长连接。
+实例同一时间只归一个线程使用；cookies 文件修改后旧实例会被淘汰，新实例重新加载。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import yt_dlp
+
+logger = logging.getLogger('youtube.ydl_pool')
+
+# cookies 文件 mtime 的检查间隔（秒）
+COOKIE_CHECK_INTERVAL = 1.0
+
+
+class _Pooled:
+    __slots__ = ('ydl', 'profile', 'generation', 'created_at')
+
+    def __init__(self, ydl, profile, generation):
+        self.ydl = ydl
+        self.profile = profile
+        self.generation = generation
+        self.created_at = time.monotonic()
+
+
+class YDLPool:
+    """
+    profiles: {配置档名称: ydl_opts}
+    size: 每个配置档最多保留的空闲实例数
+    max_age: 实例最长使用时间（秒），到期后关闭并保存 cookies
+    """
+
+    def __init__(self, profiles, size=8, max_age=1800, cookiefile='cookies.txt'):
+        self.profiles = profiles
+        self.size = size
+        self.max_age = max_age
+        self.cookiefile = cookiefile
+        self._idle = {name: queue.LifoQueue() for name in profiles}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._cookie_mtime = self._read_cookie_mtime()
+        self._cookie_checked_at = time.monotonic()
+        self.created = 0
+        self.reused = 0
+
+    def _read_cookie_mtime(self):
+        try:
+            return os.stat(self.cookiefile).st_mtime_ns
+        except OSError:
+            return None
+
+    def _check_cookies(self):
+        now = time.monotonic()
+        if now - self._cookie_checked_at < COOKIE_CHECK_INTERVAL:
+            return
+        self._cookie_checked_at = now
+        mtime = self._read_cookie_mtime()
+        with self._lock:
+            if mtime != self._cookie_mtime:
+                self._cookie_mtime = mtime
+                self._generation += 1
+                logger.info(f"{self.cookiefile} 已更新，重新创建 YoutubeDL 实例")
+
+    def _create(self, profile):
+        ydl = yt_dlp.YoutubeDL(dict(self.profiles[profile]))
+        self.created += 1
+        return _Pooled(ydl, profile, self._generation)
+
+    def warm(self, count=1):
+        """预先为每个配置档创建 count 个实例"""
+        for profile, idle in self._idle.items():
+            for _ in range(min(count, self.size) - idle.qsize()):
+                idle.put(self._create(profile))
+        logger.info(f"YoutubeDL 实例池已预热 - 配置档: {', '.join(self.profiles)} | 每个: {count}")
+
+    def _retire(self, pooled, save_cookies):
+        ydl = pooled.ydl
+        if not save_cookies:
+            # cookies 文件已被外部替换，不能用旧的 cookies 覆盖
+            ydl.params['cookiefile'] = None
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.warning(f"关闭 YoutubeDL 实例失败 - 错误: {str(e)}")
+        if save_cookies and ydl.params.get('cookiefile'):
+            # 自己保存 cookies 导致的 mtime 变化不需要触发重新加载
+            with self._lock:
+                if pooled.generation == self._generation:
+                    self._cookie_mtime = self._read_cookie_mtime()
+
+    @contextmanager
+    def acquire(self, profile, **overrides):
+        """
+        取出一个实例，overrides 覆盖本次使用的参数，退出时恢复
+        支持 format、outtmpl、progress_hooks 以及其他普通参数
+        """
+        self._check_cookies()
+        idle = self._idle[profile]
+        pooled = None
+        while pooled is None:
+            try:
+                candidate = idle.get_nowait()
+            except queue.Empty:
+                pooled = self._create(profile)
+                break
+            if candidate.generation != self._generation:
+                self._retire(candidate, save_cookies=False)
+                continue
+            pooled = candidate
+            self.reused += 1
+
+        ydl = pooled.ydl
+        saved = self._apply(ydl, overrides)
+        ok = False
+        try:
+            yield ydl
+            ok = True
+        finally:
+            self._restore(ydl, saved)
+            self._release(pooled, ok)
+
+    def _release(self, pooled, ok):
+        if pooled.generation != self._generation:
+            self._retire(pooled, save_cookies=False)
+        elif time.monotonic() - pooled.created_at > self.max_age or not ok:
+            # 出错的实例可能处于异常状态，不再复用
+            self._retire(pooled, save_cookies=ok)
+        elif self._idle[pooled.profile].qsize() >= self.size:
+            self._retire(pooled, save_cookies=True)
+        else:
+            self._idle[pooled.profile].put(pooled)
+
+    @staticmethod
+    def _apply(ydl, overrides):
+        saved = {
+            'params': {k: ydl.params.get(k) for k in overrides if k != 'progress_hooks'},
+            'progress_hooks': ydl._progress_hooks,
+            'format_selector': ydl.format_selector,
+        }
+        ydl._download_retcode = 0
+        for key, value in overrides.items():
+            if key == 'progress_hooks':
+                ydl._progress_hooks = list(value)
+            elif key == 'outtmpl' and not isinstance(value, dict):
+                ydl.params['outtmpl'] = dict(ydl.params['outtmpl'], default=value)
+            else:
+                ydl.params[key] = value
+            if key == 'format':
+                # 格式选择器在 YoutubeDL 初始化时生成，修改 format 后需要重建
+                ydl.format_selector = ydl.build_format_selector(value)
+        return saved
+
+    @staticmethod
+    def _restore(ydl, saved):
+        ydl.params.update(saved['params'])
+        ydl._progress_hooks = saved['progress_hooks']
+        ydl.format_selector = saved['format_selector']
+
+    def stats(self):
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'generation': self._generation,
+            'idle': {name: idle.qsize() for name, idle in self._idle.items()},
+        }
+
+    def close(self):
+        for idle in self._idle.values():
+            while True:
+                try:
+                    pooled = idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._retire(pooled, save_cookies=pooled.generation == self._generation)